@@ -0,0 +1,82 @@
+import os
+
+import pandas
+
+import prepare_data
+
+# Every count-based figure is a roll-up of these keys. Result_Type_Bin is derived from Result_Type, so including it does
+# not add any cell to the cube.
+CUBE_KEYS = ['Date', 'SKU', 'Block_Num', 'Block_Position', 'Zone1Position', 'Zone2Position', 'Zone3Position',
+             'Result_Type', 'Result_Type_Bin']
+CUBE_VALUES = ['Count', 'Value']
+
+
+def build_cube(data, costs, keys=CUBE_KEYS):
+    # Count products and sum their value per combination of keys
+    cube = data[keys].copy()
+    cube['Count'] = 1
+    cube['Value'] = costs.Value.reindex(data.SKU.astype('object')).to_numpy()
+    return sum_by(cube, keys)
+
+
+def merge_cubes(cube, new_cube, keys=CUBE_KEYS):
+    # Counts and values are additive, so merging only touches the (small) cubes, never the rows
+    cubes = [new_cube] if cube is None else [cube, new_cube]
+    return sum_by(pandas.concat(cubes, ignore_index=True, sort=False), keys)
+
+
+def sum_by(data, keys):
+    """Sum all non-key columns per combination of keys. Missing key values are kept as a group of their own, where
+       groupby would silently drop e.g. the products without an imputed zone position."""
+    keys_as_categories = {key: pandas.Categorical(data[key]) for key in keys}
+    sums = pandas.DataFrame({key: cat.codes for key, cat in keys_as_categories.items()})
+    for col in data.columns.difference(keys):
+        sums[col] = data[col].to_numpy()
+    sums = sums.groupby(keys, sort=False).sum().reset_index()
+
+    for key, cat in keys_as_categories.items():
+        sums[key] = pandas.Categorical.from_codes(sums[key], dtype=cat.dtype)
+        if not isinstance(data[key].dtype, pandas.CategoricalDtype):
+            sums[key] = sums[key].astype(data[key].dtype)
+    return sums
+
+
+def is_cube(data):
+    return set(data.columns) == set(CUBE_KEYS + CUBE_VALUES)
+
+
+def count_by(data, keys):
+    # Number of products per combination of keys, from either the row-level data or a (filtered) cube. Every category
+    # level is kept, with a count of 0 if no product has it.
+    if is_cube(data):
+        return data.groupby(keys, observed=False).Count.sum()
+    return data.groupby(keys, observed=False).size()
+
+
+def with_value(data, costs):
+    # Row-level data or a cube, with the value of the products in a Value column
+    if is_cube(data):
+        return data
+    return data.join(costs, on='SKU')
+
+
+def get_cube_file():
+    # Keyed on the prepared data (whose cache file name encodes the source and preparation code), the costs and the
+    # code of this module
+    key = '{}_{}_{}'.format(os.path.splitext(os.path.basename(prepare_data.get_cache_file()))[0],
+                            prepare_data.get_file_hash(os.path.join('data', 'Costs.xlsx'))[:16],
+                            prepare_data.get_file_hash(__file__)[:16])
+    return os.path.join(prepare_data.CACHE_DIR, 'cube_{}.parquet'.format(key))
+
+
+def get_cube(use_cache=True):
+    """Return the aggregate cube of the prepared dataset, building and persisting it on first use."""
+    cube_file = get_cube_file()
+    if use_cache and os.path.exists(cube_file):
+        return pandas.read_parquet(cube_file)
+
+    cube = build_cube(prepare_data.get_prepared_data(), prepare_data.get_costs())
+    os.makedirs(os.path.dirname(cube_file), exist_ok=True)
+    cube.to_parquet(cube_file + '.tmp')
+    os.replace(cube_file + '.tmp', cube_file)
+    return cube
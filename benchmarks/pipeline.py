@@ -0,0 +1,248 @@
+# Time and measure the peak memory of each stage of the pipeline on generated datasets, and compare with the results
+# of another version. Run from the repository root: python -m benchmarks.pipeline --sizes 10K 1M
+import argparse
+import collections
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot
+import sklearn.ensemble
+
+import defect_monitor
+import defect_surfaces
+import feature_associations
+import feature_encoding
+import opportunity_trees
+import prepare_data
+import run_exploratory_analyses
+import synthetic_data
+import zone_path_sankey
+
+RESULTS_DIR = os.path.join('benchmarks', 'results')
+
+# A stage runs function on a copy (for functions that work in place) of an input: the data file or the result of an
+# earlier stage. Stages with keep store their result as input for later stages.
+Stage = collections.namedtuple('Stage', ['name', 'function', 'input', 'copy', 'keep'])
+
+
+def impute_data_zone1(data):
+    prepare_data.impute_data_zone1(data, verbose=False)
+
+
+def impute_data_zone2(data):
+    prepare_data.impute_data_zone2(data, verbose=False)
+
+
+def impute_data_zone3(data):
+    prepare_data.impute_data_zone3(data, verbose=False)
+
+
+def impute_zone_positions(data):
+    prepare_data.impute_zone_positions(data, verbose=False)
+
+
+def impute_data(data):
+    return prepare_data.impute_data(data, verbose=False)
+
+
+def balance_dataset(data):
+    return prepare_data.balance_dataset(data.dropna(), 'Result_Type')
+
+
+def encode_features(data):
+    encoder = feature_encoding.FeatureEncoder()
+    return encoder.fit_transform(data), data.Result_Type
+
+
+def make_forest_fit(n_estimators, n_jobs):
+    # Same forest as predict_defects.train, with fewer trees by default to keep large sizes practical
+    def fit_forest(encoded):
+        x, y = encoded
+        rf = sklearn.ensemble.RandomForestClassifier(n_estimators=n_estimators, oob_score=True, random_state=0,
+                                                     n_jobs=n_jobs)
+        return rf.fit(x, y)
+    return fit_forest
+
+
+def plot_var_by_SKU_and_result_type(data):
+    run_exploratory_analyses.plot_var_by_SKU_and_result_type(data, ['Zone1_Temp_Avg', 'Zone2_Temp_Avg'])
+
+
+def plot_var_by_date_and_SKU(data):
+    run_exploratory_analyses.plot_var_by_date_and_SKU(data, ['Zone1_Temp_Avg', 'Zone2_Temp_Avg'])
+
+
+def plot_defect_rates_by_date_and_SKU(data):
+    run_exploratory_analyses.plot_result_type_rates_by_date_and_SKU(data, opportunity_trees.DEFECTS)
+
+
+def render_sankey(data):
+    # The diagram of make_opportunity1_sankey, rendered without writing it to figures/
+    data = data[(data.SKU != 'A001') & (data.Result_Type == 'Defect_2')]
+    zone_cols = zone_path_sankey.get_zone_columns(data)
+    paths = zone_path_sankey.get_paths(data, zone_cols)
+    links = zone_path_sankey.get_links(paths, zone_cols)
+    return zone_path_sankey.render_svg(links, [zone_path_sankey.get_node_order(paths, col) for col in zone_cols],
+                                       [col.replace('Position', '') for col in zone_cols])
+
+
+def fit_opportunity_trees(data):
+    # The trees of the three opportunities, saved and rendered to a temporary directory rather than figures/
+    with tempfile.TemporaryDirectory() as output_dir:
+        return opportunity_trees.fit_opportunity_trees(data, n_jobs=1, output_dir=output_dir, model_dir=output_dir)
+
+
+def scan_interactions(data):
+    # The defect-rate surfaces of all pairs of sensor columns, for opportunity 1
+    data = data.iloc[opportunity_trees.get_rows(data, opportunity_trees.OPPORTUNITIES[0])]
+    return defect_surfaces.scan_interactions(data, data.Result_Type != 'PASS', n_jobs=1)
+
+
+def compute_association_matrix(data):
+    # The association matrix behind plot_correlation_among_features, which caches it
+    return feature_associations.compute_association_matrix(data, n_jobs=1)
+
+
+def monitor_defect_rates(data):
+    # Products streamed through the monitor one at a time, with baseline rates from the same data
+    return defect_monitor.DefectRateMonitor(defect_monitor.get_baseline_rates(data)).update_data(data)
+
+
+def get_stages(n_estimators=100, n_jobs=-1):
+    return [
+        Stage('read_data', prepare_data.read_data, 'path', False, 'raw'),
+        Stage('impute_data_zone1', impute_data_zone1, 'raw', True, None),
+        Stage('impute_data_zone2', impute_data_zone2, 'raw', True, None),
+        Stage('impute_data_zone3', impute_data_zone3, 'raw', True, None),
+        Stage('impute_zone_positions', impute_zone_positions, 'raw', True, None),
+        Stage('impute_data_duration', prepare_data.impute_data_duration, 'raw', True, None),
+        Stage('impute_data', impute_data, 'raw', True, 'prepared'),
+        Stage('balance_dataset', balance_dataset, 'prepared', False, 'balanced'),
+        Stage('encode_features', encode_features, 'balanced', False, 'encoded'),
+        Stage('fit_forest', make_forest_fit(n_estimators, n_jobs), 'encoded', False, None),
+        Stage('plot_var_by_SKU_and_result_type', plot_var_by_SKU_and_result_type, 'prepared', False, None),
+        Stage('plot_var_by_date_and_SKU', plot_var_by_date_and_SKU, 'prepared', False, None),
+        Stage('plot_defect_rates_by_date_and_SKU', plot_defect_rates_by_date_and_SKU, 'prepared', False, None),
+        Stage('render_sankey', render_sankey, 'prepared', False, None),
+        Stage('fit_opportunity_trees', fit_opportunity_trees, 'prepared', False, None),
+        Stage('scan_interactions', scan_interactions, 'prepared', False, None),
+        Stage('compute_association_matrix', compute_association_matrix, 'prepared', False, None),
+        Stage('monitor_defect_rates', monitor_defect_rates, 'prepared', False, None),
+    ]
+
+
+def run_stage(stage, inputs, repeat):
+    """Return the result of stage with its best wall time over repeat runs and the peak memory allocated (by Python
+       objects and numpy arrays) during one more run, traced separately as tracing slows down the code."""
+    timings = []
+    for _ in range(repeat):
+        data = inputs[stage.input].copy() if stage.copy else inputs[stage.input]
+        start = time.perf_counter()
+        result = stage.function(data)
+        timings.append(time.perf_counter() - start)
+        matplotlib.pyplot.close('all')
+    del result
+
+    data = inputs[stage.input].copy() if stage.copy else inputs[stage.input]
+    tracemalloc.start()
+    result = stage.function(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    matplotlib.pyplot.close('all')
+    return result, {'seconds': min(timings), 'peak_mb': peak / 2**20}
+
+
+def run_benchmarks(sizes, stages, repeat=3):
+    # Returns a dict of size -> stage name -> {seconds, peak_mb}
+    results = {}
+    for size in sizes:
+        path = synthetic_data.get_data_file(size)
+        if not os.path.exists(path):
+            print('Generating {}'.format(path))
+            synthetic_data.write_data(path, synthetic_data.SIZES[size])
+
+        inputs = {'path': path}
+        results[size] = {}
+        for stage in stages:
+            result, results[size][stage.name] = run_stage(stage, inputs, repeat)
+            if stage.keep:
+                inputs[stage.keep] = result
+            print('{:>4} {:<35} {seconds:10.3f}s {peak_mb:10.1f}MB'.format(
+                size, stage.name, **results[size][stage.name]))
+    return results
+
+
+def get_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def get_results_file(version):
+    return os.path.join(RESULTS_DIR, '{}.json'.format(version))
+
+
+def save_results(results, version):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(get_results_file(version), 'w') as f:
+        json.dump({'version': version, 'python': platform.python_version(), 'machine': platform.platform(),
+                   'results': results}, f, indent=2, sort_keys=True)
+
+
+def load_results(version):
+    with open(get_results_file(version)) as f:
+        return json.load(f)['results']
+
+
+def compare_results(results, baseline, threshold=1.2):
+    """Print the ratio of each measurement to baseline and return the measurements more than threshold times worse."""
+    regressions = []
+    for size, stages in sorted(results.items()):
+        for name, measures in stages.items():
+            base = baseline.get(size, {}).get(name)
+            if base is None:
+                continue
+            ratios = {key: measures[key] / base[key] if base[key] else float('nan') for key in ('seconds', 'peak_mb')}
+            flag = ''
+            if any(ratio > threshold for ratio in ratios.values()):
+                regressions.append((size, name))
+                flag = 'REGRESSION'
+            print('{:>4} {:<35} time x{seconds:6.2f} memory x{peak_mb:6.2f} {}'.format(size, name, flag, **ratios))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on generated datasets.')
+    parser.add_argument('--sizes', nargs='+', default=['10K'], choices=list(synthetic_data.SIZES))
+    parser.add_argument('--stages', nargs='+', help='Only run these stages (and the stages they depend on).')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--n-estimators', type=int, default=100)
+    parser.add_argument('--jobs', type=int, default=-1)
+    parser.add_argument('--version', default=get_version(), help='Store the results under this name.')
+    parser.add_argument('--compare', help='Compare with the stored results of this version.')
+    parser.add_argument('--threshold', type=float, default=1.2, help='Ratio above which a change is a regression.')
+    args = parser.parse_args()
+
+    stages = get_stages(args.n_estimators, args.jobs)
+    if args.stages:
+        kept = {stage.keep: stage for stage in stages if stage.keep}
+        needed = set(args.stages)
+        for stage in reversed(stages):
+            if stage.name in needed and stage.input in kept:
+                needed.add(kept[stage.input].name)
+        stages = [stage for stage in stages if stage.name in needed]
+
+    results = run_benchmarks(args.sizes, stages, args.repeat)
+    save_results(results, args.version)
+    if args.compare:
+        if compare_results(results, load_results(args.compare), args.threshold):
+            sys.exit(1)
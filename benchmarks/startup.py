@@ -0,0 +1,48 @@
+# Measure the startup time of each subcommand of cli.py, up to parsing its arguments (--help), and the heavy libraries
+# it imports. Run from the repository root: python -m benchmarks.startup
+import argparse
+import subprocess
+import sys
+import time
+
+import cli
+
+# Subcommands expected to start without importing the plotting and modelling libraries
+LIGHT_COMMANDS = ['prepare', 'train', 'score', 'sankey', 'monitor', 'scan', 'tune']
+HEAVY_MODULES = ['matplotlib', 'seaborn', 'statsmodels', 'sklearn', 'graphviz', 'scipy', 'pyarrow', 'joblib']
+
+IMPORTED = 'import sys, cli; cli.get_parser({!r}); print(" ".join(sorted(m for m in {!r} if m in sys.modules)))'
+
+
+def time_startup(args, repeat):
+    # Best wall time of running cli.py with args in a fresh interpreter
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, 'cli.py'] + args, stdout=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def get_heavy_imports(command):
+    return subprocess.check_output([sys.executable, '-c', IMPORTED.format(command, HEAVY_MODULES)],
+                                   universal_newlines=True).split()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the startup time of the subcommands of cli.py.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, help='Exit with an error if a light subcommand is slower.')
+    args = parser.parse_args()
+
+    baseline = time_startup(['--help'], args.repeat)
+    print('{:<10} {:6.3f}s'.format('(none)', baseline))
+    too_slow = []
+    for command in cli.COMMANDS:
+        seconds = time_startup([command, '--help'], args.repeat)
+        heavy = get_heavy_imports(command)
+        print('{:<10} {:6.3f}s {}'.format(command, seconds, ' '.join(heavy)))
+        if args.max_seconds is not None and command in LIGHT_COMMANDS and seconds > args.max_seconds:
+            too_slow.append(command)
+    if too_slow:
+        sys.exit('Startup slower than {}s: {}'.format(args.max_seconds, ', '.join(too_slow)))
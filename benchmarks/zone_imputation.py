@@ -0,0 +1,44 @@
+# Compare the table-driven zone imputation with the original per-rule functions.
+# Run from the repository root: python -m benchmarks.zone_imputation
+import argparse
+import time
+
+import prepare_data
+
+
+def impute_per_rule(data):
+    prepare_data.impute_data_zone1(data, verbose=False)
+    prepare_data.impute_data_zone2(data, verbose=False)
+    prepare_data.impute_data_zone3(data, verbose=False)
+
+
+def impute_table_driven(data):
+    prepare_data.impute_zone_positions(data, verbose=False)
+
+
+def time_imputation(impute, data, repeat):
+    # Best of repeat runs, each on a fresh copy as imputation works in place
+    timings = []
+    for _ in range(repeat):
+        data_copy = data.copy()
+        start = time.perf_counter()
+        impute(data_copy)
+        timings.append(time.perf_counter() - start)
+    return min(timings), data_copy
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark zone position imputation.")
+    parser.add_argument('--path', default=prepare_data.DATA_FILE)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    data = prepare_data.read_data(args.path)
+    per_rule_time, per_rule_data = time_imputation(impute_per_rule, data, args.repeat)
+    table_time, table_data = time_imputation(impute_table_driven, data, args.repeat)
+
+    assert table_data.equals(per_rule_data), 'Table-driven imputation differs from the per-rule functions'
+    print('{} rows'.format(len(data)))
+    print('per-rule:     {:.4f}s'.format(per_rule_time))
+    print('table-driven: {:.4f}s'.format(table_time))
+    print('speedup:      {:.1f}x'.format(per_rule_time / table_time))
@@ -0,0 +1,209 @@
+import ast
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import inspect
+import json
+import os
+import time
+
+import matplotlib
+import pandas
+
+import aggregate_cube
+import instrumentation
+import partitioned_store
+import prepare_data
+
+STATE_FILE = os.path.join('figures', '.build_state.json')
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# A figure to build:
+# - function is called with the inputs named in inputs (see get_input) followed by args;
+# - outputs are the files the task produces. With save=True the runner saves the current figure to each of them,
+#   otherwise the function is expected to write them itself;
+# - requires names tasks that have to be built first.
+Task = collections.namedtuple('Task', ['name', 'function', 'args', 'outputs', 'inputs', 'requires', 'save'])
+Task.__new__.__defaults__ = ((), (), ('data',), (), True)
+
+# Inputs shared by the tasks, loaded at most once per worker process
+_inputs = {}
+_input_loaders = {}
+
+
+def init_worker(cache_file, cube_file, dataset_dir, trace=False):
+    matplotlib.use('Agg')
+    # Forked workers inherit the events already recorded by the parent, which keeps them itself
+    instrumentation.disable()
+    if trace:
+        instrumentation.enable()
+    _input_loaders['data'] = lambda: prepare_data.read_cache(cache_file)
+    _input_loaders['cube'] = lambda: pandas.read_parquet(cube_file)
+    # Tasks given the partitioned dataset load the partitions and columns they need themselves
+    _input_loaders['dataset'] = lambda: dataset_dir
+    _input_loaders['costs'] = prepare_data.get_costs
+
+
+def get_input(name):
+    if name not in _inputs:
+        _inputs[name] = _input_loaders[name]()
+    return _inputs[name]
+
+
+def run_task(task):
+    # Returns the wall time of the task and the trace events it recorded, if tracing
+    import matplotlib.pyplot
+
+    start = time.perf_counter()
+    matplotlib.pyplot.close('all')
+    inputs = [get_input(name) for name in task.inputs]
+    with instrumentation.stage(task.name, inputs[0] if inputs else None):
+        task.function(*inputs, *task.args)
+    if task.save:
+        for output in task.outputs:
+            with instrumentation.stage('savefig', path=output):
+                matplotlib.pyplot.savefig(output)
+    matplotlib.pyplot.close('all')
+    return time.perf_counter() - start, instrumentation.pop_events() if instrumentation.is_enabled() else []
+
+
+def get_input_fingerprints(cache_file, cube_file, dataset_dir):
+    # The names of the cache files already encode the hashes of the source data and of the code producing them
+    return {
+        'data': os.path.basename(cache_file),
+        'cube': os.path.basename(cube_file),
+        'dataset': os.path.basename(dataset_dir),
+        'costs': prepare_data.get_file_hash(os.path.join('data', 'Costs.xlsx')),
+    }
+
+
+def get_local_imports(path):
+    # Project modules imported anywhere in the module at path, including the imports inside functions
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module.split('.')[0])
+    paths = [os.path.join(PROJECT_DIR, name + '.py') for name in names]
+    return [path for path in paths if os.path.exists(path)]
+
+
+@functools.lru_cache(maxsize=None)
+def get_code_hash(path):
+    """Hash of the source of the module at path and of all the project modules it imports, directly or not, so that
+       a change to any helper module a figure function delegates to rebuilds the figure."""
+    paths, todo = set(), [os.path.abspath(path)]
+    while todo:
+        path = todo.pop()
+        if path not in paths:
+            paths.add(path)
+            todo += get_local_imports(path)
+    sha = hashlib.sha256()
+    for path in sorted(paths):
+        sha.update('{} {}'.format(os.path.basename(path), prepare_data.get_file_hash(path)).encode())
+    return sha.hexdigest()
+
+
+def get_task_fingerprint(task, input_fingerprints, task_fingerprints):
+    sha = hashlib.sha256()
+    sha.update(get_code_hash(inspect.getsourcefile(task.function)).encode())
+    sha.update(repr((task.args, task.outputs, task.save)).encode())
+    for name in task.inputs:
+        sha.update(input_fingerprints[name].encode())
+    for name in task.requires:
+        sha.update(task_fingerprints[name].encode())
+    return sha.hexdigest()
+
+
+def load_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def save_state(state, state_file):
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    with open(state_file + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(state_file + '.tmp', state_file)
+
+
+def build(tasks, n_jobs=None, force=False, state_file=STATE_FILE):
+    """Build the figures of tasks on a pool of n_jobs processes with a headless backend. Tasks whose code, arguments
+       and inputs are unchanged since their outputs were last built are skipped, unless force is set.
+       Returns a dict of task name -> (status, wall time in seconds)."""
+    matplotlib.use('Agg')
+
+    # Make sure the prepared data, the cube and the partitioned dataset are cached, so that workers load them rather
+    # than build them again
+    cache_file = prepare_data.get_cache_file()
+    if not os.path.exists(cache_file):
+        prepare_data.get_prepared_data()
+    cube_file = aggregate_cube.get_cube_file()
+    if not os.path.exists(cube_file):
+        aggregate_cube.get_cube()
+    dataset_dir = partitioned_store.build_dataset()
+    input_fingerprints = get_input_fingerprints(cache_file, cube_file, dataset_dir)
+
+    fingerprints = {}
+    for task in tasks:
+        missing = set(task.requires).difference(fingerprints)
+        if missing:
+            raise ValueError('Task {} requires {}, which must be declared before it'.format(task.name, sorted(missing)))
+        fingerprints[task.name] = get_task_fingerprint(task, input_fingerprints, fingerprints)
+
+    state = load_state(state_file)
+    results = {}
+    pending = collections.OrderedDict()
+    for task in tasks:
+        up_to_date = (state.get(task.name, {}).get('fingerprint') == fingerprints[task.name] and
+                      all(os.path.exists(output) for output in task.outputs))
+        if up_to_date and not force:
+            results[task.name] = ('up to date', 0.0)
+        else:
+            pending[task.name] = task
+
+    for task in pending.values():
+        for output in task.outputs:
+            os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+
+    with concurrent.futures.ProcessPoolExecutor(n_jobs, initializer=init_worker,
+                                                initargs=(cache_file, cube_file, dataset_dir,
+                                                          instrumentation.is_enabled())) as pool:
+        running = {}
+        while pending or running:
+            # Submit the tasks whose requirements are all built, skip those with a requirement that failed
+            for name, task in list(pending.items()):
+                if any(required not in results for required in task.requires):
+                    continue
+                del pending[name]
+                if all(results[required][0] in ('built', 'up to date') for required in task.requires):
+                    running[pool.submit(run_task, task)] = task
+                else:
+                    results[name] = ('skipped', 0.0)
+            if not running:
+                continue
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                try:
+                    seconds, events = future.result()
+                except Exception as e:
+                    print('{} failed: {!r}'.format(task.name, e))
+                    results[task.name] = ('failed', 0.0)
+                    state.pop(task.name, None)
+                else:
+                    results[task.name] = ('built', seconds)
+                    instrumentation.add_events(events)
+                    state[task.name] = {'fingerprint': fingerprints[task.name], 'seconds': seconds}
+                save_state(state, state_file)
+
+    for name, (status, seconds) in sorted(results.items(), key=lambda item: -item[1][1]):
+        print('{:<50} {:>10} {:8.2f}s'.format(name, status, seconds))
+    return results
@@ -0,0 +1,40 @@
+import argparse
+import collections
+import importlib
+import sys
+
+# Subcommands and the module implementing each of them (with add_arguments(parser) and main(args)). Only the module of
+# the subcommand run is imported, so that light subcommands do not pay for the plotting and modelling libraries.
+COMMANDS = collections.OrderedDict([
+    ('prepare', ('prepare_data', 'Prepare the dataset and cache the result.')),
+    ('explore', ('run_exploratory_analyses', 'Build the exploratory figures.')),
+    ('train', ('predict_defects', 'Train the defect model, report its out-of-bag performance and save it.')),
+    ('score', ('score_defects', 'Flag likely defects in new production records.')),
+    ('sankey', ('zone_path_sankey', 'Draw the flows of products through the zone positions.')),
+    ('monitor', ('defect_monitor', 'Monitor the defect rate of each zone position and raise drift alarms.')),
+    ('scan', ('root_cause_scan', 'Rank the zone positions by how well they explain each defect.')),
+    ('tune', ('tree_tuning', 'Tune the tree parameters of the defect opportunities.')),
+])
+
+
+def get_parser(command=None):
+    parser = argparse.ArgumentParser(prog='cli.py', description='Defect analysis pipeline.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+    for name, (module_name, description) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=description, description=description)
+        if name == command:
+            module = importlib.import_module(module_name)
+            module.add_arguments(subparser)
+            subparser.set_defaults(main=module.main)
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = get_parser(argv[0] if argv else None).parse_args(argv)
+    args.main(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+# Lets pytest import the modules of the repository root from tests/
+import pytest
+
+import synthetic_data
+
+
+@pytest.fixture(scope='session')
+def synthetic_csv(tmp_path_factory):
+    # Path of a generated 10K rows dataset, in the format of the full one
+    path = str(tmp_path_factory.mktemp('data') / 'generated_10K.csv.gz')
+    synthetic_data.write_data(path, synthetic_data.SIZES['10K'])
+    return path
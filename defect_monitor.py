@@ -0,0 +1,196 @@
+import argparse
+import collections
+import time
+
+import numpy
+import pandas
+
+import aggregate_cube
+import schema
+
+POSITION_COLUMNS = ['Zone1Position', 'Zone2Position', 'Zone3Position']
+RESULT_TYPES = schema.CATEGORIES['Result_Type']
+DEFECTS = [result_type for result_type in RESULT_TYPES if result_type != 'PASS']
+SKUS = schema.CATEGORIES['SKU']
+
+# Marks the slots of a window not filled yet
+EMPTY = 255
+
+Alarm = collections.namedtuple('Alarm', ['row_id', 'zone', 'position', 'SKU', 'defect', 'kind', 'window_rate',
+                                         'decayed_rate', 'baseline_rate'])
+
+
+def get_baseline_rates(data):
+    """Return the rate of each defect (columns) per SKU (rows) in data, row-level or an aggregate cube. Rates are
+       smoothed by half a product, so that defects never seen still get a small positive rate."""
+    counts = aggregate_cube.count_by(data, ['SKU', 'Result_Type']).unstack().reindex(index=SKUS, columns=RESULT_TYPES)
+    counts = counts.fillna(0)
+    return (counts[DEFECTS] + 0.5).div(counts.sum(axis=1) + 1, axis=0)
+
+
+class DefectRateMonitor:
+    """Follow the rate of each defect among the products going through each (zone position, SKU) cell of the line, one
+       product at a time, and raise alarms when it drifts above the baseline rate of the SKU.
+
+       Each cell keeps the results of its last `window` products in a ring buffer with their counts per result type,
+       and an exponentially decayed rate of each defect with the given half life (in products). Updating a cell takes
+       constant time and the state has a fixed size: number of cells x (window bytes + a few numbers per defect).
+
+       Two alarms detect a rate reaching rate_ratio times the baseline: a Bernoulli CUSUM, raised when the log
+       likelihood ratio of the recent results (drifted vs. baseline rate) exceeds cusum_threshold and reset after
+       each alarm, and a threshold on the rate over a full window, raised when the rate crosses it."""
+
+    def __init__(self, baseline_rates, window=1000, half_life=500, rate_ratio=2.0, cusum_threshold=5.0):
+        self.window = window
+        self.alpha = 1 - 0.5 ** (1 / half_life)
+        self.cells = [(column, position) for column in POSITION_COLUMNS for position in schema.CATEGORIES[column]]
+        self.zone_offsets = numpy.cumsum([0] + [len(schema.CATEGORIES[column]) for column in POSITION_COLUMNS]).tolist()
+
+        self.baseline_rates = baseline_rates.reindex(index=SKUS, columns=DEFECTS).to_numpy()
+        drifted_rates = numpy.minimum(self.baseline_rates * rate_ratio, 0.999)
+        # CUSUM increments after a defect and after any other result, per SKU and defect
+        self.defect_increments = numpy.log(drifted_rates / self.baseline_rates).tolist()
+        self.other_increments = numpy.log((1 - drifted_rates) / (1 - self.baseline_rates)).tolist()
+        self.drifted_rates = drifted_rates.tolist()
+        self.cusum_threshold = cusum_threshold
+
+        n_cells = len(self.cells) * len(SKUS)
+        self.rings = [bytearray([EMPTY]) * window for _ in range(n_cells)]
+        self.heads = [0] * n_cells
+        self.counts = [[0] * len(RESULT_TYPES) for _ in range(n_cells)]
+        self.n_products = [0] * n_cells
+        self.decayed_rates = [list(self.baseline_rates[i % len(SKUS)]) for i in range(n_cells)]
+        self.cusums = [[0.0] * len(DEFECTS) for _ in range(n_cells)]
+        self.above_threshold = [[False] * len(DEFECTS) for _ in range(n_cells)]
+
+    def update(self, row_id, positions, sku, result, alarms):
+        """Add a product, given the codes of its position in each zone (-1 if unknown), SKU and Result_Type (in the
+           order of schema.CATEGORIES), and append the alarms it raises to alarms."""
+        n_skus = len(SKUS)
+        for zone, position in enumerate(positions):
+            if position < 0:
+                continue
+            cell = (self.zone_offsets[zone] + position) * n_skus + sku
+
+            # Slide the window: the result of the product window products ago leaves it
+            ring, head, counts = self.rings[cell], self.heads[cell], self.counts[cell]
+            if ring[head] != EMPTY:
+                counts[ring[head]] -= 1
+            ring[head] = result
+            counts[result] += 1
+            self.heads[cell] = (head + 1) % self.window
+            self.n_products[cell] += 1
+            window_full = self.n_products[cell] >= self.window
+
+            decayed_rates, cusums = self.decayed_rates[cell], self.cusums[cell]
+            above_threshold = self.above_threshold[cell]
+            for defect in range(len(DEFECTS)):
+                if result == defect:
+                    decayed_rates[defect] += self.alpha * (1 - decayed_rates[defect])
+                    cusum = cusums[defect] + self.defect_increments[sku][defect]
+                else:
+                    decayed_rates[defect] -= self.alpha * decayed_rates[defect]
+                    cusum = max(cusums[defect] + self.other_increments[sku][defect], 0.0)
+
+                kinds = []
+                if cusum > self.cusum_threshold:
+                    kinds.append('cusum')
+                    cusum = 0.0
+                cusums[defect] = cusum
+                if window_full:
+                    above = counts[defect] >= self.drifted_rates[sku][defect] * self.window
+                    if above and not above_threshold[defect]:
+                        kinds.append('threshold')
+                    above_threshold[defect] = above
+                for kind in kinds:
+                    alarms.append(Alarm(row_id, zone + 1, self.cells[cell // n_skus][1], SKUS[sku], DEFECTS[defect],
+                                        kind, counts[defect] / min(self.n_products[cell], self.window),
+                                        decayed_rates[defect], self.baseline_rates[sku, defect]))
+
+    def update_data(self, data):
+        """Add the products of prepared data, in order, and return the alarms they raise as a dataframe. Products
+           without SKU or Result_Type are ignored."""
+        positions = numpy.column_stack([get_codes(data[column], column) for column in POSITION_COLUMNS]).tolist()
+        skus = get_codes(data.SKU, 'SKU').tolist()
+        results = get_codes(data.Result_Type, 'Result_Type').tolist()
+
+        alarms = []
+        for row_id, product_positions, sku, result in zip(data.index.tolist(), positions, skus, results):
+            if sku >= 0 and result >= 0:
+                self.update(row_id, product_positions, sku, result, alarms)
+        return pandas.DataFrame(alarms, columns=Alarm._fields)
+
+    def get_rates(self):
+        # Current rates of each defect in each (zone position, SKU) cell that has seen products
+        n_skus, n_defects = len(SKUS), len(DEFECTS)
+        cells = numpy.repeat(numpy.arange(len(self.rings)), n_defects)
+        n_products = numpy.array(self.n_products)[cells]
+        rates = pandas.DataFrame({
+            'zone': [POSITION_COLUMNS.index(self.cells[cell // n_skus][0]) + 1 for cell in cells],
+            'position': [self.cells[cell // n_skus][1] for cell in cells],
+            'SKU': numpy.array(SKUS)[cells % n_skus],
+            'defect': DEFECTS * len(self.rings),
+            'products': n_products,
+            'window_rate': numpy.array(self.counts)[:, :n_defects].ravel() / numpy.maximum(
+                numpy.minimum(n_products, self.window), 1),
+            'decayed_rate': numpy.array(self.decayed_rates).ravel(),
+            'baseline_rate': self.baseline_rates[cells % n_skus, numpy.tile(numpy.arange(n_defects), len(self.rings))],
+            'cusum': numpy.array(self.cusums).ravel(),
+        })
+        return rates[rates.products > 0].reset_index(drop=True)
+
+
+def get_codes(values, column):
+    # Codes of values in the categories of column in schema.CATEGORIES, -1 for missing values
+    return pandas.Categorical(values, categories=schema.CATEGORIES[column]).codes.astype('int64')
+
+
+def monitor_file(path, baseline_rates, output=None, chunksize=100000, **monitor_args):
+    """Stream the records in path (see score_defects.iter_records) through a DefectRateMonitor, printing the alarms
+       they raise and appending them to output (CSV) if given. Returns the monitor."""
+    import score_defects
+
+    monitor = DefectRateMonitor(baseline_rates, **monitor_args)
+    n_rows = n_alarms = 0
+    start = time.perf_counter()
+    for chunk in score_defects.iter_records(path, chunksize):
+        alarms = monitor.update_data(chunk)
+        if len(alarms):
+            print(alarms.to_string(index=False, header=n_alarms == 0))
+            if output:
+                alarms.to_csv(output, mode='w' if n_alarms == 0 else 'a', header=n_alarms == 0, index=False)
+        n_alarms += len(alarms)
+        n_rows += len(chunk)
+        elapsed = time.perf_counter() - start
+        print('{} rows monitored in {:.1f}s ({:.0f} rows/s), {} alarms'.format(
+            n_rows, elapsed, n_rows / elapsed, n_alarms))
+    return monitor
+
+
+def add_arguments(parser):
+    parser.add_argument('path', help='Records to monitor, in production order: a CSV extract, or a .parquet store of '
+                                     'prepared data.')
+    parser.add_argument('--output', help='CSV file to write the alarms to.')
+    parser.add_argument('--rates', help='CSV file to write the final rates of each position, SKU and defect to.')
+    parser.add_argument('--window', type=int, default=1000, help='Products in the sliding window of each position.')
+    parser.add_argument('--half-life', type=float, default=500, help='Half life of the decayed rates, in products.')
+    parser.add_argument('--rate-ratio', type=float, default=2.0,
+                        help='Raise alarms when a rate reaches this multiple of the baseline rate of the SKU.')
+    parser.add_argument('--cusum-threshold', type=float, default=5.0)
+    parser.add_argument('--chunksize', type=int, default=100000)
+
+
+def main(args):
+    # Baseline rates of the historical (prepared) dataset, from its aggregate cube
+    baseline_rates = get_baseline_rates(aggregate_cube.get_cube())
+    monitor = monitor_file(args.path, baseline_rates, args.output, args.chunksize, window=args.window,
+                           half_life=args.half_life, rate_ratio=args.rate_ratio, cusum_threshold=args.cusum_threshold)
+    if args.rates:
+        monitor.get_rates().to_csv(args.rates, index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monitor the defect rate of each zone position and raise drift '
+                                                 'alarms.')
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,139 @@
+import argparse
+import concurrent.futures
+import itertools
+
+import numpy
+import pandas
+
+
+def get_sensor_columns(data):
+    # Numeric temperature, humidity and duration columns
+    return [col for col in data.columns
+            if any(var in col for var in ('Temp', 'Humidity', 'Dur')) and pandas.api.types.is_numeric_dtype(data[col])]
+
+
+def get_bin_codes(values, edges):
+    """Return the index of the bin of each value, with right-closed bins (edges[i], edges[i + 1]] as in pandas.cut.
+       Values outside the edges or missing get -1."""
+    edges = numpy.asarray(edges, dtype=float)
+    codes = numpy.searchsorted(edges, numpy.asarray(values, dtype=float), side='left') - 1
+    codes[codes >= len(edges) - 1] = -1
+    return codes
+
+
+def get_defect_rate_surface(x_codes, y_codes, has_defect, n_x_bins, n_y_bins):
+    """Return the defect rate and the number of samples in each (x bin, y bin) cell, as (n_x_bins, n_y_bins) arrays.
+       Cells without samples have a NaN rate."""
+    binned = (x_codes >= 0) & (y_codes >= 0)
+    cells = x_codes[binned] * n_y_bins + y_codes[binned]
+    counts = numpy.bincount(cells, minlength=n_x_bins * n_y_bins)
+    defects = numpy.bincount(cells, weights=numpy.asarray(has_defect, dtype=float)[binned],
+                             minlength=n_x_bins * n_y_bins)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        rates = defects / counts
+    return rates.reshape(n_x_bins, n_y_bins), counts.reshape(n_x_bins, n_y_bins)
+
+
+def get_defect_rate_frames(x, y, has_defect, x_edges, y_edges):
+    # Same as get_defect_rate_surface, as dataframes labelled with the bins of x (index) and y (columns)
+    x_bins = pandas.IntervalIndex.from_breaks(x_edges, name=x.name)
+    y_bins = pandas.IntervalIndex.from_breaks(y_edges, name=y.name)
+    rates, counts = get_defect_rate_surface(get_bin_codes(x, x_edges), get_bin_codes(y, y_edges), has_defect,
+                                            len(x_bins), len(y_bins))
+    return (pandas.DataFrame(rates, index=x_bins, columns=y_bins),
+            pandas.DataFrame(counts, index=x_bins, columns=y_bins))
+
+
+def get_quantile_edges(values, n_bins):
+    # Edges of (at most) n_bins bins holding similar numbers of samples. The first edge is lowered so that the
+    # smallest value falls in the first (right-closed) bin.
+    edges = numpy.unique(numpy.nanquantile(values, numpy.linspace(0, 1, n_bins + 1)))
+    edges[0] = numpy.nextafter(edges[0], -numpy.inf)
+    return edges
+
+
+# Bin codes shared with the scan workers
+_codes = {}
+
+
+def init_scan_worker(codes, n_bins, has_defect):
+    _codes.update(codes=codes, n_bins=n_bins, has_defect=has_defect)
+
+
+def scan_pairs(pairs, min_count):
+    codes, n_bins, has_defect = _codes['codes'], _codes['n_bins'], _codes['has_defect']
+    results = []
+    for i, j in pairs:
+        rates, counts = get_defect_rate_surface(codes[:, i], codes[:, j], has_defect, n_bins[i], n_bins[j])
+        populated = counts >= min_count
+        if not populated.any():
+            continue
+        cell_rates = rates[populated]
+        overall_rate = (cell_rates * counts[populated]).sum() / counts[populated].sum()
+        results.append({
+            'x': i,
+            'y': j,
+            'contrast': cell_rates.max() - cell_rates.min(),
+            'max_rate': cell_rates.max(),
+            'min_rate': cell_rates.min(),
+            # Count-weighted spread of the cell rates around the rate over the populated cells
+            'weighted_std': numpy.sqrt((counts[populated] * (cell_rates - overall_rate) ** 2).sum() /
+                                       counts[populated].sum()),
+            'n_cells': int(populated.sum()),
+        })
+    return results
+
+
+def scan_interactions(data, has_defect, columns=None, n_bins=20, min_count=30, n_jobs=None, batch_size=50):
+    """Compute the binned defect-rate surface of every pair of columns (default: all Temp/Humidity/Dur columns) and
+       rank the pairs by defect-rate contrast: the difference between the highest and lowest rate over the cells with
+       at least min_count samples. Columns are binned once into n_bins quantile bins, and batches of pairs are scanned
+       on n_jobs worker processes (n_jobs=1 scans in this process)."""
+    columns = get_sensor_columns(data) if columns is None else list(columns)
+
+    codes = numpy.empty((len(data), len(columns)), dtype=numpy.int16)
+    col_n_bins = []
+    for k, col in enumerate(columns):
+        values = data[col].astype('float64').to_numpy()
+        edges = get_quantile_edges(values, n_bins)
+        codes[:, k] = get_bin_codes(values, edges)
+        col_n_bins.append(len(edges) - 1)
+    has_defect = numpy.asarray(has_defect, dtype=bool)
+
+    pairs = list(itertools.combinations(range(len(columns)), 2))
+    batches = [pairs[i:i + batch_size] for i in range(0, len(pairs), batch_size)]
+    if n_jobs == 1:
+        init_scan_worker(codes, col_n_bins, has_defect)
+        results = [result for batch in batches for result in scan_pairs(batch, min_count)]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(n_jobs, initializer=init_scan_worker,
+                                                    initargs=(codes, col_n_bins, has_defect)) as pool:
+            results = [result for batch_results in pool.map(scan_pairs, batches, itertools.repeat(min_count))
+                       for result in batch_results]
+
+    ranking = pandas.DataFrame(results, columns=['x', 'y', 'contrast', 'max_rate', 'min_rate', 'weighted_std',
+                                                 'n_cells'])
+    ranking['x'] = [columns[i] for i in ranking.x]
+    ranking['y'] = [columns[j] for j in ranking.y]
+    return ranking.sort_values('contrast', ascending=False).reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    import opportunity_trees
+    import prepare_data
+
+    parser = argparse.ArgumentParser(description='Rank pairs of sensor columns by defect-rate contrast for each '
+                                                 'opportunity.')
+    parser.add_argument('--bins', type=int, default=20)
+    parser.add_argument('--min-count', type=int, default=30)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--jobs', type=int, default=None)
+    args = parser.parse_args()
+
+    data = prepare_data.get_prepared_data()
+    for opportunity in opportunity_trees.OPPORTUNITIES:
+        data2 = data[data.SKU.isin(opportunity.skus) & data.Result_Type.isin(['PASS', opportunity.defect])]
+        ranking = scan_interactions(data2, data2.Result_Type != 'PASS', n_bins=args.bins, min_count=args.min_count,
+                                    n_jobs=args.jobs)
+        print('{} ({} in {})'.format(opportunity.name, opportunity.defect, ', '.join(opportunity.skus)))
+        print(ranking.head(args.top))
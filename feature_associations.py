@@ -0,0 +1,152 @@
+import concurrent.futures
+import hashlib
+import itertools
+import os
+
+import numpy
+import pandas
+
+import prepare_data
+
+
+def pearson_block(x, y):
+    # Pearson correlation between the columns of x and y over pairwise complete observations, as DataFrame.corr
+    x_observed, y_observed = ~numpy.isnan(x), ~numpy.isnan(y)
+    x0, y0 = numpy.where(x_observed, x, 0), numpy.where(y_observed, y, 0)
+    x_observed, y_observed = x_observed.astype('float64'), y_observed.astype('float64')
+
+    n = x_observed.T @ y_observed
+    sum_x, sum_y = x0.T @ y_observed, x_observed.T @ y0
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        cov = x0.T @ y0 - sum_x * sum_y / n
+        var_x = (x0 ** 2).T @ y_observed - sum_x ** 2 / n
+        var_y = x_observed.T @ y0 ** 2 - sum_y ** 2 / n
+        return numpy.clip(cov / numpy.sqrt(var_x * var_y), -1, 1)
+
+
+def cramers_v(a, b, n_a, n_b):
+    # Cramér's V between two categorical columns given as codes (-1 for missing values)
+    observed = (a >= 0) & (b >= 0)
+    table = numpy.bincount(a[observed] * n_b + b[observed], minlength=n_a * n_b).reshape(n_a, n_b).astype('float64')
+    table = table[table.sum(axis=1) > 0][:, table.sum(axis=0) > 0]
+    n = table.sum()
+    k = min(table.shape) - 1
+    if k < 1:
+        return numpy.nan
+    chi2 = n * ((table ** 2 / numpy.outer(table.sum(axis=1), table.sum(axis=0))).sum() - 1)
+    return numpy.sqrt(chi2 / n / k)
+
+
+def correlation_ratio(codes, x, n_levels):
+    # Correlation ratio (eta) between a categorical column given as codes and a numeric column
+    observed = (codes >= 0) & ~numpy.isnan(x)
+    codes, x = codes[observed], x[observed]
+    counts = numpy.bincount(codes, minlength=n_levels)
+    sums = numpy.bincount(codes, weights=x, minlength=n_levels)
+    grand_mean = x.mean() if len(x) else numpy.nan
+    present = counts > 0
+    between = (counts[present] * (sums[present] / counts[present] - grand_mean) ** 2).sum()
+    total = ((x - grand_mean) ** 2).sum()
+    return numpy.sqrt(between / total) if total > 0 else numpy.nan
+
+
+# Encoded columns shared with the workers: numeric values, categorical codes and, for each column, its kind and the
+# index of its values in either array
+_shared = {}
+
+
+def init_worker(values, codes, n_levels, columns):
+    _shared.update(values=values, codes=codes, n_levels=n_levels, columns=columns)
+
+
+def compute_block(rows, cols):
+    values, codes, n_levels, columns = _shared['values'], _shared['codes'], _shared['n_levels'], _shared['columns']
+    block = numpy.full((len(rows), len(cols)), numpy.nan)
+
+    # All numeric pairs of the block at once
+    numeric_rows = [i for i, row in enumerate(rows) if columns[row][0] == 'numeric']
+    numeric_cols = [j for j, col in enumerate(cols) if columns[col][0] == 'numeric']
+    if numeric_rows and numeric_cols:
+        block[numpy.ix_(numeric_rows, numeric_cols)] = pearson_block(
+            values[:, [columns[rows[i]][1] for i in numeric_rows]],
+            values[:, [columns[cols[j]][1] for j in numeric_cols]])
+
+    for (i, row), (j, col) in itertools.product(enumerate(rows), enumerate(cols)):
+        (row_kind, row_index), (col_kind, col_index) = columns[row], columns[col]
+        if row_kind == 'categorical' and col_kind == 'categorical':
+            block[i, j] = cramers_v(codes[:, row_index], codes[:, col_index], n_levels[row_index], n_levels[col_index])
+        elif row_kind == 'categorical':
+            block[i, j] = correlation_ratio(codes[:, row_index], values[:, col_index], n_levels[row_index])
+        elif col_kind == 'categorical':
+            block[i, j] = correlation_ratio(codes[:, col_index], values[:, row_index], n_levels[col_index])
+    return block
+
+
+def compute_association_matrix(data, block_size=16, n_jobs=None):
+    """Return the association between every pair of columns of data: Pearson correlation between numeric columns,
+       Cramér's V between categorical (category, object or bool) columns and the correlation ratio between a
+       categorical and a numeric column. The matrix is computed in blocks of block_size columns on n_jobs worker
+       processes (n_jobs=1 computes it in this process)."""
+    numeric = [col for col in data.columns if pandas.api.types.is_numeric_dtype(data[col]) and
+               not pandas.api.types.is_bool_dtype(data[col])]
+    categorical = [col for col in data.columns if col not in numeric]
+
+    # Centre the numeric columns, which keeps the single-pass sums of pearson_block accurate
+    values = data[numeric].to_numpy(dtype='float64', copy=True)
+    values -= numpy.nanmean(values, axis=0)
+    categories = [pandas.Categorical(data[col]) for col in categorical]
+    codes = numpy.column_stack([cat.codes.astype('int64') for cat in categories] or [numpy.empty(len(data), 'int64')])
+    n_levels = [len(cat.categories) for cat in categories]
+    columns = [('numeric', numeric.index(col)) if col in numeric else ('categorical', categorical.index(col))
+               for col in data.columns]
+
+    blocks = [list(range(start, min(start + block_size, len(columns)))) for start in range(0, len(columns), block_size)]
+    block_pairs = [(rows, cols) for i, rows in enumerate(blocks) for cols in blocks[i:]]
+    if n_jobs == 1:
+        init_worker(values, codes, n_levels, columns)
+        results = [compute_block(rows, cols) for rows, cols in block_pairs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(n_jobs, initializer=init_worker,
+                                                    initargs=(values, codes, n_levels, columns)) as pool:
+            results = list(pool.map(compute_block, *zip(*block_pairs)))
+
+    matrix = numpy.full((len(columns), len(columns)), numpy.nan)
+    for (rows, cols), block in zip(block_pairs, results):
+        matrix[numpy.ix_(rows, cols)] = block
+        matrix[numpy.ix_(cols, rows)] = block.T
+    numpy.fill_diagonal(matrix, 1)
+    return pandas.DataFrame(matrix, index=data.columns, columns=data.columns)
+
+
+def get_data_key(data):
+    # The prepared data (whose cache file name encodes the source and preparation code), the columns and the rows data
+    # holds, without hashing its content: a filtered frame has other rows
+    index = data.index
+    rows = (len(index), index[0], index[-1]) if len(index) else (0,)
+    sha = hashlib.sha256(os.path.basename(prepare_data.get_cache_file()).encode())
+    sha.update(repr((list(data.columns), rows)).encode())
+    return sha.hexdigest()[:16]
+
+
+def get_cache_file(data_key):
+    key = '{}_{}'.format(data_key, prepare_data.get_file_hash(__file__)[:16])
+    return os.path.join(prepare_data.CACHE_DIR, 'associations_{}.parquet'.format(key))
+
+
+def get_association_matrix(data, block_size=16, n_jobs=None, use_cache=True):
+    """Same as compute_association_matrix. With use_cache, data has to be (a subset of the rows of) the prepared data
+       (see prepare_data.get_prepared_data): its matrix is cached on disk, keyed on the prepared data, the columns and
+       the number, first and last row_id of the rows (see get_data_key). Associations between a subset of the columns
+       are slices of the full matrix."""
+    if not use_cache:
+        return compute_association_matrix(data, block_size, n_jobs)
+
+    cache_file = get_cache_file(get_data_key(data))
+    if os.path.exists(cache_file):
+        return pandas.read_parquet(cache_file)
+
+    matrix = compute_association_matrix(data, block_size, n_jobs)
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    matrix.to_parquet(cache_file + '.tmp')
+    os.replace(cache_file + '.tmp', cache_file)
+    return matrix
@@ -0,0 +1,63 @@
+import numpy
+import pandas
+
+import instrumentation
+
+
+class FeatureEncoder(object):
+    """One-hot encode the categorical columns of a dataframe, keeping the other columns as numeric features. The
+       vocabulary is learnt once from the categorical dtypes (pinned by prepare_data, so every subset of the data gets
+       the same one) and the columns of the matrix are always in the order of feature_names_: numeric columns first,
+       then one column per category, named and ordered like pandas.get_dummies.
+
+       The matrix is a dense float32 array, the type trees are fitted on, unless sparse is set, which gives a CSR
+       matrix. Most features are numeric and dense, which a CSR matrix stores in 1.5 times the memory, and forests
+       fit about 3 times slower on it: only a vocabulary much wider than the numeric columns is worth a sparse
+       matrix."""
+
+    def __init__(self, exclude=('Result_Type', 'Result_Type_Bin', 'Date'), sparse=False):
+        self.exclude = list(exclude)
+        self.sparse = sparse
+
+    @instrumentation.traced
+    def fit(self, data):
+        columns = [col for col in data.columns if col not in self.exclude]
+        self.categories_ = {col: list(data[col].cat.categories)
+                            for col in columns if isinstance(data[col].dtype, pandas.CategoricalDtype)}
+        self.numeric_columns_ = [col for col in columns if col not in self.categories_]
+        self.feature_names_ = self.numeric_columns_ + ['{}_{}'.format(col, category)
+                                                       for col, categories in self.categories_.items()
+                                                       for category in categories]
+        return self
+
+    @instrumentation.traced
+    def transform(self, data):
+        n_rows, n_numeric = len(data), len(self.numeric_columns_)
+        numeric = data[self.numeric_columns_].astype('float32').to_numpy()
+
+        # Row and feature of each one-hot entry. Codes of values outside the vocabulary (or missing) are -1 and leave
+        # the row empty, as in get_dummies
+        rows, features = [numpy.empty(0, dtype='int64')], [numpy.empty(0, dtype='int64')]
+        offset = n_numeric
+        for col, categories in self.categories_.items():
+            codes = pandas.Categorical(data[col], categories=categories).codes
+            known = numpy.flatnonzero(codes >= 0)
+            rows.append(known)
+            features.append(offset + codes[known])
+            offset += len(categories)
+        rows, features = numpy.concatenate(rows), numpy.concatenate(features)
+
+        if self.sparse:
+            import scipy.sparse
+
+            one_hot = scipy.sparse.csr_matrix((numpy.ones(len(rows), dtype='float32'), (rows, features - n_numeric)),
+                                              shape=(n_rows, offset - n_numeric))
+            return scipy.sparse.hstack([scipy.sparse.csr_matrix(numeric), one_hot], format='csr')
+
+        x = numpy.zeros((n_rows, offset), dtype='float32')
+        x[:, :n_numeric] = numeric
+        x[rows, features] = 1
+        return x
+
+    def fit_transform(self, data):
+        return self.fit(data).transform(data)
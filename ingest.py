@@ -0,0 +1,155 @@
+import argparse
+import datetime
+import json
+import os
+
+import pandas
+
+import aggregate_cube
+import partitioned_store
+import prepare_data
+
+STORE_DIR = 'store'
+
+
+def get_store_files(store_dir=STORE_DIR):
+    return {
+        'prepared': os.path.join(store_dir, 'prepared'),
+        'aggregates': os.path.join(store_dir, 'aggregates'),
+        'manifest': os.path.join(store_dir, 'manifest.json'),
+    }
+
+
+def read_manifest(store_dir=STORE_DIR):
+    manifest_file = get_store_files(store_dir)['manifest']
+    if not os.path.exists(manifest_file):
+        return []
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def write_manifest(manifest, store_dir=STORE_DIR):
+    manifest_file = get_store_files(store_dir)['manifest']
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+
+# Appends whose aggregates are summed at read time before they are compacted into a single cube
+COMPACT_EVERY = 30
+
+
+def get_aggregates_file(part_name, store_dir=STORE_DIR):
+    # The aggregates of the rows of the append of part_name
+    return os.path.join(get_store_files(store_dir)['aggregates'], 'part-{}.parquet'.format(part_name))
+
+
+def get_compacted_file(part_name, store_dir=STORE_DIR):
+    # The aggregates of the rows of all appends up to that of part_name
+    return os.path.join(get_store_files(store_dir)['aggregates'], 'cube-{}.parquet'.format(part_name))
+
+
+def get_aggregates_files(manifest, store_dir=STORE_DIR):
+    # Files whose aggregates sum to those of the appends in manifest: the last compacted cube and the appends since
+    compacted = [entry['part'] for entry in manifest if entry.get('compacted')]
+    return ([get_compacted_file(compacted[-1], store_dir)] if compacted else []) + [
+        get_aggregates_file(entry['part'], store_dir) for entry in manifest if not entry.get('compacted')]
+
+
+def write_parquet(data, path):
+    data.to_parquet(path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def load_aggregates(store_dir=STORE_DIR):
+    """Return the running aggregates (an aggregate cube) of the rows appended so far, or None if there are none. Only
+       the appends in the manifest count, so the aggregates of an append interrupted before its manifest entry was
+       written are left out. Reads the last compacted cube and at most COMPACT_EVERY parts (see compact_aggregates)."""
+    manifest = read_manifest(store_dir)
+    if not manifest:
+        return None
+    parts = [pandas.read_parquet(aggregates_file) for aggregates_file in get_aggregates_files(manifest, store_dir)]
+    return aggregate_cube.sum_by(pandas.concat(parts, ignore_index=True, sort=False), aggregate_cube.CUBE_KEYS)
+
+
+def compact_aggregates(store_dir=STORE_DIR):
+    """Sum the aggregates of the appends so far into a single cube, so that reading them no longer grows with the
+       number of appends. Work is proportional to the history, which is why append_data only compacts every
+       COMPACT_EVERY appends."""
+    manifest = read_manifest(store_dir)
+    if not any(not entry.get('compacted') for entry in manifest):
+        return
+    # As for appends, the new cube only counts once the manifest refers to it
+    write_parquet(load_aggregates(store_dir), get_compacted_file(manifest[-1]['part'], store_dir))
+    stale_files = get_aggregates_files(manifest, store_dir)
+    for entry in manifest:
+        entry['compacted'] = True
+    write_manifest(manifest, store_dir)
+    for stale_file in stale_files:
+        os.remove(stale_file)
+
+
+def load_store(store_dir=STORE_DIR, columns=None, filters=()):
+    """Return the rows appended so far that satisfy filters, as one prepared dataframe (see partitioned_store.load), or
+       None if there are none. Only the rows of the appends in the manifest are read: those of an interrupted append
+       are left out until it is retried."""
+    manifest = read_manifest(store_dir)
+    if not manifest:
+        return None
+    return partitioned_store.load(get_store_files(store_dir)['prepared'], columns, filters,
+                                  parts=[entry['part'] for entry in manifest])
+
+
+def append_data(path, store_dir=STORE_DIR, chunksize=100000, compact_every=COMPACT_EVERY):
+    """Prepare the rows in path (e.g. the extract of a new production day), append them to the store with their
+       aggregates (an aggregate cube, see aggregate_cube). Work is proportional to the new rows only, but for a
+       compaction of the aggregates every compact_every appends. Appending the same file twice is a no-op."""
+    store_files = get_store_files(store_dir)
+    source_hash = prepare_data.get_file_hash(path)
+    manifest = read_manifest(store_dir)
+    if any(entry['hash'] == source_hash for entry in manifest):
+        print('{} was already appended to {}'.format(path, store_dir))
+        return
+
+    costs = prepare_data.get_costs()
+    new_aggregates = []
+
+    def aggregate_chunks(chunks):
+        for chunk in chunks:
+            new_aggregates.append(aggregate_cube.build_cube(chunk, costs))
+            yield chunk
+
+    # Write the new rows and their aggregates first: the append only counts once its manifest entry is written, as
+    # only the parts in the manifest are read. Part files are named after the source, so that appending again after a
+    # failure replaces those already written.
+    part_name = source_hash[:16]
+    partitioned_store.write_dataset(aggregate_chunks(prepare_data.iter_prepared_data(path, chunksize)),
+                                    store_files['prepared'], part_name)
+    os.makedirs(store_files['aggregates'], exist_ok=True)
+    write_parquet(aggregate_cube.sum_by(pandas.concat(new_aggregates, ignore_index=True, sort=False),
+                                        aggregate_cube.CUBE_KEYS), get_aggregates_file(part_name, store_dir))
+
+    manifest.append({
+        'path': path,
+        'hash': source_hash,
+        'part': part_name,
+        'rows': int(sum(chunk_aggregates.Count.sum() for chunk_aggregates in new_aggregates)),
+        'appended_at': datetime.datetime.now().isoformat(timespec='seconds'),
+    })
+    write_manifest(manifest, store_dir)
+
+    if sum(not entry.get('compacted') for entry in manifest) >= compact_every:
+        compact_aggregates(store_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Append new production data to the store and update aggregates.')
+    parser.add_argument('paths', nargs='+', help='CSV extracts to append, in the same format as the full dataset.')
+    parser.add_argument('--store-dir', default=STORE_DIR)
+    parser.add_argument('--chunksize', type=int, default=100000)
+    parser.add_argument('--compact-every', type=int, default=COMPACT_EVERY,
+                        help='Compact the aggregates into a single cube every this many appends.')
+    args = parser.parse_args()
+
+    for path in args.paths:
+        append_data(path, args.store_dir, args.chunksize, args.compact_every)
@@ -0,0 +1,110 @@
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, where peak RSS is not recorded
+    resource = None
+
+# Events recorded since tracing was enabled, None while tracing is disabled
+_events = None
+
+
+def enable():
+    global _events
+    if _events is None:
+        _events = []
+
+
+def disable():
+    global _events
+    _events = None
+
+
+def is_enabled():
+    return _events is not None
+
+
+def pop_events():
+    # Return the events recorded so far and start over, so that worker processes can hand them to the parent
+    global _events
+    events, _events = _events, []
+    return events
+
+
+def add_events(events):
+    if _events is not None:
+        _events.extend(events)
+
+
+def write_trace(path):
+    """Write the recorded events to path in the Chrome trace format (open in chrome://tracing or Perfetto)."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': _events or [], 'displayTimeUnit': 'ms'}, f)
+
+
+def get_peak_rss():
+    # Peak resident set size of this process so far in bytes
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_shape(value):
+    shape = getattr(value, 'shape', None)
+    if shape is None or len(shape) == 0:
+        return None
+    return [int(shape[0]), int(shape[1]) if len(shape) > 1 else 1]
+
+
+@contextlib.contextmanager
+def stage(name, data=None, **args):
+    """Record the wall time, CPU time and peak RSS increase of the enclosed block as a complete event, with the shape
+       (rows, columns) of data and any extra args. The context yields a dict to which the block can add 'out' (a
+       frame or array whose shape is recorded) and other args. Does nothing while tracing is disabled."""
+    if _events is None:
+        yield {}
+        return
+
+    info = dict(args)
+    if get_shape(data) is not None:
+        info['shape_in'] = get_shape(data)
+    start_ts, start_wall, start_cpu, start_rss = time.time(), time.perf_counter(), time.process_time(), get_peak_rss()
+    try:
+        yield info
+    finally:
+        wall = time.perf_counter() - start_wall
+        info['cpu_ms'] = 1e3 * (time.process_time() - start_cpu)
+        info['peak_rss_delta_mb'] = (get_peak_rss() - start_rss) / 2**20
+        out = info.pop('out', None)
+        if get_shape(out) is not None:
+            info['shape_out'] = get_shape(out)
+        if _events is not None:
+            _events.append({'name': name, 'cat': 'stage', 'ph': 'X', 'ts': 1e6 * start_ts, 'dur': 1e6 * wall,
+                            'pid': os.getpid(), 'tid': threading.get_ident(), 'args': info})
+
+
+def traced(function):
+    """Decorator recording each call of function as a stage. The shapes recorded are those of the first argument with
+       a shape, before and after the call (functions that impute in place), and of the return value if it has one.
+       While tracing is disabled the call only costs a global lookup."""
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _events is None:
+            return function(*args, **kwargs)
+
+        data = next((arg for arg in args if get_shape(arg) is not None), None)
+        with stage(name, data) as info:
+            result = function(*args, **kwargs)
+            info['out'] = result if get_shape(result) is not None else data
+        return result
+    return wrapper
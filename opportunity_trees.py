@@ -0,0 +1,150 @@
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+
+import numpy
+
+import feature_encoding
+import instrumentation
+
+NON_A001_SKUS = ['B003', 'C005', 'X007', 'Z009']
+DEFECTS = ['Defect_1', 'Defect_2', 'Defect_3', 'Defect_4']
+# The NonA001 SKUs together and every SKU on its own
+SKU_GROUPS = [('NotA001', NON_A001_SKUS)] + [(sku, [sku]) for sku in ['A001'] + NON_A001_SKUS]
+
+# A root-cause analysis: a decision tree separating PASS from defect products among the given SKUs
+Opportunity = collections.namedtuple('Opportunity', ['name', 'skus', 'defect', 'tree_params'])
+
+# min_impurity_decrease is the impurity decrease of a split weighted by the share of the rows in its node: on these
+# rows, 1e-4 already leaves a single leaf
+OPPORTUNITIES = [
+    # Defect_2 in NonA001 SKUs
+    Opportunity('opportunity1', NON_A001_SKUS, 'Defect_2',
+                dict(min_samples_split=1000, min_samples_leaf=500, min_impurity_decrease=0.00001)),
+    # Defect_1 in A001 SKUs
+    Opportunity('opportunity2', ['A001'], 'Defect_1',
+                dict(min_samples_split=1000, min_samples_leaf=100, min_impurity_decrease=0.00001)),
+    # Defect_3 in NonA001 SKUs
+    Opportunity('opportunity3', NON_A001_SKUS, 'Defect_3',
+                dict(min_samples_split=10, min_samples_leaf=10, min_impurity_decrease=0.000005)),
+]
+
+DEFAULT_TREE_PARAMS = dict(min_samples_split=1000, min_samples_leaf=100, min_impurity_decrease=0.00001)
+
+MODEL_DIR = os.path.join('models', 'opportunity_trees')
+# Tree parameters chosen by tree_tuning, per opportunity name
+TUNED_PARAMS_FILE = os.path.join(MODEL_DIR, 'tuned_params.json')
+
+# Columns that are not features of the trees
+EXCLUDE = ['Result_Type_Bin', 'Result_Type', 'Date', 'SKU']
+
+
+def get_all_opportunities(tree_params=DEFAULT_TREE_PARAMS):
+    # Every defect, for every SKU group
+    return [Opportunity('{}_{}'.format(group, defect), skus, defect, tree_params)
+            for group, skus in SKU_GROUPS for defect in DEFECTS]
+
+
+def get_tuned_opportunities(opportunities=OPPORTUNITIES, tuned_params_file=TUNED_PARAMS_FILE):
+    # Opportunities with the tree parameters found by tree_tuning, where there are any
+    if not os.path.exists(tuned_params_file):
+        return list(opportunities)
+    with open(tuned_params_file) as f:
+        tuned_params = json.load(f)
+    # Parameters tuned on another set of parameters (e.g. min_impurity_split, which scikit-learn no longer has) are
+    # ignored
+    return [opportunity._replace(tree_params=tuned_params[opportunity.name])
+            if set(tuned_params.get(opportunity.name, ())) == set(opportunity.tree_params) else opportunity
+            for opportunity in opportunities]
+
+
+def get_rows(data, opportunity):
+    # Positions of the rows of data in an opportunity
+    return numpy.flatnonzero(data.SKU.isin(opportunity.skus) & data.Result_Type.isin(['PASS', opportunity.defect]))
+
+
+def get_filters(opportunity):
+    # Row predicates selecting the products of an opportunity, for partitioned_store.load
+    return [('SKU', 'in', opportunity.skus), ('Result_Type', 'in', ['PASS', opportunity.defect])]
+
+
+def fit_opportunity_tree(opportunity, x, y, feature_names, output_dir='figures', model_dir=MODEL_DIR):
+    # Fit the tree of one opportunity, save it and render its top levels with graphviz
+    import graphviz
+    import joblib
+    import sklearn.tree
+
+    with instrumentation.stage('DecisionTreeClassifier.fit', x, opportunity=opportunity.name):
+        tree = sklearn.tree.DecisionTreeClassifier(**opportunity.tree_params).fit(x, y)
+    os.makedirs(model_dir, exist_ok=True)
+    joblib.dump(tree, os.path.join(model_dir, opportunity.name + '.joblib'))
+
+    graph = sklearn.tree.export_graphviz(tree,
+                                         impurity=False,
+                                         precision=2,
+                                         special_characters=True,
+                                         max_depth=3,
+                                         feature_names=feature_names,
+                                         class_names=tree.classes_,
+                                         filled=True,
+                                         rounded=True,
+                                         proportion=True)
+    source = graphviz.Source(graph)
+    source.render(os.path.join(output_dir, opportunity.name + '_tree'), format='png')
+    source.render(os.path.join(output_dir, opportunity.name + '_tree'), format='pdf')
+    return tree
+
+
+def fit_opportunity_trees(data, opportunities=OPPORTUNITIES, n_jobs=None, output_dir='figures', model_dir=MODEL_DIR):
+    """Fit, save and render the tree of each opportunity. The features are encoded once for all opportunities, which
+       then only select their rows. Trees are fitted on n_jobs worker processes (n_jobs=1 fits them in this process).
+       Returns a dict of opportunity name -> fitted tree. If some trees fail, the others are still fitted and saved,
+       then a RuntimeError naming the failed opportunities is raised."""
+    # dropna is row-wise, so dropping once here leaves each opportunity the same rows as dropping after selecting them
+    data = data.dropna()
+    encoder = feature_encoding.FeatureEncoder(exclude=EXCLUDE).fit(data)
+    x = encoder.transform(data)
+    y = data.Result_Type.astype('object').to_numpy()
+
+    jobs = []
+    for opportunity in opportunities:
+        rows = get_rows(data, opportunity)
+        jobs.append((opportunity, x[rows], y[rows], encoder.feature_names_, output_dir, model_dir))
+
+    # A failing opportunity does not stop the others, whose trees are saved and rendered before the error is raised
+    trees, errors = {}, {}
+    if n_jobs == 1:
+        for job in jobs:
+            try:
+                trees[job[0].name] = fit_opportunity_tree(*job)
+            except Exception as error:
+                errors[job[0].name] = error
+    else:
+        with concurrent.futures.ProcessPoolExecutor(n_jobs) as pool:
+            futures = {job[0].name: pool.submit(fit_opportunity_tree, *job) for job in jobs}
+            for name, future in futures.items():
+                try:
+                    trees[name] = future.result()
+                except Exception as error:
+                    errors[name] = error
+    if errors:
+        raise RuntimeError('Fitting the trees of {} failed'.format(', '.join(errors))) from next(iter(errors.values()))
+    return trees
+
+
+if __name__ == '__main__':
+    import prepare_data
+
+    parser = argparse.ArgumentParser(description='Fit the root-cause decision trees of the defect opportunities.')
+    parser.add_argument('--all', action='store_true',
+                        help='Analyze every SKU/defect combination instead of the three main opportunities.')
+    parser.add_argument('--jobs', type=int, default=None, help='Number of worker processes (default: all cores).')
+    parser.add_argument('--tuned', action='store_true', help='Use the tree parameters found by tree_tuning.')
+    args = parser.parse_args()
+
+    opportunities = get_all_opportunities() if args.all else OPPORTUNITIES
+    if args.tuned:
+        opportunities = get_tuned_opportunities(opportunities)
+    fit_opportunity_trees(prepare_data.get_prepared_data(), opportunities, n_jobs=args.jobs)
@@ -0,0 +1,208 @@
+import glob
+import operator
+import os
+import shutil
+
+import numpy
+import pandas
+
+import instrumentation
+import prepare_data
+import schema
+
+# Rows are stored in one directory per month of Date and SKU, as Month=<YYYY-MM>/SKU=<SKU>/part-<name>.parquet
+PARTITION_KEYS = ['Month', 'SKU']
+UNKNOWN = 'unknown'
+
+# Row predicates are (column, operator, value) tuples, all of which rows have to satisfy
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda values, value: values.isin(value),
+    'not in': lambda values, value: ~values.isin(value),
+}
+ORDERED_OPERATORS = ['<', '<=', '>', '>=']
+# Predicates evaluated by the Parquet reader, on the rows of each file. The reader drops rows with a missing value for
+# any predicate, which pandas only does for these: != and not in keep them, so they are evaluated after reading.
+READER_OPERATORS = ['==', '<', '<=', '>', '>=', 'in']
+# Columns stored as unordered categoricals, which only compare for equality
+CATEGORICAL_COLUMNS = list(schema.CATEGORIES) + ['Result_Type_Bin']
+
+
+def get_labels(values, format_categories):
+    # Partition label of each value, UNKNOWN for missing values
+    values = pandas.Categorical(values)
+    return numpy.append(numpy.asarray(format_categories(values.categories), dtype=object), UNKNOWN)[values.codes]
+
+
+def write_partitions(data, dataset_dir, name):
+    """Write the rows of data to the partitions of dataset_dir they belong to, as part-<name>.parquet files (replacing
+       files of the same name, so writing the same rows twice is harmless)."""
+    import pyarrow
+    import pyarrow.parquet
+
+    # Counts get the same type in all files, whatever their values
+    data = data.astype({col: schema.STREAM_COUNT_DTYPE for col in schema.COUNT_COLUMNS if col in data})
+    months = get_labels(data.Date, lambda dates: dates.strftime('%Y-%m'))
+    skus = get_labels(data.SKU, lambda skus: skus)
+    for (month, sku), part in data.groupby([months, skus], sort=False):
+        part_dir = os.path.join(dataset_dir, 'Month={}'.format(month), 'SKU={}'.format(sku))
+        os.makedirs(part_dir, exist_ok=True)
+        part_file = os.path.join(part_dir, 'part-{}.parquet'.format(name))
+        pyarrow.parquet.write_table(pyarrow.Table.from_pandas(part), part_file + '.tmp')
+        os.replace(part_file + '.tmp', part_file)
+
+
+def get_part_files(part_dirs, parts=None):
+    """Return the part files in part_dirs, only those written under one of the names in parts if given. Names must
+       not hold a '-', which separates the name from the chunk number in the files written by write_dataset."""
+    part_files = []
+    for part_dir in part_dirs:
+        for part_file in sorted(glob.glob(os.path.join(part_dir, 'part-*.parquet'))):
+            name = os.path.basename(part_file)[len('part-'):-len('.parquet')].split('-')[0]
+            if parts is None or name in parts:
+                part_files.append(part_file)
+    return part_files
+
+
+def write_dataset(chunks, dataset_dir, name):
+    # Write chunks of prepared data to the partitions of dataset_dir, chunk by chunk
+    for i, chunk in enumerate(chunks):
+        write_partitions(chunk, dataset_dir, '{}-{:05d}'.format(name, i))
+
+
+def get_partitions(dataset_dir):
+    # Return a frame of the Month and SKU of each partition directory, indexed by directory
+    partitions = {}
+    for part_dir in glob.glob(os.path.join(dataset_dir, 'Month=*', 'SKU=*')):
+        partitions[part_dir] = [os.path.basename(path).split('=', 1)[1]
+                                for path in (os.path.dirname(part_dir), part_dir)]
+    return pandas.DataFrame.from_dict(partitions, orient='index', columns=PARTITION_KEYS)
+
+
+def check_filters(filters):
+    for col, op, value in filters:
+        if op not in OPERATORS:
+            raise ValueError('Unknown operator {!r} in filter on {}'.format(op, col))
+        if op in ORDERED_OPERATORS and col in CATEGORICAL_COLUMNS:
+            raise ValueError('{} is categorical and only supports ==, !=, in and not in, not {}'.format(col, op))
+
+
+def select_partitions(partitions, filters):
+    """Return the partitions that may hold rows satisfying filters. Predicates on SKU are evaluated on the SKU of each
+       partition, predicates on Date on the first and last day of its month. Raises ValueError for filters that rows
+       cannot be compared with (see check_filters)."""
+    check_filters(filters)
+    selected = pandas.Series(True, index=partitions.index)
+    months = pandas.to_datetime(partitions.Month.where(partitions.Month != UNKNOWN), format='%Y-%m')
+    first_days, last_days = months, months + pandas.offsets.MonthEnd(0)
+    for col, op, value in filters:
+        if col == 'SKU':
+            selected &= OPERATORS[op](partitions.SKU, value) | (partitions.SKU == UNKNOWN)
+        elif col == 'Date' and op in ('<', '<='):
+            selected &= OPERATORS[op](first_days, pandas.Timestamp(value)) | months.isna()
+        elif col == 'Date' and op in ('>', '>='):
+            selected &= OPERATORS[op](last_days, pandas.Timestamp(value)) | months.isna()
+        elif col == 'Date' and op in ('==', 'in'):
+            values = pandas.to_datetime([value] if op == '==' else list(value))
+            selected &= months.isin(values.to_period('M').to_timestamp()) | months.isna()
+    return partitions.index[selected]
+
+
+def get_reader_filters(filters):
+    # The predicates of filters evaluated by the Parquet reader, in its form, or None if there are none
+    reader_filters = []
+    for col, op, value in filters:
+        if op in READER_OPERATORS:
+            if col in schema.DATE_COLUMNS:
+                value = list(pandas.to_datetime(value)) if op == 'in' else pandas.Timestamp(value)
+            reader_filters.append((col, op, value))
+    return reader_filters or None
+
+
+def get_reader_args():
+    # pyarrow versions before 1.0 only filter the rows of a file with the (then optional) non-legacy dataset reader,
+    # later versions do by default and eventually removed the option
+    import inspect
+
+    import pyarrow.parquet
+
+    if 'use_legacy_dataset' in inspect.signature(pyarrow.parquet.read_table).parameters:
+        return {'use_legacy_dataset': False}
+    return {}
+
+
+def restore_dtypes(data):
+    # Parquet files only know the categories present in each of them
+    for col in data.columns:
+        if col in schema.CATEGORIES:
+            data[col] = data[col].astype(pandas.CategoricalDtype(schema.CATEGORIES[col]))
+        elif col == 'Result_Type_Bin':
+            data[col] = data[col].astype(schema.RESULT_TYPE_BIN)
+    return data
+
+
+@instrumentation.traced
+def load(dataset_dir, columns=None, filters=(), parts=None):
+    """Return the rows of the dataset in dataset_dir that satisfy all filters, e.g.
+       [('SKU', '!=', 'A001'), ('Result_Type', 'in', ['PASS', 'Defect_2'])], with only the given columns (default: all).
+       Only the partitions that can hold such rows are read (see select_partitions) and, from these, only the columns
+       needed, with the rows filtered by the reader where it can (see READER_OPERATORS). With parts, only the files
+       written under these names are read (see get_part_files). Rows are in the order of their row_id. Raises
+       ValueError if the dataset has no such files or for an ordered comparison (<, <=, >, >=) on a categorical
+       column."""
+    import pyarrow.parquet
+
+    part_dirs = sorted(select_partitions(get_partitions(dataset_dir), filters))
+    # Predicates the reader cannot evaluate are evaluated on the rows it returns
+    reader_filters = get_reader_filters(filters)
+    row_filters = [(col, op, value) for col, op, value in filters if op not in READER_OPERATORS]
+    filter_columns = [col for col, _, _ in row_filters]
+    read_columns = None if columns is None else list(dict.fromkeys(list(columns) + filter_columns))
+
+    frames = []
+    for part_file in get_part_files(part_dirs, parts):
+        frame = restore_dtypes(pyarrow.parquet.read_table(part_file, columns=read_columns, filters=reader_filters,
+                                                          use_pandas_metadata=True, **get_reader_args()).to_pandas())
+        selected = numpy.ones(len(frame), dtype=bool)
+        for col, op, value in row_filters:
+            selected &= numpy.asarray(OPERATORS[op](frame[col], value), dtype=bool)
+        if selected.any():
+            frames.append(frame[selected])
+    if frames:
+        data = schema.compact_counts(pandas.concat(frames).sort_index(kind='mergesort'))
+    else:
+        # No row satisfies the filters: an empty frame with the columns and types the rows are stored with
+        part_files = get_part_files(sorted(get_partitions(dataset_dir).index), parts)
+        if not part_files:
+            raise ValueError('No data in {}'.format(dataset_dir))
+        data = restore_dtypes(pyarrow.parquet.read_schema(part_files[0]).empty_table().to_pandas())
+    return data if columns is None else data[list(columns)]
+
+
+def get_dataset_dir():
+    # Keyed on the prepared data, whose cache file name encodes the source and preparation code, and on this module
+    key = '{}_{}'.format(os.path.splitext(os.path.basename(prepare_data.get_cache_file()))[0],
+                         prepare_data.get_file_hash(__file__)[:16])
+    return os.path.join(prepare_data.CACHE_DIR, 'dataset_{}'.format(key))
+
+
+def build_dataset():
+    """Write the prepared dataset partitioned by month and SKU, unless it is already. Returns its directory."""
+    dataset_dir = get_dataset_dir()
+    if os.path.exists(dataset_dir):
+        return dataset_dir
+
+    shutil.rmtree(dataset_dir + '.tmp', ignore_errors=True)
+    write_partitions(prepare_data.get_prepared_data(), dataset_dir + '.tmp', 'prepared')
+    os.replace(dataset_dir + '.tmp', dataset_dir)
+
+    # Only the dataset of the current prepared data is ever read again
+    for stale_dir in glob.glob(os.path.join(prepare_data.CACHE_DIR, 'dataset_*')):
+        if stale_dir != dataset_dir:
+            shutil.rmtree(stale_dir)
+    return dataset_dir
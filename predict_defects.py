@@ -1,44 +1,153 @@
+import argparse
 import os
+import time
 
-import matplotlib.pyplot
 import numpy
 import pandas
-import seaborn
-import sklearn.model_selection
 
+import feature_encoding
+import instrumentation
 import prepare_data
 
-data = prepare_data.get_prepared_data()
+MODEL_FILE = os.path.join('models', 'defect_model.joblib')
 
-data2 = prepare_data.balance_dataset(data.dropna(), 'Result_Type')
 
-x = pandas.get_dummies(data2.drop(columns=['Result_Type', 'Result_Type_Bin', 'Date']))
-y = data2.Result_Type#.astype('category')
-rf = sklearn.ensemble.RandomForestClassifier(n_estimators=1000, oob_score=True, random_state=0)
-rf.fit(x, y)
+def train(data, n_jobs=-1, adaptive=False, **adaptive_args):
+    """Fit the forest on a dataset balanced on Result_Type, using n_jobs cores (-1: all). With adaptive, the forest is
+       grown until its out-of-bag accuracy stabilises (see fit_adaptive) and the OOB curve is returned as well."""
+    import sklearn.ensemble
 
-oob_prediction = pandas.Series(rf.classes_[numpy.argmax(rf.oob_decision_function_,axis=1)], index=x.index)
-print(sklearn.metrics.classification_report(y, oob_prediction))
-print(sklearn.metrics.balanced_accuracy_score(y, oob_prediction))
+    data2 = prepare_data.balance_dataset(data.dropna(), 'Result_Type')
 
-# Make plots
-os.makedirs('figures', exist_ok=True)
+    encoder = feature_encoding.FeatureEncoder()
+    x = encoder.fit_transform(data2)
+    y = data2.Result_Type#.astype('category')
+    if adaptive:
+        rf, curve = fit_adaptive(x, y, n_jobs=n_jobs, **adaptive_args)
+        return rf, encoder, y, curve
 
-matplotlib.pyplot.figure()
-pandas.Series(rf.feature_importances_, index=x.columns).sort_values(ascending=False).head(10).plot(kind='bar')
-matplotlib.pyplot.xlabel('Features')
-matplotlib.pyplot.ylabel('Importance')
-matplotlib.pyplot.tight_layout()
-matplotlib.pyplot.savefig(os.path.join('figures', 'rf_variable_importance.png'))
+    rf = sklearn.ensemble.RandomForestClassifier(n_estimators=1000, oob_score=True, random_state=0, n_jobs=n_jobs)
+    with instrumentation.stage('RandomForestClassifier.fit', x, n_estimators=rf.n_estimators):
+        rf.fit(x, y)
+    return rf, encoder, y, None
 
-matplotlib.pyplot.figure()
-seaborn.heatmap(pandas.DataFrame(sklearn.metrics.confusion_matrix(y, oob_prediction),
-                                 index=rf.classes_,
-                                 columns=rf.classes_),
-                cmap='Blues',
-                cbar_kws={'label': 'Number of products'})
-matplotlib.pyplot.xlabel('Golden truth')
-matplotlib.pyplot.ylabel('Out-of-bag predictions')
-matplotlib.pyplot.tight_layout()
-matplotlib.pyplot.savefig(os.path.join('figures', 'rf_confusion_matrix.png'))
 
+def get_oob_balanced_accuracy(rf, y):
+    import sklearn.metrics
+
+    # Samples that were in the bag of every tree so far have no out-of-bag prediction yet
+    scored = numpy.isfinite(rf.oob_decision_function_).all(axis=1) & (rf.oob_decision_function_.sum(axis=1) > 0)
+    oob_prediction = rf.classes_[numpy.argmax(rf.oob_decision_function_[scored], axis=1)]
+    return sklearn.metrics.balanced_accuracy_score(numpy.asarray(y)[scored], oob_prediction)
+
+
+def fit_adaptive(x, y, step=50, max_estimators=1000, tol=0.002, patience=3, n_jobs=-1):
+    """Grow the forest step trees at a time (warm start) and stop once the OOB balanced accuracy has changed by less
+       than tol for patience increments in a row, or max_estimators is reached.
+       Returns the forest and its OOB curve: accuracy and fit time of each increment."""
+    import sklearn.ensemble
+
+    rf = sklearn.ensemble.RandomForestClassifier(n_estimators=0, oob_score=True, random_state=0, n_jobs=n_jobs,
+                                                 warm_start=True)
+    curve = []
+    stable = 0
+    while rf.n_estimators < max_estimators and stable < patience:
+        rf.n_estimators = min(rf.n_estimators + step, max_estimators)
+        start = time.perf_counter()
+        with instrumentation.stage('RandomForestClassifier.fit', x, n_estimators=rf.n_estimators):
+            rf.fit(x, y)
+        seconds = time.perf_counter() - start
+
+        accuracy = get_oob_balanced_accuracy(rf, y)
+        stable = stable + 1 if curve and abs(accuracy - curve[-1]['oob_balanced_accuracy']) < tol else 0
+        curve.append({'n_estimators': rf.n_estimators, 'oob_balanced_accuracy': accuracy, 'seconds': seconds})
+        print('{n_estimators} trees: OOB balanced accuracy {oob_balanced_accuracy:.4f} ({seconds:.1f}s)'.format(
+            **curve[-1]))
+    return rf, pandas.DataFrame(curve)
+
+
+def save_figure(path):
+    import matplotlib.pyplot
+
+    with instrumentation.stage('savefig', path=path):
+        matplotlib.pyplot.savefig(path)
+
+
+def report(rf, feature_names, y):
+    import matplotlib.pyplot
+    import seaborn
+    import sklearn.metrics
+
+    oob_prediction = pandas.Series(rf.classes_[numpy.argmax(rf.oob_decision_function_,axis=1)], index=y.index)
+    print(sklearn.metrics.classification_report(y, oob_prediction))
+    print(sklearn.metrics.balanced_accuracy_score(y, oob_prediction))
+
+    # Make plots
+    os.makedirs('figures', exist_ok=True)
+
+    matplotlib.pyplot.figure()
+    pandas.Series(rf.feature_importances_, index=feature_names).sort_values(ascending=False).head(10).plot(kind='bar')
+    matplotlib.pyplot.xlabel('Features')
+    matplotlib.pyplot.ylabel('Importance')
+    matplotlib.pyplot.tight_layout()
+    save_figure(os.path.join('figures', 'rf_variable_importance.png'))
+
+    matplotlib.pyplot.figure()
+    seaborn.heatmap(pandas.DataFrame(sklearn.metrics.confusion_matrix(y, oob_prediction),
+                                     index=rf.classes_,
+                                     columns=rf.classes_),
+                    cmap='Blues',
+                    cbar_kws={'label': 'Number of products'})
+    matplotlib.pyplot.xlabel('Golden truth')
+    matplotlib.pyplot.ylabel('Out-of-bag predictions')
+    matplotlib.pyplot.tight_layout()
+    save_figure(os.path.join('figures', 'rf_confusion_matrix.png'))
+
+
+def save_model(rf, encoder, path=MODEL_FILE):
+    # Keep the feature encoder with the forest, so that new records are encoded exactly as the training data
+    import joblib
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    joblib.dump({'model': rf, 'encoder': encoder}, path)
+
+
+def load_model(path=MODEL_FILE):
+    import joblib
+
+    model = joblib.load(path)
+    return model['model'], model['encoder']
+
+
+def add_arguments(parser):
+    parser.add_argument('--model', default=MODEL_FILE, help='Where to save the fitted model.')
+    parser.add_argument('--jobs', type=int, default=-1, help='Number of cores to train on (default: all).')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Grow the forest until the OOB balanced accuracy stabilises instead of fitting 1000 trees.')
+    parser.add_argument('--step', type=int, default=50, help='Trees added per increment in adaptive mode.')
+    parser.add_argument('--max-estimators', type=int, default=1000, help='Largest forest in adaptive mode.')
+    parser.add_argument('--tol', type=float, default=0.002, help='OOB accuracy change considered stable.')
+    parser.add_argument('--patience', type=int, default=3, help='Stable increments in a row before stopping.')
+    parser.add_argument('--trace', help='Record the time and memory used by each stage to this JSON trace file.')
+
+
+def main(args):
+    if args.trace:
+        instrumentation.enable()
+
+    data = prepare_data.get_prepared_data()
+    rf, encoder, y, curve = train(data, n_jobs=args.jobs, adaptive=args.adaptive, step=args.step,
+                                  max_estimators=args.max_estimators, tol=args.tol, patience=args.patience)
+    # Save the model before plotting, so that a failing report does not lose it
+    save_model(rf, encoder, args.model)
+    if curve is not None:
+        curve.to_csv(os.path.splitext(args.model)[0] + '_oob_curve.csv', index=False)
+    report(rf, encoder.feature_names_, y)
+    if args.trace:
+        instrumentation.write_trace(args.trace)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the defect model, report its out-of-bag performance and save it.')
+    add_arguments(parser)
+    main(parser.parse_args())
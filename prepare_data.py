@@ -1,56 +1,68 @@
+import argparse
+import glob
+import hashlib
 import os
 
+import numpy
 import pandas
 
-pandas.set_option('display.max_columns', 10)
-pandas.set_option('display.width', 150)
+import instrumentation
+import schema
 
+DATA_FILE = os.path.join('data', 'WIDS_Dataset_Full_Aug18_Jan19_Adjusted.csv.gz')
+CACHE_DIR = 'cache'
 
-def read_data():
+
+@instrumentation.traced
+def read_data(path=DATA_FILE):
     """Read in dataset and return a dataframe with:
        - index: row_id
        - columns: original and derived features. Derived features include:
          - Result_Type_Bin: categorical feature (PASS or DEFECT)."""
 
     # data = pandas.read_csv(os.path.join('data', 'WIDS_Project_Generated_Data_10K.csv'), index_col=0)
-    data = pandas.read_csv(os.path.join('data', 'WIDS_Dataset_Full_Aug18_Jan19_Adjusted.csv.gz'),
-                           index_col=0,
-                           dtype={
-                               'Zone1Position': 'category',
-                               'Zone2Position': 'category',
-                               'Zone3Position': 'category',
-                               'SKU': 'category',
-                               'Block_Num': 'category',
-                               'Block_Position': 'category',
-                               'Result_Type': 'category',
-                               'Passed_QC_Count': 'Int64',
-                               'Defect_1_Count': 'Int64',
-                               'Defect_2_Count': 'Int64',
-                               'Defect_3_Count': 'Int64',
-                               'Defect_4_Count': 'Int64',
-                           })
+    return format_data(pandas.read_csv(path, index_col=0, dtype=schema.READ_DTYPES))
+
+
+def read_data_chunks(path=DATA_FILE, chunksize=100000):
+    # Same as read_data, but yields the dataset in chunks of at most chunksize rows, with the same count types in all
+    for chunk in pandas.read_csv(path, index_col=0, dtype=schema.READ_DTYPES, chunksize=chunksize):
+        yield format_data(chunk, schema.STREAM_COUNT_DTYPE)
+
+
+def format_data(data, count_dtype=None):
     data.index.name = 'row_id'
 
+    # Pin categories so that they do not depend on which values happen to be present in the data read
+    for col, categories in schema.CATEGORIES.items():
+        unknown = set(data[col].cat.categories).difference(categories)
+        if unknown:
+            raise ValueError('Unexpected values in {}: {}'.format(col, sorted(unknown)))
+        data[col] = data[col].cat.set_categories(categories)
+    schema.apply_schema(data, count_dtype)
+
     # Add binary Result_Type_Bin variable
     data['Result_Type_Bin'] = data.Result_Type.map({
         'PASS': 'PASS',
         'Defect_1': 'DEFECT',
         'Defect_2': 'DEFECT',
         'Defect_3': 'DEFECT',
-        'Defect_4': 'DEFECT'}).astype('category')
+        'Defect_4': 'DEFECT'}).astype(schema.RESULT_TYPE_BIN)
 
     return data
 
 
-def impute_data_zone1(data):
+@instrumentation.traced
+def impute_data_zone1(data, verbose=True):
     # Columns related to position in zone1
     zone1_pos = ['Zone1Position', 'Zone1_Row_Num', 'Zone1_Col_Num', 'Zone1_Left_Block_Bin', 'Zone1_Right_Block_Bin', 'Zone1_Area']
 
     # Investigate patterns of available data:
     # print(data[zone1_pos].notna().groupby(zone1_pos).size())
 
-    print('{:.2f}% fraction of samples have positional information for Zone1'.format(
-        100 * data.Zone1Position.notna().mean()))
+    if verbose:
+        print('{:.2f}% fraction of samples have positional information for Zone1'.format(
+            100 * data.Zone1Position.notna().mean()))
 
     # Set Row based on Zone1_Area where we can.
     data.loc[data.Zone1_Area.isin(['Top Right', 'Top Left']), 'Zone1_Row_Num'] = 1
@@ -69,19 +81,22 @@ def impute_data_zone1(data):
     data.drop(columns=set(zone1_pos).difference(['Zone1Position']), inplace=True)
 
     # Investigate remaining patterns of missing data:
-    print('{:.2f}% fraction of samples have positional information for Zone1 after imputation.'.format(
-        100 * data.Zone1Position.notna().mean()))
+    if verbose:
+        print('{:.2f}% fraction of samples have positional information for Zone1 after imputation.'.format(
+            100 * data.Zone1Position.notna().mean()))
 
 
-def impute_data_zone2(data):
+@instrumentation.traced
+def impute_data_zone2(data, verbose=True):
     # Columns related to position in zone2
     zone2_pos = ['Zone2Position', 'Zone2_Row_Num', 'Zone2_Col_num']
 
     # Investigate patterns of available data:
     # print(data[zone2_pos].notna().groupby(zone2_pos).size())
 
-    print('{:.2f}% fraction of samples have positional information for Zone2'.format(
-        100 * data.Zone2Position.notna().mean()))
+    if verbose:
+        print('{:.2f}% fraction of samples have positional information for Zone2'.format(
+            100 * data.Zone2Position.notna().mean()))
 
     # Input values in 'Zone2Position' based on row and col position
     data.loc[(data.Zone2_Row_Num == 1) & (data.Zone2_Col_num == 1), 'Zone2Position'] = '1'
@@ -91,19 +106,22 @@ def impute_data_zone2(data):
 
     data.drop(columns=set(zone2_pos).difference(['Zone2Position']), inplace=True)
 
-    print('{:.2f}% fraction of samples have positional information for Zone2 after imputation.'.format(
-        100 * data.Zone2Position.notna().mean()))
+    if verbose:
+        print('{:.2f}% fraction of samples have positional information for Zone2 after imputation.'.format(
+            100 * data.Zone2Position.notna().mean()))
 
 
-def impute_data_zone3(data):
+@instrumentation.traced
+def impute_data_zone3(data, verbose=True):
     # Columns related to position in zone3
     zone3_pos = ['Zone3Position', 'Zone3_Row_Num', 'Zone3_Col_Num', 'Zone3_Area']
 
     # Investigate patterns of available data:
     # print(data[zone3_pos].notna().groupby(zone3_pos).size())
 
-    print('{:.2f}% fraction of samples have positional information for Zone3'.format(
-        100 * data.Zone3Position.notna().mean()))
+    if verbose:
+        print('{:.2f}% fraction of samples have positional information for Zone3'.format(
+            100 * data.Zone3Position.notna().mean()))
 
     # Set Position based on Zone3_Area and Row/Column where we can.
     data.loc[(data.Zone3_Area == 'Top Left') & (data.Zone3_Col_Num == 2), 'Zone3Position'] = '2'
@@ -121,15 +139,137 @@ def impute_data_zone3(data):
 
     data.drop(columns=set(zone3_pos).difference(['Zone3Position']), inplace=True)
 
-    print('{:.2f}% fraction of samples have positional information for Zone3 after imputation.'.format(
-        100 * data.Zone3Position.notna().mean()))
+    if verbose:
+        print('{:.2f}% fraction of samples have positional information for Zone3 after imputation.'.format(
+            100 * data.Zone3Position.notna().mean()))
 
     # Recreate other positional variables based on Zone3Position
     data['Zone3_Area'] = data.Zone3Position.map(
         {'1': 'Top Left', '2': 'Top Left', '3': 'Bottom Right',
-         '4': 'Top Left', '5': 'Bottom Right', '6': 'Bottom Right'}).astype('category')
-
-
+         '4': 'Top Left', '5': 'Bottom Right', '6': 'Bottom Right'}).astype(
+        pandas.CategoricalDtype(['Bottom Right', 'Top Left']))
+
+
+# Layout of the positions in each zone. Positions are numbered row by row on a grid of the given shape (rows, cols).
+# Where row and column are both known they determine the position. Otherwise:
+# - area_rows: the area implies the row (it overrides the recorded row number);
+# - area_positions: (area, 'row' or 'col', value, position) rules, where later rules take precedence over earlier ones.
+# Columns in drop are redundant with the position once imputed, derived_area recreates an area column from positions.
+ZONE_LAYOUTS = {
+    'Zone1': {
+        'position': 'Zone1Position',
+        'row': 'Zone1_Row_Num',
+        'col': 'Zone1_Col_Num',
+        'area': 'Zone1_Area',
+        'shape': (2, 4),
+        'area_rows': {'Top Left': 1, 'Top Right': 1, 'Bottom Left': 2, 'Bottom Right': 2},
+        'area_positions': [],
+        'drop': ['Zone1_Row_Num', 'Zone1_Col_Num', 'Zone1_Left_Block_Bin', 'Zone1_Right_Block_Bin', 'Zone1_Area'],
+    },
+    'Zone2': {
+        'position': 'Zone2Position',
+        'row': 'Zone2_Row_Num',
+        'col': 'Zone2_Col_num',
+        'area': None,
+        'shape': (2, 2),
+        'area_rows': {},
+        'area_positions': [],
+        'drop': ['Zone2_Row_Num', 'Zone2_Col_num'],
+    },
+    'Zone3': {
+        'position': 'Zone3Position',
+        'row': 'Zone3_Row_Num',
+        'col': 'Zone3_Col_Num',
+        'area': 'Zone3_Area',
+        'shape': (2, 3),
+        'area_rows': {},
+        'area_positions': [
+            ('Top Left', 'col', 2, 2),
+            ('Top Left', 'row', 2, 4),
+            ('Bottom Right', 'row', 1, 3),
+            ('Bottom Right', 'col', 2, 5),
+        ],
+        'drop': ['Zone3_Row_Num', 'Zone3_Col_Num', 'Zone3_Area'],
+        'derived_area': {1: 'Top Left', 2: 'Top Left', 3: 'Bottom Right',
+                         4: 'Top Left', 5: 'Bottom Right', 6: 'Bottom Right'},
+    },
+}
+
+
+def get_layout_areas(layout):
+    return sorted(set(layout['area_rows']).union(rule[0] for rule in layout['area_positions']))
+
+
+def compile_zone_layout(layout):
+    """Return a lookup table indexed by [area code, row code, col code] holding the imputed position, where code 0
+       stands for a missing (or out of range) value and position 0 for "keep the recorded position"."""
+    n_rows, n_cols = layout['shape']
+    areas = [None] + get_layout_areas(layout)
+
+    table = numpy.zeros((len(areas), n_rows + 1, n_cols + 1), dtype=numpy.int8)
+    for area_code, area in enumerate(areas):
+        for row in range(n_rows + 1):
+            for col in range(n_cols + 1):
+                row_from_area = layout['area_rows'].get(area, row)
+                for rule_area, dim, value, position in layout['area_positions']:
+                    if rule_area == area and {'row': row_from_area, 'col': col}[dim] == value:
+                        table[area_code, row, col] = position
+                if row_from_area and col:
+                    table[area_code, row, col] = (row_from_area - 1) * n_cols + col
+    return table
+
+
+def get_grid_codes(values, size):
+    # Map 1..size to codes 1..size and everything else (including missing values) to 0
+    values = numpy.asarray(values, dtype=float)
+    valid = (values >= 1) & (values <= size) & (values == numpy.floor(values))
+    return numpy.where(valid, values, 0).astype(numpy.intp)
+
+
+@instrumentation.traced
+def impute_zone_positions(data, layouts=ZONE_LAYOUTS, verbose=True):
+    """Impute missing zone positions from the redundant row/column/area columns as described by layouts.
+       Each zone is imputed with a single lookup in a table compiled from its layout, instead of one boolean-mask
+       assignment per rule as in impute_data_zone1/2/3, which are kept as the reference implementation."""
+    for zone, layout in layouts.items():
+        position = layout['position']
+        n_rows, n_cols = layout['shape']
+
+        if verbose:
+            print('{:.2f}% fraction of samples have positional information for {}'.format(
+                100 * data[position].notna().mean(), zone))
+
+        if layout['area'] is None:
+            area_codes = numpy.zeros(len(data), dtype=numpy.intp)
+        else:
+            area_codes = pandas.Categorical(data[layout['area']], categories=get_layout_areas(layout)).codes + 1
+        imputed = compile_zone_layout(layout)[area_codes,
+                                              get_grid_codes(data[layout['row']], n_rows),
+                                              get_grid_codes(data[layout['col']], n_cols)]
+
+        # Positions are categories '1'..'n' (see schema.CATEGORIES), so the category code of position p is p - 1
+        codes = numpy.where(imputed > 0, imputed - 1, data[position].cat.codes)
+        data[position] = pandas.Categorical.from_codes(codes, dtype=data[position].dtype)
+
+        if verbose:
+            print('{:.2f}% fraction of samples have positional information for {} after imputation.'.format(
+                100 * data[position].notna().mean(), zone))
+
+    # Dropping copies the remaining columns, so drop the redundant columns of all zones at once
+    data.drop(columns=[col for layout in layouts.values() for col in layout['drop']], inplace=True)
+
+    for layout in layouts.values():
+        if 'derived_area' in layout:
+            # Area code of each position code, with a last entry -1 (missing) that missing positions (code -1) pick
+            dtype = pandas.CategoricalDtype(schema.CATEGORIES[layout['area']])
+            n_positions = len(schema.CATEGORIES[layout['position']])
+            area_codes = numpy.array([dtype.categories.get_loc(layout['derived_area'][p])
+                                      for p in range(1, n_positions + 1)] + [-1])
+            data[layout['area']] = pandas.Categorical.from_codes(area_codes[data[layout['position']].cat.codes],
+                                                                 dtype=dtype)
+
+
+@instrumentation.traced
 def impute_data_duration(data):
     # Drop AVG_Zone123_Dur as it is redundant with Total_Zone123_Dur and the 2 columns are filled in the same cases
     assert ((data.Total_Zone123_Dur.isna() == data.AVG_Zone123_Dur.isna()).all())
@@ -145,13 +285,14 @@ def impute_data_duration(data):
     # print(data[dur_cols].notna().groupby(dur_cols).size())
 
 
-def get_prepared_data():
-    data = read_data()
+def build_prepared_data(path=DATA_FILE):
+    return impute_data(read_data(path))
+
 
+@instrumentation.traced
+def impute_data(data, verbose=True):
     # Impute missing data from redundant information
-    impute_data_zone1(data)
-    impute_data_zone2(data)
-    impute_data_zone3(data)
+    impute_zone_positions(data, verbose=verbose)
     impute_data_duration(data)
 
     # # Drop entries with missing data
@@ -164,18 +305,188 @@ def get_prepared_data():
     return data
 
 
-def balance_dataset(data, varname):
+def iter_prepared_data(path=DATA_FILE, chunksize=100000):
+    """Yield the prepared dataset chunk by chunk. All preparation steps are row-wise, so peak memory depends on
+       chunksize rather than on the size of the dataset."""
+    for chunk in read_data_chunks(path, chunksize):
+        yield impute_data(chunk, verbose=False)
+
+
+def write_prepared_store(store_file, path=DATA_FILE, chunksize=100000):
+    # Prepare the dataset in chunks and append each of them as a row group of a single Parquet file
+    write_chunks(store_file, iter_prepared_data(path, chunksize))
+
+
+def write_chunks(store_file, chunks):
+    import pyarrow
+    import pyarrow.parquet
+
+    os.makedirs(os.path.dirname(store_file) or '.', exist_ok=True)
+    writer = None
+    try:
+        for chunk in chunks:
+            # Cast later chunks to the schema of the first one, e.g. for columns that are entirely missing in a chunk.
+            # The row_id is stored as a column: a range index would only be kept in the pandas metadata of the first
+            # chunk, and so read back as 0..n-1 in every row group.
+            table = pyarrow.Table.from_pandas(chunk.reset_index(), schema=writer.schema if writer else None,
+                                              preserve_index=False)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(store_file, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def iter_prepared_store(store_file, columns=None):
+    # Yield the chunks written by write_prepared_store one row group at a time
+    import pyarrow.parquet
+
+    store = pyarrow.parquet.ParquetFile(store_file)
+    if columns is not None:
+        columns = ['row_id'] + [col for col in columns if col != 'row_id']
+    for i in range(store.num_row_groups):
+        yield store.read_row_group(i, columns=columns).to_pandas().set_index('row_id')
+
+
+# Digest of each file hashed so far, by (path, size, modification time)
+_file_hashes = {}
+
+
+def get_file_hash(path, block_size=2**20):
+    # The file is only read again when its size or modification time has changed since it was last hashed
+    stat = os.stat(path)
+    key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                sha.update(block)
+        _file_hashes[key] = sha.hexdigest()
+    return _file_hashes[key]
+
+
+def get_cache_file(path=DATA_FILE):
+    # The cache is keyed on the content of the source data and on the code in this module and the schema, so that
+    # changes to the dataset, the imputation rules or the types never serve a stale prepared frame.
+    code_hash = hashlib.sha256((get_file_hash(__file__) + get_file_hash(schema.__file__)).encode()).hexdigest()
+    key = '{}_{}'.format(get_file_hash(path)[:16], code_hash[:16])
+    return os.path.join(CACHE_DIR, 'prepared_{}.feather'.format(key))
+
+
+def write_cache(data, cache_file):
+    import pyarrow.feather
+
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    # Uncompressed Arrow IPC so that later reads can memory-map the file. Categoricals are stored as dictionaries.
+    tmp_file = cache_file + '.tmp'
+    pyarrow.feather.write_feather(data.reset_index(), tmp_file, compression='uncompressed')
+    os.replace(tmp_file, cache_file)
+
+    # Only the cache for the current source data and code is ever read again
+    for stale_file in glob.glob(os.path.join(CACHE_DIR, 'prepared_*.feather')):
+        if stale_file != cache_file:
+            os.remove(stale_file)
+
+
+@instrumentation.traced
+def read_cache(cache_file):
+    import pyarrow.feather
+
+    return pyarrow.feather.read_table(cache_file, memory_map=True).to_pandas().set_index('row_id')
+
+
+def clear_cache():
+    for cache_file in glob.glob(os.path.join(CACHE_DIR, 'prepared_*.feather*')):
+        os.remove(cache_file)
+
+
+def get_prepared_data(path=DATA_FILE, use_cache=True):
+    """Return the prepared dataset, reading it from the on-disk cache when the source data and the preparation code
+       are unchanged since the cache was written."""
+    if not use_cache:
+        return build_prepared_data(path)
+
+    cache_file = get_cache_file(path)
+    if os.path.exists(cache_file):
+        return read_cache(cache_file)
+
+    data = build_prepared_data(path)
+    write_cache(data, cache_file)
+    return data
+
+
+@instrumentation.traced
+def balance_dataset(data, varname, random_state=0):
     # Create a balanced dataset, balanced on a categorical variable.
     # Sub-samples data for each category down to the number of occurrences of the least common category.
-    per_cat_n = data[varname].value_counts().min()
-    return pandas.concat([
-        sub_data.sample(per_cat_n) for _, sub_data in data.groupby(varname)
-    ])
+    return data.iloc[get_balanced_index(data[varname], random_state=random_state)]
+
+
+def get_balanced_index(labels, n_per_class=None, replace=False, n_replicates=None, random_state=0):
+    """Return the positions of a sample of labels with n_per_class positions for each (observed) class, grouped by
+       class in sorted order. n_per_class defaults to the size of the least common class; larger values upsample,
+       which requires replace. With n_replicates, return an (n_replicates, n_classes * n_per_class) array of
+       independent samples instead. Positions can index rows with iloc or slice encoded matrices without copying the
+       frame."""
+    codes, classes = pandas.factorize(labels, sort=True)
+    labelled = numpy.flatnonzero(codes >= 0)
+    codes = codes[labelled]
+    counts = numpy.bincount(codes, minlength=len(classes))
+    n_per_class = counts.min() if n_per_class is None else n_per_class
+    if n_per_class > counts.min() and not replace:
+        raise ValueError('Cannot sample {} per class without replacement, the smallest class has {} samples'.format(
+            n_per_class, counts.min()))
+
+    rng = numpy.random.RandomState(random_state)
+    n_samples = 1 if n_replicates is None else n_replicates
+    # Offsets of the start of each class in labelled, once sorted by class
+    starts = numpy.concatenate([[0], numpy.cumsum(counts)[:-1]])
+    if replace:
+        by_class = numpy.argsort(codes, kind='mergesort')
+        offsets = (rng.random_sample((n_samples, len(classes), n_per_class)) * counts[:, None]).astype(numpy.intp)
+        index = by_class[starts[:, None] + offsets]
+    else:
+        # Sorting on class + a random key in [0, 1) shuffles the positions within each class, for all samples at once
+        by_class = numpy.argsort(codes + rng.random_sample((n_samples, len(codes))), axis=1)
+        index = numpy.take_along_axis(by_class, (starts[:, None] + numpy.arange(n_per_class)).reshape(1, -1), axis=1)
+
+    index = labelled[index.reshape(n_samples, -1)]
+    return index[0] if n_replicates is None else index
+
+
+def set_display_options():
+    pandas.set_option('display.max_columns', 10)
+    pandas.set_option('display.width', 150)
 
 
 def get_costs():
     return pandas.read_excel(os.path.join('data', 'Costs.xlsx'), skiprows=1, usecols=['SKU', 'Value'], index_col='SKU')
 
 
+def add_arguments(parser):
+    parser.add_argument('--clear-cache', action='store_true', help='Invalidate the cached prepared dataset first.')
+    parser.add_argument('--store', help='Stream the prepared dataset to this Parquet file instead of caching it.')
+    parser.add_argument('--chunksize', type=int, default=100000, help='Rows per chunk when streaming to --store.')
+    parser.add_argument('--dataset', action='store_true',
+                        help='Also write the prepared dataset partitioned by month and SKU (see partitioned_store).')
+
+
+def main(args):
+    set_display_options()
+    if args.clear_cache:
+        clear_cache()
+    if args.store:
+        write_prepared_store(args.store, chunksize=args.chunksize)
+    else:
+        get_prepared_data()
+    if args.dataset:
+        # partitioned_store imports this module
+        import partitioned_store
+        print(partitioned_store.build_dataset())
+
+
 if __name__ == '__main__':
-    data = get_prepared_data()
+    parser = argparse.ArgumentParser(description='Prepare the dataset and cache the result.')
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,198 @@
+import argparse
+
+import numpy
+import pandas
+
+import aggregate_cube
+import opportunity_trees
+import schema
+import zone_path_sankey
+
+RESULT_TYPES = schema.CATEGORIES['Result_Type']
+
+
+def get_path_tensor(data, zone_cols, sku_groups):
+    """Return the number of products per SKU group, position in each zone and Result_Type, as an array of shape
+       (groups, positions of the 1st zone, ..., positions of the last zone, result types), from the path counts of
+       zone_path_sankey.get_paths. Products of unknown position are left out."""
+    paths = zone_path_sankey.get_paths(data, zone_cols, group_cols=['SKU']).reset_index(name='Count')
+    cols = ['SKU'] + zone_cols + ['Result_Type']
+    codes = [pandas.Categorical(paths[col], categories=schema.CATEGORIES[col]).codes for col in cols]
+    known = numpy.all([code >= 0 for code in codes], axis=0)
+
+    by_sku = numpy.zeros([len(schema.CATEGORIES[col]) for col in cols])
+    numpy.add.at(by_sku, tuple(code[known] for code in codes), paths.Count.to_numpy()[known])
+    membership = numpy.array([numpy.isin(schema.CATEGORIES['SKU'], skus) for _, skus in sku_groups], dtype=float)
+    return numpy.tensordot(membership, by_sku, axes=1)
+
+
+def get_odds_ratio(through_defects, through, defects, total):
+    # Odds ratio of the defect through a position vs. elsewhere, with 0.5 added to each cell of the 2x2 table
+    others = total - through - defects + through_defects
+    return ((through_defects + 0.5) * (others + 0.5) /
+            ((through - through_defects + 0.5) * (defects - through_defects + 0.5)))
+
+
+def get_enrichment(through_defects, through, defects, total):
+    """Return the odds ratio, the chi-square p-value and the one-sided Fisher exact p-value (of the defect being more
+       frequent through the position than elsewhere) of 2x2 tables given as arrays of the same shape: products with
+       the defect through the position, products through the position, products with the defect and all products."""
+    import scipy.stats
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        chi2 = (total * (through_defects * total - through * defects) ** 2 /
+                (through * (total - through) * defects * (total - defects)))
+    return (get_odds_ratio(through_defects, through, defects, total),
+            scipy.stats.chi2.sf(chi2, 1),
+            scipy.stats.hypergeom.sf(through_defects - 1, total, defects, through))
+
+
+def sum_to(tensor, axes):
+    # Sum tensor (as returned by get_path_tensor) over all zone axes but the given ones, in their order
+    zone_axes = range(1, tensor.ndim - 1)
+    return tensor.sum(axis=tuple(axis for axis in zone_axes if axis not in axes))
+
+
+def scan_positions(data, sku_groups=opportunity_trees.SKU_GROUPS, defects=opportunity_trees.DEFECTS):
+    """Return the enrichment of each defect through each zone position, for each SKU group, as a dataframe with
+       columns group, defect, zone, position, products (through the position), defects (among them), rate,
+       rate_elsewhere, odds_ratio, chi2_p, fisher_p, residual_odds_ratio, residual_position, score and rank.
+
+       A root cause at a position makes its products defective whatever the positions they went through in the other
+       zones, so that the positions sending many products to it look enriched too. Leaving out the products of the
+       root cause position removes the enrichment of all other positions, while leaving out those of a position that
+       only feeds it does not. residual_odds_ratio is the largest odds ratio of a position of another zone
+       (residual_position) among the products not going through the position, and positions are ranked within each
+       group and defect by score: the log odds ratio of the position minus the log residual odds ratio.
+
+       data can be the row-level data or an aggregate cube."""
+    zone_cols = zone_path_sankey.get_zone_columns(data)
+    tensor = get_path_tensor(data, zone_cols, sku_groups)
+    defect_codes = [RESULT_TYPES.index(defect) for defect in defects]
+    total = tensor.sum(axis=tuple(range(1, tensor.ndim)))
+    total_defects = tensor.sum(axis=tuple(range(1, tensor.ndim - 1)))[:, defect_codes]
+
+    # Products through each position of each zone: (groups, positions, defects) and (groups, positions)
+    marginals = [sum_to(tensor, [zone + 1]) for zone in range(len(zone_cols))]
+    through_defects = [marginal[..., defect_codes] for marginal in marginals]
+    through = [marginal.sum(axis=-1) for marginal in marginals]
+
+    scans = []
+    for zone, zone_col in enumerate(zone_cols):
+        odds_ratio, chi2_p, fisher_p = get_enrichment(through_defects[zone], through[zone][..., None],
+                                                      total_defects[:, None], total[:, None, None])
+
+        # Odds ratios of the positions of the other zones among the products not going through each position:
+        # (groups, positions of the other zone, positions, defects)
+        residuals, residual_positions = [], []
+        for other, other_col in enumerate(zone_cols):
+            if other == zone:
+                continue
+            pairs = sum_to(tensor, sorted([zone + 1, other + 1]))
+            if other > zone:
+                pairs = pairs.swapaxes(1, 2)
+            other_through = (through[other][:, :, None] - pairs.sum(axis=-1))[..., None]
+            odds_ratios = get_odds_ratio(through_defects[other][:, :, None] - pairs[..., defect_codes], other_through,
+                                         (total_defects[:, None] - through_defects[zone])[:, None],
+                                         (total[:, None] - through[zone])[:, None, :, None])
+            # Positions left without products are no evidence either way
+            residuals.append(numpy.where(other_through > 0, odds_ratios, 1.0))
+            residual_positions += ['{}{}'.format(other_col, position) for position in schema.CATEGORIES[other_col]]
+        residuals = numpy.concatenate(residuals, axis=1)
+
+        positions = schema.CATEGORIES[zone_col]
+        index = pandas.MultiIndex.from_product([[group for group, _ in sku_groups], positions, defects],
+                                               names=['group', 'position', 'defect'])
+        products = numpy.broadcast_to(through[zone][..., None], odds_ratio.shape)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            scan = pandas.DataFrame({
+                'zone': zone + 1,
+                'products': products.ravel(),
+                'defects': through_defects[zone].ravel(),
+                'rate': (through_defects[zone] / products).ravel(),
+                'rate_elsewhere': ((total_defects[:, None] - through_defects[zone]) /
+                                   (total[:, None, None] - products)).ravel(),
+                'odds_ratio': odds_ratio.ravel(),
+                'chi2_p': chi2_p.ravel(),
+                'fisher_p': fisher_p.ravel(),
+                'residual_odds_ratio': residuals.max(axis=1).ravel(),
+                'residual_position': numpy.array(residual_positions)[residuals.argmax(axis=1)].ravel(),
+            }, index=index)
+        scans.append(scan.reset_index())
+
+    scan = pandas.concat(scans, ignore_index=True)
+    scan = scan[scan.products > 0]
+    scan['score'] = numpy.log(scan.odds_ratio) - numpy.log(scan.residual_odds_ratio)
+    scan['rank'] = scan.groupby(['group', 'defect']).score.rank(ascending=False, method='min').astype(int)
+    columns = ['group', 'defect', 'zone', 'position'] + [col for col in scan.columns
+                                                         if col not in ('group', 'defect', 'zone', 'position')]
+    return scan.sort_values(['group', 'defect', 'rank'])[columns].reset_index(drop=True)
+
+
+def get_conditional_rates(data, sku_groups=opportunity_trees.SKU_GROUPS, defects=opportunity_trees.DEFECTS):
+    """Return the rate of each defect given each upstream position and each position of a later zone, for each SKU
+       group, as a dataframe with columns group, defect, upstream_zone, upstream_position, zone, position, products
+       (through both), rate (among them), rate_elsewhere (through the upstream position but not the position) and
+       upstream_rate (through the upstream position). A root cause at the position shows as a high rate and a
+       rate_elsewhere close to the group rate for all its upstream positions."""
+    zone_cols = zone_path_sankey.get_zone_columns(data)
+    tensor = get_path_tensor(data, zone_cols, sku_groups)
+    defect_codes = [RESULT_TYPES.index(defect) for defect in defects]
+
+    rates = []
+    for upstream, upstream_col in enumerate(zone_cols):
+        upstream_counts = sum_to(tensor, [upstream + 1])
+        for zone in range(upstream + 1, len(zone_cols)):
+            pairs = sum_to(tensor, [upstream + 1, zone + 1])
+            pair_defects = pairs[..., defect_codes]
+            products = pairs.sum(axis=-1)[..., None]
+            upstream_products = upstream_counts.sum(axis=-1)[:, :, None, None]
+            upstream_defects = upstream_counts[:, :, None, defect_codes]
+            index = pandas.MultiIndex.from_product([[group for group, _ in sku_groups],
+                                                    schema.CATEGORIES[upstream_col],
+                                                    schema.CATEGORIES[zone_cols[zone]], defects],
+                                                   names=['group', 'upstream_position', 'position', 'defect'])
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                pair_rates = pandas.DataFrame({
+                    'upstream_zone': upstream + 1,
+                    'zone': zone + 1,
+                    'products': numpy.broadcast_to(products, pair_defects.shape).ravel(),
+                    'rate': (pair_defects / products).ravel(),
+                    'rate_elsewhere': ((upstream_defects - pair_defects) / (upstream_products - products)).ravel(),
+                    'upstream_rate': numpy.broadcast_to(upstream_defects / upstream_products,
+                                                        pair_defects.shape).ravel(),
+                }, index=index)
+            rates.append(pair_rates.reset_index())
+
+    rates = pandas.concat(rates, ignore_index=True)
+    columns = ['group', 'defect', 'upstream_zone', 'upstream_position', 'zone', 'position', 'products', 'rate',
+               'rate_elsewhere', 'upstream_rate']
+    return rates.loc[rates.products > 0, columns].reset_index(drop=True)
+
+
+def add_arguments(parser):
+    parser.add_argument('--defects', nargs='+', default=opportunity_trees.DEFECTS)
+    parser.add_argument('--top', type=int, default=3, help='Positions to print for each SKU group and defect.')
+    parser.add_argument('--max-p', type=float, default=0.01,
+                        help='Only print positions whose enrichment has a Fisher p-value below this.')
+    parser.add_argument('--output', help='CSV file to write the enrichment of all positions to.')
+    parser.add_argument('--conditional', help='CSV file to write the rates given each upstream position to.')
+
+
+def main(args):
+    cube = aggregate_cube.get_cube()
+    scan = scan_positions(cube, defects=args.defects)
+    if args.output:
+        scan.to_csv(args.output, index=False)
+    if args.conditional:
+        get_conditional_rates(cube, defects=args.defects).to_csv(args.conditional, index=False)
+
+    significant = scan[scan.fisher_p < args.max_p]
+    top = significant[significant.groupby(['group', 'defect']).score.rank(ascending=False, method='first') <= args.top]
+    print(top.to_string(index=False))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rank the zone positions by how well they explain each defect.')
+    add_arguments(parser)
+    main(parser.parse_args())
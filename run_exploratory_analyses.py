@@ -1,19 +1,23 @@
+import argparse
 import os
+import sys
 
-import graphviz
 import matplotlib.pyplot
 import numpy
-import pandas
 import seaborn
-import sklearn.tree
 import statsmodels.graphics.mosaicplot
 
+import aggregate_cube
+import build_figures
+import defect_surfaces
+import feature_associations
+import instrumentation
+import opportunity_trees
+import partitioned_store
 import prepare_data
+import time_series
 import zone_path_sankey
 
-pandas.set_option('display.max_columns', 10)
-pandas.set_option('display.width', 150)
-
 
 def plot_var_by_SKU_and_result_type(data, cols):
     data2 = data.copy()
@@ -31,31 +35,44 @@ def plot_var_by_SKU_and_result_type(data, cols):
                     data=data2.reset_index())
 
 
-def plot_var_by_date_and_SKU(data, cols):
-    data = data.copy()
-    data.SKU = data.SKU.astype('object')
-    data.set_index(['Date', 'SKU', 'Result_Type'], inplace=True)
-    data = data[cols].stack().to_frame('value')
-    data.index.names = ['Date', 'SKU', 'Result_Type', 'vars']
-
-    g = seaborn.relplot(x='Date', y='value',
-                        err_style="bars",
-                        row='SKU',
-                        col='vars',
-                        hue='SKU',
-                        kind='line',
-                        palette='Set1',
-                        data=data.reset_index())
-    g.set_xticklabels(rotation=90)
+def plot_interval(x, y, lower, upper, **kwargs):
+    # Line of y over x with error bars from lower to upper, for FacetGrid.map
+    matplotlib.pyplot.errorbar(x, y, yerr=[y - lower, upper - y], **kwargs)
+
+
+def plot_daily_series(series):
+    # Daily estimates with their intervals (see time_series), one panel per SKU and variable
+    g = seaborn.FacetGrid(series, row='SKU', col='vars', hue='SKU', palette='Set1')
+    g.map(plot_interval, 'Date', 'value', 'lower', 'upper')
+    for ax in g.axes.flat:
+        ax.tick_params(axis='x', labelrotation=90)
     matplotlib.pyplot.tight_layout()
 
 
-def plot_correlation_among_features(data, cols):
-    data = data.copy()
-    data = data[cols]
+def plot_var_by_date_and_SKU(data, cols, window=1):
+    # Daily mean of each of cols per SKU with its 95% interval, averaged over the last window days. For the count
+    # columns, which are running sums, this is the level of the counters
+    plot_daily_series(time_series.get_daily_means(data, cols, window))
+
+
+def plot_result_type_rates_by_date_and_SKU(data, result_types, window=7):
+    # Daily share of the products of each of result_types per SKU with its 95% Wilson interval, over the last window
+    # days
+    plot_daily_series(time_series.get_daily_rates(data, result_types, window))
+
+
+def cache_feature_associations(data):
+    # In the figure worker process, as the other figure tasks: a pool of its own would compete with them for the cores
+    feature_associations.get_association_matrix(data, n_jobs=1)
+
+
+def plot_correlation_among_features(data, cols=None):
+    # Association among different features, numerical and categorical, sliced from the cached full matrix. Computed
+    # in-process when not cached yet as figure tasks run in worker processes
+    corr = feature_associations.get_association_matrix(data, n_jobs=1)
+    if cols is not None:
+        corr = corr.loc[cols, cols]
 
-    # Correlation among different features
-    corr = data.corr()
     mask = numpy.zeros_like(corr)
     mask[numpy.triu_indices_from(mask)] = True
     f = matplotlib.pyplot.figure()
@@ -88,26 +105,27 @@ def plot_paired_grid(data, grouping_var, cols):
 
 
 def plot_cat_data_association(data, cols, name):
-    statsmodels.graphics.mosaicplot.mosaic(data.groupby(cols).size())
+    statsmodels.graphics.mosaicplot.mosaic(aggregate_cube.count_by(data, cols))
     matplotlib.pyplot.savefig(os.path.join('figures', name+'.png'))
 
 
 def plot_cost_defect_association(data, costs):
-    statsmodels.graphics.mosaicplot.mosaic(data.join(costs, on='SKU').groupby(['SKU', 'Result_Type']).Value.sum())
+    values = aggregate_cube.with_value(data, costs).groupby(['SKU', 'Result_Type']).Value.sum()
+    statsmodels.graphics.mosaicplot.mosaic(values)
     matplotlib.pyplot.savefig(os.path.join('figures', 'SKU_vs_Result_Type_costs.png'))
 
 
 def plot_zone_position_defect(data):
     fig, ax = matplotlib.pyplot.subplots(1, 3)
-    data.groupby(['Zone1Position', 'Result_Type']).size().unstack().plot(kind='bar', stacked=True, ax=ax[0])
-    data.groupby(['Zone2Position', 'Result_Type']).size().unstack().plot(kind='bar', stacked=True, ax=ax[1])
-    data.groupby(['Zone3Position', 'Result_Type']).size().unstack().plot(kind='bar', stacked=True, ax=ax[2])
+    aggregate_cube.count_by(data, ['Zone1Position', 'Result_Type']).unstack().plot(kind='bar', stacked=True, ax=ax[0])
+    aggregate_cube.count_by(data, ['Zone2Position', 'Result_Type']).unstack().plot(kind='bar', stacked=True, ax=ax[1])
+    aggregate_cube.count_by(data, ['Zone3Position', 'Result_Type']).unstack().plot(kind='bar', stacked=True, ax=ax[2])
     matplotlib.pyplot.savefig(os.path.join('figures', 'defects_by_position.png'))
     matplotlib.pyplot.savefig(os.path.join('figures', 'defects_by_position.pdf'))
 
 
 def plot_opportunities(data, costs):
-    data2 = data.join(costs, on='SKU')
+    data2 = aggregate_cube.with_value(data, costs)
     data2 = data2[data2.Result_Type != 'PASS']
     data2.SKU.replace(['B003', 'C005', 'X007', 'Z009'], 'NotA001', inplace=True)
     opportunities = data2.groupby(['SKU', 'Result_Type']).Value.sum().sort_values(ascending=False) / 1e6
@@ -118,35 +136,23 @@ def plot_opportunities(data, costs):
     matplotlib.pyplot.savefig(os.path.join('figures', 'opportunities.png'))
 
 
-def analyze_opportunity1(data):
-    # Analyze root cause of opportunity 1 defects (Defect_2 in NonA001 SKUs)
-    data2 = data[(data.SKU != 'A001') & data.Result_Type.isin(['PASS', 'Defect_2'])].dropna()
-    x = pandas.get_dummies(data2.drop(columns=['Result_Type_Bin', 'Result_Type', 'Date', 'SKU']))
-    tree = sklearn.tree.DecisionTreeClassifier(min_samples_split=1000, min_samples_leaf=500,
-                                               min_impurity_split=0.1).fit(x, data2.Result_Type.astype('object'))
-    graph = sklearn.tree.export_graphviz(tree,
-                                         impurity=False,
-                                         precision=2,
-                                         special_characters=True,
-                                         max_depth=3,
-                                         feature_names=x.columns,
-                                         class_names=tree.classes_,
-                                         filled=True,
-                                         rounded=True,
-                                         proportion=True)
-    graphviz.Source(graph).render(os.path.join('figures', 'opportunity1_tree'), format='png')
-    graphviz.Source(graph).render(os.path.join('figures', 'opportunity1_tree'), format='pdf')
+def analyze_opportunity(dataset, opportunity):
+    # Only the partitions of the SKUs of the opportunity are read. The opportunity, with its tree parameters, is an
+    # argument of the figure tasks so that changing them rebuilds the trees
+    data = partitioned_store.load(dataset, filters=opportunity_trees.get_filters(opportunity))
+    opportunity_trees.fit_opportunity_trees(data, [opportunity], n_jobs=1)
 
 
 
-def plot_opportunity1_partial_dependency_plot(data):
-    data2 = data[(data.Zone3Position == '6') & (data.SKU != 'A001') & data.Result_Type.isin(['PASS', 'Defect_2'])].copy()
+def plot_opportunity1_partial_dependency_plot(dataset):
+    data2 = partitioned_store.load(dataset, ['Zone1_Humidity_Min', 'Zone1_Temp_Range', 'Result_Type'],
+                                   [('Zone3Position', '==', '6'), ('SKU', '!=', 'A001'),
+                                    ('Result_Type', 'in', ['PASS', 'Defect_2'])])
 
     data2['HasDefect'] = data2.Result_Type != 'PASS'
-    groups = data2.groupby([pandas.cut(data2.Zone1_Humidity_Min, range(16, 53), precision=0),
-                            pandas.cut(data2.Zone1_Temp_Range, range(0, 23), precision=0)])
-    data3 = groups.HasDefect.mean().unstack()
-    counts = groups.size().unstack(fill_value=0).values # Count number of samples for each group
+    data3, counts = defect_surfaces.get_defect_rate_frames(data2.Zone1_Humidity_Min, data2.Zone1_Temp_Range,
+                                                           data2.HasDefect, range(16, 53), range(0, 23))
+    counts = counts.values # Count number of samples for each group
 
     matplotlib.pyplot.figure()
     cmap = matplotlib.colors.LinearSegmentedColormap.from_list('red_blue', ['#e31a1c', '#1f78b4'])
@@ -165,28 +171,9 @@ def plot_opportunity1_partial_dependency_plot(data):
     matplotlib.pyplot.savefig(os.path.join('figures', 'opportunity1_partial_dependency_alpha.pdf'))
 
 
-def analyze_opportunity2(data):
-    # Analyze root cause of opportunity 2 defects (Defect_1 in A001 SKUs)
-    data2 = data[(data.SKU == 'A001') & data.Result_Type.isin(['PASS', 'Defect_1'])].dropna()
-    x = pandas.get_dummies(data2.drop(columns=['Result_Type_Bin', 'Result_Type', 'Date', 'SKU']))
-    tree = sklearn.tree.DecisionTreeClassifier(min_samples_split=1000, min_samples_leaf=100,
-                                               min_impurity_split=0.1).fit(x, data2.Result_Type.astype('object'))
-    graph = sklearn.tree.export_graphviz(tree,
-                                         impurity=False,
-                                         precision=2,
-                                         special_characters=True,
-                                         max_depth=3,
-                                         feature_names=x.columns,
-                                         class_names=tree.classes_,
-                                         filled=True,
-                                         rounded=True,
-                                         proportion=True)
-    graphviz.Source(graph).render(os.path.join('figures', 'opportunity2_tree'), format='png')
-    graphviz.Source(graph).render(os.path.join('figures', 'opportunity2_tree'), format='pdf')
-
-
-def plot_opportunity2_partial_dependency_plot(data):
-    data2 = data[(data.SKU == 'A001') & data.Result_Type.isin(['PASS', 'Defect_1'])].copy()
+def plot_opportunity2_partial_dependency_plot(dataset):
+    data2 = partitioned_store.load(dataset, ['Zone1_Temp_Range', 'Result_Type'],
+                                   [('SKU', '==', 'A001'), ('Result_Type', 'in', ['PASS', 'Defect_1'])])
 
     data2['HasDefect'] = data2.Result_Type != 'PASS'
     data2['Zone1_Temp_Range'] = data2.Zone1_Temp_Range.round(0)
@@ -198,29 +185,10 @@ def plot_opportunity2_partial_dependency_plot(data):
     matplotlib.pyplot.savefig(os.path.join('figures', 'opportunity2_partial_dependency.pdf'))
 
 
-def analyze_opportunity3(data):
-    # Analyze root cause of opportunity 3 defects (Defect_3 in NonA001 SKUs)
-    data2 = data[(data
-                  .SKU != 'A001') & data.Result_Type.isin(['PASS', 'Defect_3'])].dropna()
-    x = pandas.get_dummies(data2.drop(columns=['Result_Type_Bin', 'Result_Type', 'Date', 'SKU']))
-    tree = sklearn.tree.DecisionTreeClassifier(min_samples_split=10, min_samples_leaf=10,
-                                               min_impurity_split=0.065).fit(x, data2.Result_Type.astype('object'))
-    graph = sklearn.tree.export_graphviz(tree,
-                                         impurity=False,
-                                         precision=2,
-                                         special_characters=True,
-                                         max_depth=3,
-                                         feature_names=x.columns,
-                                         class_names=tree.classes_,
-                                         filled=True,
-                                         rounded=True,
-                                         proportion=True)
-    graphviz.Source(graph).render(os.path.join('figures', 'opportunity3_tree'), format='png')
-    graphviz.Source(graph).render(os.path.join('figures', 'opportunity3_tree'), format='pdf')
-
-
-def plot_opportunity3_partial_dependency_plot(data):
-    data2 = data[(data.Zone2Position == '1') & (data.SKU != 'A001') & data.Result_Type.isin(['PASS', 'Defect_3'])].copy()
+def plot_opportunity3_partial_dependency_plot(dataset):
+    data2 = partitioned_store.load(dataset, ['Block_Position', 'Zone1_In_Zone3_Out_Dur', 'Result_Type'],
+                                   [('Zone2Position', '==', '1'), ('SKU', '!=', 'A001'),
+                                    ('Result_Type', 'in', ['PASS', 'Defect_3'])])
 
     data2['HasDefect'] = data2.Result_Type != 'PASS'
     data2.dropna(subset=['HasDefect', 'Block_Position', 'Zone1_In_Zone3_Out_Dur'], inplace=True)
@@ -234,72 +202,130 @@ def plot_opportunity3_partial_dependency_plot(data):
     matplotlib.pyplot.savefig(os.path.join('figures', 'opportunity3_partial_dependency.pdf'))
 
 
-if __name__ == '__main__':
-    data = prepare_data.get_prepared_data()
-    costs = prepare_data.get_costs()
-
-    # Exploratory plots
-    matplotlib.pyplot.close('all')
-    os.makedirs('figures', exist_ok=True)
-
-    # Association between SKU and categorical variables
-    plot_cat_data_association(data, ['SKU', 'Result_Type_Bin'], 'SKU_vs_Result_Type_Bin')
-    plot_cat_data_association(data, ['SKU', 'Result_Type'], 'SKU_vs_Result_Type')
-    plot_cat_data_association(data, ['SKU', 'Block_Num'], 'SKU_vs_Block_Num')
-    plot_cat_data_association(data, ['SKU', 'Block_Position'], 'SKU_vs_Block_Position')
-    plot_cost_defect_association(data, costs)
-    plot_opportunities(data, costs)
-
-    analyze_opportunity1(data)
-    plot_zone_position_defect(data)
-    plot_opportunity1_partial_dependency_plot(data)
+def make_opportunity1_sankey(data):
     zone_path_sankey.make_sankey(data[(data.SKU != 'A001') & (data.Result_Type.isin(['Defect_2']))])
 
-    analyze_opportunity2(data)
-    plot_opportunity2_partial_dependency_plot(data)
 
-    analyze_opportunity3(data)
-    plot_opportunity3_partial_dependency_plot(data)
-
-
-    # Correlation among numerical variables
-    plot_correlation_among_features(data, data.columns)
-
-
-    # Influence of temperature on defects
-    plot_correlation_among_features(data, ['Zone1_Temp_Min', 'Zone2_Temp_Min', 'Zone3_Temp_Min',
-                                           'Zone1_Temp_Max', 'Zone2_Temp_Max', 'Zone3_Temp_Max',
-                                           'Zone1_Temp_Range', 'Zone2_Temp_Range', 'Zone3_Temp_Range',
-                                           'Zone1_Temp_Avg', 'Zone2_Temp_Avg', 'Zone3_Temp_Avg'])
-
-    plot_var_by_SKU_and_result_type(data, ['Zone1_Temp_Min', 'Zone2_Temp_Min', 'Zone3_Temp_Min'])
-    plot_var_by_SKU_and_result_type(data, ['Zone1_Temp_Max', 'Zone2_Temp_Max', 'Zone3_Temp_Max'])
-    plot_var_by_SKU_and_result_type(data, ['Zone1_Temp_Avg', 'Zone2_Temp_Avg', 'Zone3_Temp_Avg'])
-    plot_var_by_SKU_and_result_type(data, ['Zone1_Temp_Range', 'Zone2_Temp_Range', 'Zone3_Temp_Range'])
-
-
-    # Influence of humidity on defects
-    plot_correlation_among_features(data, ['Zone1_Humidity_Min', 'Zone2_Humidity_Min', 'Zone3_Humidity_Min',
-                                           'Zone1_Humidity_Max', 'Zone2_Humidity_Max', 'Zone3_Humidity_Max',
-                                           'Zone1_Humidity_Range', 'Zone2_Humidity_Range', 'Zone3_Humidity_Range',
-                                           'Zone1_Humidity_Avg', 'Zone2_Humidity_Avg', 'Zone3_Humidity_Avg'])
-    plot_var_by_SKU_and_result_type(data, ['Zone1_Humidity_Min', 'Zone2_Humidity_Min', 'Zone3_Humidity_Min'])
-    plot_var_by_SKU_and_result_type(data, ['Zone1_Humidity_Max', 'Zone2_Humidity_Max', 'Zone3_Humidity_Max'])
-    plot_var_by_SKU_and_result_type(data, ['Zone1_Humidity_Avg', 'Zone2_Humidity_Avg', 'Zone3_Humidity_Avg'])
-    plot_var_by_SKU_and_result_type(data, ['Zone1_Humidity_Range', 'Zone2_Humidity_Range', 'Zone3_Humidity_Range'])
+def plot_total_duration_by_SKU(data):
+    # Influence of time taken to manufacture the product. Do products made quickly have more defects?
+    seaborn.violinplot(x='SKU', y='Total_Dur', data=data)
 
 
-    # Influence of date on defects broken down by SKU
-    plot_var_by_date_and_SKU(data, ['Passed_QC_Count'])
-    plot_var_by_date_and_SKU(data, ['Defect_1_Count', 'Defect_2_Count', 'Defect_3_Count',
-                                    'Defect_4_Count'])
+def get_figure_tasks():
+    Task = build_figures.Task
+
+    def figure(name):
+        return os.path.join('figures', name + '.png')
+
+    def figures(name):
+        return [os.path.join('figures', name + extension) for extension in ('.png', '.pdf')]
+
+    temp_cols = ['Zone1_Temp_Min', 'Zone2_Temp_Min', 'Zone3_Temp_Min',
+                 'Zone1_Temp_Max', 'Zone2_Temp_Max', 'Zone3_Temp_Max',
+                 'Zone1_Temp_Range', 'Zone2_Temp_Range', 'Zone3_Temp_Range',
+                 'Zone1_Temp_Avg', 'Zone2_Temp_Avg', 'Zone3_Temp_Avg']
+    humidity_cols = [col.replace('Temp', 'Humidity') for col in temp_cols]
+    dur_cols = ['Result_Type_Bin', 'Zone1_Dur', 'Zone2_Dur', 'Zone3_Dur', 'Zone1_Out_Zone2_In_Dur',
+                'Zone1_Out_Zone3_In_Dur', 'Zone2_Out_Zone3_In_Dur',
+                'Zone1_In_Zone3_Out_Dur', 'Zone1_In_Zone2_Out_Dur', 'Zone2_In_Zone3_Out_Dur', 'Total_Dur',
+                'Total_Zone123_Dur']
+
+    tasks = [
+        # Association between SKU and categorical variables
+        Task('SKU_vs_Result_Type_Bin', plot_cat_data_association, (['SKU', 'Result_Type_Bin'], 'SKU_vs_Result_Type_Bin'),
+             [figure('SKU_vs_Result_Type_Bin')], inputs=('cube',), save=False),
+        Task('SKU_vs_Result_Type', plot_cat_data_association, (['SKU', 'Result_Type'], 'SKU_vs_Result_Type'),
+             [figure('SKU_vs_Result_Type')], inputs=('cube',), save=False),
+        Task('SKU_vs_Block_Num', plot_cat_data_association, (['SKU', 'Block_Num'], 'SKU_vs_Block_Num'),
+             [figure('SKU_vs_Block_Num')], inputs=('cube',), save=False),
+        Task('SKU_vs_Block_Position', plot_cat_data_association, (['SKU', 'Block_Position'], 'SKU_vs_Block_Position'),
+             [figure('SKU_vs_Block_Position')], inputs=('cube',), save=False),
+        Task('SKU_vs_Result_Type_costs', plot_cost_defect_association, (),
+             [figure('SKU_vs_Result_Type_costs')], inputs=('cube', 'costs'), save=False),
+        Task('opportunities', plot_opportunities, (), [figure('opportunities')], inputs=('cube', 'costs'), save=False),
+
+        # Root cause of opportunity 1 defects (Defect_2 in NonA001 SKUs)
+        Task('opportunity1_tree', analyze_opportunity, (opportunity_trees.OPPORTUNITIES[0],),
+             figures('opportunity1_tree'), inputs=('dataset',), save=False),
+        Task('defects_by_position', plot_zone_position_defect, (), figures('defects_by_position'), inputs=('cube',),
+             save=False),
+        Task('opportunity1_partial_dependency', plot_opportunity1_partial_dependency_plot, (),
+             figures('opportunity1_partial_dependency') + figures('opportunity1_partial_dependency_alpha'),
+             inputs=('dataset',), save=False),
+        Task('opportunity1_sankey', make_opportunity1_sankey, (),
+             ['opportunity1_sankey.json', os.path.join('figures', 'opportunity1_sankey.svg')], inputs=('cube',),
+             save=False),
+
+        # Root cause of opportunity 2 defects (Defect_1 in A001 SKUs)
+        Task('opportunity2_tree', analyze_opportunity, (opportunity_trees.OPPORTUNITIES[1],),
+             figures('opportunity2_tree'), inputs=('dataset',), save=False),
+        Task('opportunity2_partial_dependency', plot_opportunity2_partial_dependency_plot, (),
+             figures('opportunity2_partial_dependency'), inputs=('dataset',), save=False),
+
+        # Root cause of opportunity 3 defects (Defect_3 in NonA001 SKUs)
+        Task('opportunity3_tree', analyze_opportunity, (opportunity_trees.OPPORTUNITIES[2],),
+             figures('opportunity3_tree'), inputs=('dataset',), save=False),
+        Task('opportunity3_partial_dependency', plot_opportunity3_partial_dependency_plot, (),
+             figures('opportunity3_partial_dependency'), inputs=('dataset',), save=False),
+
+        # Association among all variables, computed once and sliced by the heatmaps below
+        Task('feature_associations', cache_feature_associations, (), save=False),
+        Task('correlation_all', plot_correlation_among_features, (None,), [figure('correlation_all')],
+             requires=('feature_associations',)),
+
+        # Influence of temperature, humidity and durations on defects
+        Task('correlation_temperature', plot_correlation_among_features, (temp_cols,),
+             [figure('correlation_temperature')], requires=('feature_associations',)),
+        Task('correlation_humidity', plot_correlation_among_features, (humidity_cols,),
+             [figure('correlation_humidity')], requires=('feature_associations',)),
+        Task('correlation_duration', plot_correlation_among_features, (dur_cols,), [figure('correlation_duration')],
+             requires=('feature_associations',)),
+    ]
+
+    for var in ['Temp', 'Humidity']:
+        for stat in ['Min', 'Max', 'Avg', 'Range']:
+            name = '{}_{}_by_SKU_and_Result_Type'.format(var, stat)
+            cols = ['Zone{}_{}_{}'.format(zone, var, stat) for zone in (1, 2, 3)]
+            tasks.append(Task(name, plot_var_by_SKU_and_result_type, (cols,), [figure(name)]))
+
+    tasks += [
+        # Influence of date on defects broken down by SKU
+        Task('Passed_QC_Count_by_Date_and_SKU', plot_var_by_date_and_SKU, (['Passed_QC_Count'],),
+             [figure('Passed_QC_Count_by_Date_and_SKU')]),
+        Task('Defect_Counts_by_Date_and_SKU', plot_var_by_date_and_SKU,
+             (['Defect_1_Count', 'Defect_2_Count', 'Defect_3_Count', 'Defect_4_Count'],),
+             [figure('Defect_Counts_by_Date_and_SKU')]),
+        Task('Defect_Rates_by_Date_and_SKU', plot_result_type_rates_by_date_and_SKU, (opportunity_trees.DEFECTS, 7),
+             [figure('Defect_Rates_by_Date_and_SKU')]),
+
+        # Influence of time taken to manufacture the product. Do products made quickly have more defects?
+        Task('Total_Dur_by_SKU', plot_total_duration_by_SKU, (), [figure('Total_Dur_by_SKU')]),
+        Task('Dur_by_Result_Type_Bin', plot_paired_grid, ('Result_Type_Bin', ['Zone1_Dur', 'Zone2_Dur', 'Zone3_Dur']),
+             [figure('Dur_by_Result_Type_Bin')]),
+        Task('Dur_by_Result_Type', plot_paired_grid, ('Result_Type', ['Zone1_Dur', 'Zone2_Dur', 'Zone3_Dur']),
+             [figure('Dur_by_Result_Type')]),
+    ]
+    return tasks
+
+
+def add_arguments(parser):
+    parser.add_argument('--jobs', type=int, default=None, help='Number of worker processes (default: all cores).')
+    parser.add_argument('--force', action='store_true', help='Rebuild all figures, even if they are up to date.')
+    parser.add_argument('--trace', help='Record the time and memory used by each stage to this JSON trace file.')
+
+
+def main(args):
+    prepare_data.set_display_options()
+    if args.trace:
+        instrumentation.enable()
+    results = build_figures.build(get_figure_tasks(), n_jobs=args.jobs, force=args.force)
+    if args.trace:
+        instrumentation.write_trace(args.trace)
+    if any(status == 'failed' for status, _ in results.values()):
+        sys.exit(1)
 
 
-    # Influence of time taken to manufacture the product. Do products made quickly have more defects?
-    seaborn.violinplot(x='SKU', y='Total_Dur', data=data)
-    plot_paired_grid(data, 'Result_Type_Bin', ['Zone1_Dur', 'Zone2_Dur', 'Zone3_Dur'])
-    plot_paired_grid(data, 'Result_Type', ['Zone1_Dur', 'Zone2_Dur', 'Zone3_Dur'])
-    plot_correlation_among_features(data, ['Result_Type_Bin', 'Zone1_Dur', 'Zone2_Dur', 'Zone3_Dur', 'Zone1_Out_Zone2_In_Dur',
-                                           'Zone1_Out_Zone3_In_Dur', 'Zone2_Out_Zone3_In_Dur',
-                                           'Zone1_In_Zone3_Out_Dur', 'Zone1_In_Zone2_Out_Dur', 'Zone2_In_Zone3_Out_Dur', 'Total_Dur',
-                                           'Total_Zone123_Dur'])
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the exploratory figures.')
+    add_arguments(parser)
+    main(parser.parse_args())
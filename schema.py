@@ -0,0 +1,99 @@
+import argparse
+
+import numpy
+import pandas
+
+# Categories documented in the data dictionary. Fixing them up front gives every chunk of the dataset the same dtypes,
+# which the streaming mode relies on to impute and store chunks independently.
+CATEGORIES = {
+    'Zone1Position': ['1', '2', '3', '4', '5', '6', '7', '8'],
+    'Zone2Position': ['1', '2', '3', '4'],
+    'Zone3Position': ['1', '2', '3', '4', '5', '6'],
+    'SKU': ['A001', 'B003', 'C005', 'X007', 'Z009'],
+    'Block_Num': ['1000', '1001', '1002', '1003', '1004', '1006', '1007'],
+    'Block_Position': ['1', '2', '3', '4'],
+    'Result_Type': ['Defect_1', 'Defect_2', 'Defect_3', 'Defect_4', 'PASS'],
+    'Zone1_Area': ['Bottom Left', 'Bottom Right', 'Top Left', 'Top Right'],
+    'Zone3_Area': ['Bottom Right', 'Top Left'],
+}
+
+# Derived from Result_Type by prepare_data.format_data
+RESULT_TYPE_BIN = pandas.CategoricalDtype(['DEFECT', 'PASS'])
+
+DATE_COLUMNS = ['Date']
+
+COUNT_COLUMNS = ['Passed_QC_Count', 'Defect_1_Count', 'Defect_2_Count', 'Defect_3_Count', 'Defect_4_Count']
+
+# Sensor readings, durations and the row/column/block columns that only hold small integers but can be missing.
+# float32 keeps ~7 significant digits, more than the sensors resolve.
+FLOAT32_COLUMNS = [
+    'Zone{}_{}_{}'.format(zone, sensor, stat)
+    for zone in (1, 2, 3) for sensor in ('Temp', 'Humidity') for stat in ('Avg', 'Min', 'Max', 'Range')] + [
+    'Zone1_Dur', 'Zone2_Dur', 'Zone3_Dur',
+    'Zone1_Out_Zone2_In_Dur', 'Zone1_Out_Zone3_In_Dur', 'Zone2_Out_Zone3_In_Dur',
+    'Zone1_In_Zone3_Out_Dur', 'Zone1_In_Zone2_Out_Dur', 'Zone2_In_Zone3_Out_Dur',
+    'Total_Dur', 'Total_Zone123_Dur', 'AVG_Zone123_Dur',
+    'Zone1_Row_Num', 'Zone1_Col_Num', 'Zone2_Row_Num', 'Zone2_Col_num', 'Zone3_Row_Num', 'Zone3_Col_Num',
+    'Zone1_Left_Block_Bin', 'Zone1_Right_Block_Bin',
+]
+
+# Types given to read_csv. Categories are read as found and pinned afterwards, so that unexpected values raise an error
+# instead of silently becoming missing. Counts are read as float64 and compacted afterwards (see get_count_dtype).
+READ_DTYPES = dict({col: 'category' for col in CATEGORIES},
+                   **{col: 'float32' for col in FLOAT32_COLUMNS},
+                   **{col: 'float64' for col in COUNT_COLUMNS},
+                   Block_Orientation='UInt8')
+
+# Count type of streamed chunks, which cannot depend on the values of each chunk
+STREAM_COUNT_DTYPE = 'UInt32'
+
+
+def get_count_dtype(values):
+    """Return the smallest integer type holding values: unsigned if none is negative, and nullable (e.g. UInt16) if some
+       are missing."""
+    observed = values[numpy.isfinite(values)]
+    low, high = (int(observed.min()), int(observed.max())) if len(observed) else (0, 0)
+    dtype = numpy.promote_types(numpy.min_scalar_type(low), numpy.min_scalar_type(high))
+    if len(observed) < len(values):
+        return pandas.api.types.pandas_dtype(dtype.name.replace('uint', 'UInt').replace('int', 'Int'))
+    return dtype
+
+
+def apply_schema(data, count_dtype=None):
+    """Convert the columns read with READ_DTYPES to their compact types in place: Date to datetime64 and counts to
+       count_dtype, or the smallest type holding the values of each count column by default."""
+    for col in DATE_COLUMNS:
+        data[col] = pandas.to_datetime(data[col], format='%Y-%m-%d')
+    return compact_counts(data, count_dtype)
+
+
+def compact_counts(data, count_dtype=None):
+    # Convert the count columns of data to count_dtype, or the smallest type holding their values, in place
+    for col in COUNT_COLUMNS:
+        if col in data:
+            data[col] = data[col].astype(count_dtype or get_count_dtype(data[col].astype('float64').to_numpy()))
+    return data
+
+
+def memory_report(before, after):
+    """Return the memory used by each column of before and after (two versions of the same frame) in bytes, with a
+       total row. Columns missing from one of the frames are reported as 0."""
+    report = pandas.DataFrame({'before': before.memory_usage(index=False, deep=True),
+                               'after': after.memory_usage(index=False, deep=True)}).fillna(0).astype('int64')
+    report['dtype_before'] = before.dtypes.astype(str)
+    report['dtype_after'] = after.dtypes.astype(str)
+    report.loc['Total'] = [report.before.sum(), report.after.sum(), '', '']
+    report[['before', 'after']] = report[['before', 'after']].astype('int64')
+    report['ratio'] = (report.after / report.before).round(3)
+    return report
+
+
+if __name__ == '__main__':
+    import prepare_data
+
+    parser = argparse.ArgumentParser(description='Report the memory used by each column with and without the schema.')
+    parser.add_argument('--path', default=prepare_data.DATA_FILE)
+    args = parser.parse_args()
+
+    report = memory_report(pandas.read_csv(args.path, index_col=0), prepare_data.read_data(args.path))
+    print(report.to_string())
@@ -0,0 +1,59 @@
+import argparse
+import time
+
+import pandas
+
+import predict_defects
+import prepare_data
+
+
+def iter_records(path, chunksize):
+    # New records either come as raw CSV extracts, prepared on the fly, or as a store of already prepared data
+    if path.endswith('.parquet'):
+        return prepare_data.iter_prepared_store(path)
+    return prepare_data.iter_prepared_data(path, chunksize)
+
+
+def score_chunk(rf, encoder, data):
+    """Return the predicted Result_Type and class probabilities of each record. Records with missing features, which
+       the forest cannot handle, get no prediction."""
+    scores = pandas.DataFrame(index=data.index, columns=['Predicted_Result_Type'] + list(rf.classes_), dtype=float)
+    scores['Predicted_Result_Type'] = scores.Predicted_Result_Type.astype('object')
+
+    complete = data[encoder.numeric_columns_ + list(encoder.categories_)].notna().all(axis=1)
+    if complete.any():
+        probabilities = rf.predict_proba(encoder.transform(data[complete]))
+        scores.loc[complete, rf.classes_] = probabilities
+        scores.loc[complete, 'Predicted_Result_Type'] = rf.classes_[probabilities.argmax(axis=1)]
+    return scores
+
+
+def score_file(path, output, model_path=predict_defects.MODEL_FILE, chunksize=100000, n_jobs=-1):
+    rf, encoder = predict_defects.load_model(model_path)
+    rf.n_jobs = n_jobs  # Trees predict independently, so spread each chunk over the cores
+
+    n_rows = 0
+    start = time.perf_counter()
+    for i, chunk in enumerate(iter_records(path, chunksize)):
+        score_chunk(rf, encoder, chunk).to_csv(output, mode='w' if i == 0 else 'a', header=i == 0)
+        n_rows += len(chunk)
+        elapsed = time.perf_counter() - start
+        print('{} rows scored in {:.1f}s ({:.0f} rows/s)'.format(n_rows, elapsed, n_rows / elapsed))
+
+
+def add_arguments(parser):
+    parser.add_argument('path', help='Records to score: a CSV extract, or a .parquet store of prepared data.')
+    parser.add_argument('output', help='CSV file to write the predicted Result_Type and class probabilities to.')
+    parser.add_argument('--model', default=predict_defects.MODEL_FILE)
+    parser.add_argument('--chunksize', type=int, default=100000)
+    parser.add_argument('--jobs', type=int, default=-1, help='Number of cores to predict with (default: all).')
+
+
+def main(args):
+    score_file(args.path, args.output, args.model, args.chunksize, args.jobs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Flag likely defects in new production records.')
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,213 @@
+import argparse
+import gzip
+import os
+
+import numpy
+import pandas
+
+import prepare_data
+import schema
+
+# Number of rows of each standard size of generated dataset
+SIZES = {'10K': 10**4, '1M': 10**6, '10M': 10**7}
+
+FIRST_DATE = '2018-08-01'
+N_DAYS = 184
+
+# Fraction of missing values. Positions are often missing in the raw data while (some of) the redundant row, column and
+# area columns are filled, which is what the imputation in prepare_data recovers.
+MISSING_RATES = {
+    'position': 0.3,
+    'row_col': 0.1,
+    'area': 0.5,
+    'duration': 0.02,
+}
+
+# Range of each duration column
+DURATIONS = {
+    'Zone1_Dur': (9.4, 23),
+    'Zone2_Dur': (48, 52),
+    'Zone3_Dur': (13, 33),
+    'Zone1_Out_Zone2_In_Dur': (2.5, 6),
+    'Zone1_Out_Zone3_In_Dur': (56, 63),
+    'Zone2_Out_Zone3_In_Dur': (4, 7.5),
+    'Zone1_In_Zone3_Out_Dur': (98, 100),
+    'Zone1_In_Zone2_Out_Dur': (60, 79),
+    'Zone2_In_Zone3_Out_Dur': (76, 83),
+}
+
+# Range of the minimum and spread of each sensor
+SENSORS = {'Temp': (12, 21, 1, 20), 'Humidity': (17, 38, 1, 20)}
+
+# Defect rates go up with these positions and SKUs and with zone 2 humidity, so that models have something to find
+SKU_WEIGHTS = [0.3, 0.2, 0.2, 0.15, 0.15]
+DEFECT_LOGITS = {'base': -2.2, 'Zone1Position': {'3': 0.8}, 'Zone3Position': {'5': 0.5}, 'SKU': {'B003': 0.6},
+                 'Zone2_Humidity_Avg': 0.03}
+DEFECT_TYPE_WEIGHTS = [0.3, 0.35, 0.2, 0.15]
+
+COLUMNS = ['Date', 'Zone1Position', 'Zone2Position', 'Zone3Position', 'SKU', 'Result_Type',
+           'Zone1_Row_Num', 'Zone1_Col_Num', 'Zone2_Row_Num', 'Zone2_Col_num', 'Zone3_Row_Num', 'Zone3_Col_Num',
+           'Zone1_Left_Block_Bin', 'Zone1_Right_Block_Bin', 'Zone1_Area', 'Zone3_Area'] + list(DURATIONS) + [
+    'Zone{}_{}_{}'.format(zone, sensor, stat)
+    for zone in (1, 2, 3) for sensor in SENSORS for stat in ('Avg', 'Min', 'Max', 'Range')] + [
+    'Block_Num', 'Block_Position', 'Block_Orientation', 'Total_Dur', 'Total_Zone123_Dur', 'AVG_Zone123_Dur',
+    'Passed_QC_Count', 'Defect_1_Count', 'Defect_2_Count', 'Defect_3_Count', 'Defect_4_Count']
+
+
+def get_data_file(size):
+    return os.path.join('data', 'WIDS_Project_Generated_Data_{}.csv.gz'.format(size))
+
+
+def with_missing(values, rate, rng):
+    values = values.astype('float64')
+    values[rng.random_sample(len(values)) < rate] = numpy.nan
+    return values
+
+
+def as_labels(codes, labels, missing):
+    # Labels of codes (0-based), None where missing
+    labels = numpy.array(list(labels) + [None], dtype=object)
+    return labels[numpy.where(missing, len(labels) - 1, codes)]
+
+
+def generate_positions(data, n_rows, rng):
+    # Returns the true position labels, before positions go missing
+    positions = {}
+    for zone, layout in prepare_data.ZONE_LAYOUTS.items():
+        n_grid_rows, n_grid_cols = layout['shape']
+        position = rng.randint(n_grid_rows * n_grid_cols, size=n_rows)
+        row, col = position // n_grid_cols + 1, position % n_grid_cols + 1
+
+        labels = schema.CATEGORIES[layout['position']]
+        positions[layout['position']] = numpy.asarray(labels)[position]
+        data[layout['position']] = as_labels(position, labels, rng.random_sample(n_rows) < MISSING_RATES['position'])
+        data[layout['row']] = with_missing(row, MISSING_RATES['row_col'], rng)
+        data[layout['col']] = with_missing(col, MISSING_RATES['row_col'], rng)
+        data['_{}_position'.format(zone)] = position
+
+    # Areas as recorded in the raw data
+    position = data.pop('_Zone1_position')
+    left = (position % 4) < 2
+    area = numpy.where(position < 4, 'Top ', 'Bottom ').astype(object) + numpy.where(left, 'Left', 'Right')
+    missing = rng.random_sample(n_rows) < MISSING_RATES['area']
+    data['Zone1_Left_Block_Bin'] = with_missing(left.astype(int), MISSING_RATES['row_col'], rng)
+    data['Zone1_Right_Block_Bin'] = with_missing((~left).astype(int), MISSING_RATES['row_col'], rng)
+    data['Zone1_Area'] = numpy.where(missing, None, area)
+
+    position = data.pop('_Zone3_position')
+    areas = prepare_data.ZONE_LAYOUTS['Zone3']['derived_area']
+    missing = rng.random_sample(n_rows) < MISSING_RATES['area']
+    data['Zone3_Area'] = as_labels(position, [areas[p] for p in sorted(areas)], missing)
+    del data['_Zone2_position']
+    return positions
+
+
+def generate_sensors(data, n_rows, rng):
+    for zone in (1, 2, 3):
+        for sensor, (low, high, min_spread, max_spread) in SENSORS.items():
+            minimum = rng.uniform(low, high, n_rows)
+            maximum = minimum + rng.uniform(min_spread, max_spread, n_rows)
+            data['Zone{}_{}_Avg'.format(zone, sensor)] = (minimum + maximum) / 2
+            data['Zone{}_{}_Min'.format(zone, sensor)] = minimum
+            data['Zone{}_{}_Max'.format(zone, sensor)] = maximum
+            data['Zone{}_{}_Range'.format(zone, sensor)] = maximum - minimum
+
+
+def generate_results(data, positions, n_rows, rng):
+    logit = numpy.full(n_rows, DEFECT_LOGITS['base'])
+    for col in ['Zone1Position', 'Zone3Position', 'SKU']:
+        for value, effect in DEFECT_LOGITS[col].items():
+            logit += effect * (positions.get(col, data[col]) == value)
+    logit += DEFECT_LOGITS['Zone2_Humidity_Avg'] * (data['Zone2_Humidity_Avg'] - 40)
+
+    defect = rng.random_sample(n_rows) < 1 / (1 + numpy.exp(-logit))
+    defect_type = rng.choice(4, size=n_rows, p=DEFECT_TYPE_WEIGHTS)
+    return numpy.where(defect, defect_type, 4)
+
+
+def get_zero_counts():
+    return pandas.DataFrame(0, index=schema.CATEGORIES['SKU'], columns=schema.COUNT_COLUMNS)
+
+
+def generate_counts(data, result_types, counts_before):
+    """Return the running number of products of each SKU that passed QC or had each defect, up to and including each
+       row (rows being in chronological order), starting from counts_before: a frame of the counts per SKU before the
+       first row."""
+    # Result types are coded as the defects, then PASS
+    outcomes = numpy.zeros((len(result_types), 5), dtype='int64')
+    outcomes[numpy.arange(len(result_types)), result_types] = 1
+    outcomes = pandas.DataFrame(outcomes[:, [4, 0, 1, 2, 3]], columns=schema.COUNT_COLUMNS)
+    return outcomes.groupby(data['SKU']).cumsum() + counts_before.reindex(data['SKU']).to_numpy()
+
+
+def generate_chunk(start, n_rows, total_rows, random_state=0, counts_before=None):
+    """Return rows start to start + n_rows of a generated dataset of total_rows rows, with the columns, value ranges
+       and patterns of missing values of the raw dataset. Chunks are generated independently from each other, except
+       for the running counts, which continue from counts_before (per SKU, see generate_counts; zero by default)."""
+    rng = numpy.random.RandomState([random_state, start])
+    data = {}
+
+    # Rows are in chronological order across the whole dataset
+    day = (numpy.arange(start, start + n_rows) * N_DAYS) // total_rows
+    dates = pandas.date_range(FIRST_DATE, periods=N_DAYS).strftime('%Y-%m-%d')
+    data['Date'] = numpy.asarray(dates)[day]
+
+    positions = generate_positions(data, n_rows, rng)
+    data['SKU'] = numpy.asarray(schema.CATEGORIES['SKU'])[rng.choice(5, size=n_rows, p=SKU_WEIGHTS)]
+    generate_sensors(data, n_rows, rng)
+    result_types = generate_results(data, positions, n_rows, rng)
+    data['Result_Type'] = numpy.asarray(schema.CATEGORIES['Result_Type'])[result_types]
+
+    # Durations are missing independently of each other, except for the 2 zone 1-2-3 totals that go together
+    for col, (low, high) in DURATIONS.items():
+        data[col] = with_missing(rng.uniform(low, high, n_rows), MISSING_RATES['duration'], rng)
+    total = with_missing(rng.uniform(70, 108, n_rows), MISSING_RATES['duration'], rng)
+    data['Total_Dur'] = rng.uniform(78, 120, n_rows)
+    data['Total_Zone123_Dur'] = total
+    data['AVG_Zone123_Dur'] = total / 3
+
+    data['Block_Num'] = numpy.asarray(schema.CATEGORIES['Block_Num'])[rng.randint(7, size=n_rows)]
+    data['Block_Position'] = rng.randint(1, 5, size=n_rows)
+    data['Block_Orientation'] = numpy.ones(n_rows, dtype=int)
+    counts = generate_counts(data, result_types, get_zero_counts() if counts_before is None else counts_before)
+    for col in schema.COUNT_COLUMNS:
+        data[col] = counts[col].to_numpy()
+
+    return pandas.DataFrame(data, index=pandas.RangeIndex(start, start + n_rows), columns=COLUMNS)
+
+
+def generate_data(n_rows, random_state=0, chunksize=10**6):
+    # Yield a generated dataset of n_rows rows in chunks of at most chunksize rows
+    counts = get_zero_counts()
+    for start in range(0, n_rows, chunksize):
+        chunk = generate_chunk(start, min(chunksize, n_rows - start), n_rows, random_state, counts)
+        last_counts = chunk.groupby('SKU')[schema.COUNT_COLUMNS].last()
+        counts.loc[last_counts.index] = last_counts.to_numpy()
+        yield chunk
+
+
+def write_data(path, n_rows, random_state=0, chunksize=10**6):
+    """Write a generated dataset of n_rows rows as csv (gzip compressed if path ends with .gz), in the format read by
+       prepare_data.read_data. Memory use depends on chunksize rather than on n_rows."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with (gzip.open(path + '.tmp', 'wt', compresslevel=1) if path.endswith('.gz') else open(path + '.tmp', 'w')) as f:
+        for i, chunk in enumerate(generate_data(n_rows, random_state, chunksize)):
+            chunk.to_csv(f, header=i == 0, float_format='%.10g')
+    os.replace(path + '.tmp', path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic datasets with the schema of the raw dataset.')
+    parser.add_argument('sizes', nargs='*', default=['10K'], help='Sizes to generate, among {}.'.format(list(SIZES)))
+    parser.add_argument('--rows', type=int, help='Generate this number of rows instead (requires --output).')
+    parser.add_argument('--output', help='Output file, defaults to data/WIDS_Project_Generated_Data_<size>.csv.gz.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.rows and not args.output:
+        parser.error('--rows requires --output')
+
+    if args.rows:
+        write_data(args.output, args.rows, args.seed)
+    for size in ([] if args.rows else args.sizes):
+        write_data(args.output or get_data_file(size), SIZES[size], args.seed)
+        print('Wrote {} rows to {}'.format(SIZES[size], args.output or get_data_file(size)))
@@ -0,0 +1,38 @@
+import numpy
+import pandas
+
+import defect_monitor
+
+
+def get_products(position, sku, results):
+    return pandas.DataFrame({'Zone1Position': position, 'Zone2Position': None, 'Zone3Position': None, 'SKU': sku,
+                             'Result_Type': results})
+
+
+def test_alarms_and_rates():
+    baseline_rates = pandas.DataFrame(0.1, index=defect_monitor.SKUS, columns=defect_monitor.DEFECTS)
+    monitor = defect_monitor.DefectRateMonitor(baseline_rates, window=20, half_life=10, rate_ratio=2.0,
+                                               cusum_threshold=3.0)
+    # Defect_1 in 1 of 10 products at two cells, then in 1 of 2 at the first one only. A third cell only passes.
+    steady = ['Defect_1'] + ['PASS'] * 9
+    drifted = ['Defect_1', 'PASS'] * 8
+    data = pandas.concat([get_products('3', 'B003', steady * 4), get_products('1', 'A001', steady * 4),
+                          get_products('3', 'B003', drifted), get_products('1', 'A001', steady),
+                          get_products('5', 'C005', ['PASS'] * 10)], ignore_index=True)
+    alarms = monitor.update_data(data)
+
+    assert sorted(alarms.kind) == ['cusum', 'threshold']
+    assert (alarms.zone == 1).all() and (alarms.position == '3').all() and (alarms.SKU == 'B003').all()
+    assert (alarms.defect == 'Defect_1').all()
+    assert (alarms.row_id >= 80).all() and (alarms.row_id < 96).all()
+
+    rates = monitor.get_rates().set_index(['position', 'SKU', 'defect'])
+    assert len(rates) == 3 * len(defect_monitor.DEFECTS) and (rates.zone == 1).all()
+    assert list(rates.products.xs('Defect_1', level='defect')) == [50, 56, 10]
+    # The window holds the last 20 products of each cell
+    assert rates.loc[('1', 'A001', 'Defect_1'), 'window_rate'] == 2 / 20
+    assert rates.loc[('3', 'B003', 'Defect_1'), 'window_rate'] == 8 / 20
+    assert rates.loc[('3', 'B003', 'Defect_2'), 'window_rate'] == 0
+    # 10 passes, one half life, halve the decayed rate
+    numpy.testing.assert_allclose(rates.loc[('5', 'C005', 'Defect_1'), 'decayed_rate'], 0.05)
+    assert rates.loc[('5', 'C005', 'Defect_1'), 'window_rate'] == 0
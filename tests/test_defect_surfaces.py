@@ -0,0 +1,17 @@
+import numpy
+import pandas
+import pytest
+
+import defect_surfaces
+
+
+@pytest.mark.parametrize('edges', [[0, 1, 2, 3], range(16, 53), [-2.5, 0.1, 0.2, 7]])
+def test_bin_codes_match_pandas_cut(edges):
+    edges = numpy.asarray(edges, dtype=float)
+    rng = numpy.random.RandomState(0)
+    # Every edge, values just off each edge, values outside the edges and missing values
+    values = numpy.concatenate([edges, numpy.nextafter(edges, -numpy.inf), numpy.nextafter(edges, numpy.inf),
+                                rng.uniform(edges[0] - 1, edges[-1] + 1, 100), [numpy.nan] * 3])
+    values = pandas.Series(values)
+
+    numpy.testing.assert_array_equal(defect_surfaces.get_bin_codes(values, edges), pandas.cut(values, edges).cat.codes)
@@ -0,0 +1,38 @@
+import numpy
+import pandas
+import pytest
+
+import feature_associations
+import prepare_data
+
+
+def get_data(n_rows=200):
+    rng = numpy.random.RandomState(0)
+    data = pandas.DataFrame({'x': rng.normal(size=n_rows), 'y': rng.normal(size=n_rows),
+                             'c': pandas.Categorical(rng.choice(list('abc'), n_rows))})
+    data['y'] += data.x
+    return data
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float64'])
+def test_all_float_frame(dtype):
+    # A frame of a single numeric block, whose values pandas may hand out as a read-only view
+    values = get_data()[['x', 'y']].to_numpy()
+    values[3, 0] = numpy.nan
+    data = pandas.DataFrame(values.astype(dtype), columns=['x', 'y'])
+    matrix = feature_associations.compute_association_matrix(data, n_jobs=1)
+
+    numpy.testing.assert_allclose(matrix.to_numpy(), data.astype('float64').corr().to_numpy())
+    numpy.testing.assert_array_equal(data.to_numpy(), values.astype(dtype))
+
+
+def test_cached_matrix_is_keyed_on_the_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(prepare_data, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(prepare_data, 'get_cache_file', lambda: 'prepared_source_code.feather')
+    data = get_data()
+    subset = data[data.x > 0]
+
+    for frame in (data, subset, data):
+        pandas.testing.assert_frame_equal(feature_associations.get_association_matrix(frame, n_jobs=1),
+                                          feature_associations.compute_association_matrix(frame, n_jobs=1))
+    assert len(list(tmp_path.glob('associations_*.parquet'))) == 2
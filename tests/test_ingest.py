@@ -0,0 +1,44 @@
+import pandas
+import pytest
+
+import aggregate_cube
+import ingest
+import prepare_data
+import synthetic_data
+
+
+def sort_cube(cube):
+    return cube.sort_values(aggregate_cube.CUBE_KEYS).reset_index(drop=True)
+
+
+def test_retried_append_counts_once(synthetic_csv, tmp_path, monkeypatch):
+    store_dir = str(tmp_path / 'store')
+    # The 10K dataset, then two days of 2000 other rows
+    paths = [synthetic_csv] + [str(tmp_path / 'day_{}.csv.gz'.format(i)) for i in (1, 2)]
+    for i, path in enumerate(paths[1:], 1):
+        synthetic_data.write_data(path, 2000, random_state=i)
+    ingest.append_data(paths[0], store_dir, chunksize=3000, compact_every=2)
+
+    def fail(manifest, store_dir):
+        raise OSError('interrupted')
+
+    with monkeypatch.context() as m:
+        m.setattr(ingest, 'write_manifest', fail)
+        with pytest.raises(OSError):
+            ingest.append_data(paths[1], store_dir, chunksize=3000, compact_every=2)
+    # The rows and aggregates written by the interrupted append are left out
+    assert len(ingest.read_manifest(store_dir)) == 1
+    assert ingest.load_aggregates(store_dir).Count.sum() == 10000
+    assert len(ingest.load_store(store_dir, ['SKU'])) == 10000
+
+    # The retry is the second append, which compacts the aggregates, and the third one is summed with the cube
+    ingest.append_data(paths[1], store_dir, chunksize=3000, compact_every=2)
+    ingest.append_data(paths[1], store_dir, chunksize=3000, compact_every=2)
+    assert [entry.get('compacted', False) for entry in ingest.read_manifest(store_dir)] == [True, True]
+    ingest.append_data(paths[2], store_dir, chunksize=3000, compact_every=2)
+    assert len(ingest.get_aggregates_files(ingest.read_manifest(store_dir), store_dir)) == 2
+
+    stored = ingest.load_store(store_dir)
+    expected = aggregate_cube.build_cube(stored, prepare_data.get_costs())
+    assert len(stored) == 14000
+    pandas.testing.assert_frame_equal(sort_cube(ingest.load_aggregates(store_dir)), sort_cube(expected))
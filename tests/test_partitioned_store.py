@@ -0,0 +1,75 @@
+import pandas
+import pytest
+
+import partitioned_store
+import prepare_data
+
+
+@pytest.fixture(scope='module')
+def dataset(synthetic_csv, tmp_path_factory):
+    data = prepare_data.impute_data(prepare_data.read_data(synthetic_csv), verbose=False)
+    dataset_dir = str(tmp_path_factory.mktemp('store') / 'dataset')
+    partitioned_store.write_partitions(data, dataset_dir, 'prepared')
+    return data, dataset_dir
+
+
+def test_select_partitions(dataset):
+    _, dataset_dir = dataset
+    partitions = partitioned_store.get_partitions(dataset_dir)
+
+    def selected(filters):
+        return partitions.loc[partitioned_store.select_partitions(partitions, filters)]
+
+    assert set(partitions.Month) == {'2018-{:02d}'.format(month) for month in range(8, 13)} | {'2019-01'}
+    assert set(selected([('Date', '>=', '2018-09-15'), ('Date', '<', '2018-11-01')]).Month) == {'2018-09', '2018-10'}
+    assert set(selected([('Date', '>', '2018-09-30')]).Month) == set(partitions.Month) - {'2018-08', '2018-09'}
+    assert set(selected([('SKU', 'in', ['A001', 'C005'])]).SKU) == {'A001', 'C005'}
+    assert set(selected([('SKU', '!=', 'A001')]).SKU) == {'B003', 'C005', 'X007', 'Z009'}
+
+
+@pytest.mark.parametrize('filters', [
+    [('Date', '>=', '2018-09-15'), ('Date', '<=', '2018-10-20')],
+    [('SKU', 'in', ['A001', 'C005']), ('Result_Type', '!=', 'PASS')],
+    [('SKU', '!=', 'A001'), ('Zone3Position', '==', '6')],
+    # Missing positions satisfy != and not in, as in pandas
+    [('Zone3Position', 'not in', ['5', '6']), ('Date', 'in', ['2018-08-02', '2018-08-03'])],
+    [('Zone2_Humidity_Avg', '>', 30), ('Result_Type', '!=', 'PASS')],
+])
+def test_load_matches_filtering_the_rows(dataset, filters):
+    data, dataset_dir = dataset
+    selected = pandas.Series(True, index=data.index)
+    for col, op, value in filters:
+        values = pandas.to_datetime(value) if col == 'Date' else value
+        selected &= partitioned_store.OPERATORS[op](data[col], values)
+    expected = data.loc[selected, ['Date', 'SKU', 'Result_Type', 'Zone3Position', 'Zone2_Humidity_Avg']]
+    loaded = partitioned_store.load(dataset_dir, expected.columns, filters)
+
+    assert 0 < len(loaded) < len(data)
+    pandas.testing.assert_frame_equal(loaded, expected, check_dtype=False, check_categorical=False,
+                                      check_index_type=False)
+
+
+def test_load_empty_result(dataset):
+    data, dataset_dir = dataset
+    loaded = partitioned_store.load(dataset_dir, ['Date', 'SKU', 'Passed_QC_Count'],
+                                    [('SKU', '==', 'A001'), ('Date', '<', '2018-01-01')])
+
+    assert loaded.empty
+    assert list(loaded.columns) == ['Date', 'SKU', 'Passed_QC_Count']
+    assert list(loaded.SKU.cat.categories) == list(data.SKU.cat.categories)
+
+
+@pytest.mark.parametrize('col', ['SKU', 'Result_Type', 'Zone1Position'])
+def test_ordered_comparison_on_categorical_is_rejected(dataset, col):
+    _, dataset_dir = dataset
+    with pytest.raises(ValueError, match=col):
+        partitioned_store.load(dataset_dir, filters=[(col, '<', 'B003')])
+
+
+def test_load_filters_on_columns_it_does_not_return(dataset):
+    data, dataset_dir = dataset
+    loaded = partitioned_store.load(dataset_dir, ['SKU'], [('Zone2_Humidity_Avg', '<=', 25), ('SKU', '==', 'B003')])
+    expected = data.loc[(data.Zone2_Humidity_Avg <= 25) & (data.SKU == 'B003'), ['SKU']]
+
+    assert 0 < len(loaded)
+    pandas.testing.assert_frame_equal(loaded, expected, check_categorical=False, check_index_type=False)
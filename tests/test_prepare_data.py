@@ -0,0 +1,54 @@
+import numpy
+import pandas
+import pytest
+
+import prepare_data
+
+
+@pytest.fixture(scope='module')
+def raw_data(synthetic_csv):
+    return prepare_data.read_data(synthetic_csv)
+
+
+def test_table_driven_imputation_matches_per_rule(raw_data):
+    per_rule = raw_data.copy()
+    prepare_data.impute_data_zone1(per_rule)
+    prepare_data.impute_data_zone2(per_rule)
+    prepare_data.impute_data_zone3(per_rule)
+    table_driven = raw_data.copy()
+    prepare_data.impute_zone_positions(table_driven)
+
+    assert table_driven.Zone1Position.isna().sum() < raw_data.Zone1Position.isna().sum()
+    pandas.testing.assert_frame_equal(table_driven, per_rule)
+
+
+def test_balanced_index():
+    labels = pandas.Series(['b'] * 5 + ['a'] * 3 + [None] + ['c'] * 4)
+    index = prepare_data.get_balanced_index(labels)
+
+    assert len(numpy.unique(index)) == len(index) == 9
+    assert list(labels.iloc[index]) == ['a'] * 3 + ['b'] * 3 + ['c'] * 3
+    assert prepare_data.get_balanced_index(labels, n_per_class=5, replace=True, n_replicates=4).shape == (4, 15)
+    with pytest.raises(ValueError):
+        prepare_data.get_balanced_index(labels, n_per_class=5)
+
+
+def test_prepared_store_keeps_row_ids(synthetic_csv, tmp_path):
+    store_file = str(tmp_path / 'prepared.parquet')
+    prepare_data.write_prepared_store(store_file, synthetic_csv, chunksize=3000)
+    chunks = list(prepare_data.iter_prepared_store(store_file))
+    data = pandas.concat(chunks)
+
+    assert len(chunks) == 4
+    pandas.testing.assert_index_equal(data.index, pandas.RangeIndex(10000, name='row_id'), exact=False)
+    assert list(next(prepare_data.iter_prepared_store(store_file, ['SKU'])).columns) == ['SKU']
+
+
+def test_file_hash_is_read_again_once_the_file_changes(tmp_path):
+    path = tmp_path / 'source.csv'
+    path.write_bytes(b'a')
+    digest = prepare_data.get_file_hash(str(path))
+    assert prepare_data.get_file_hash(str(path)) == digest
+
+    path.write_bytes(b'ab')
+    assert prepare_data.get_file_hash(str(path)) != digest
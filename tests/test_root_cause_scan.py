@@ -0,0 +1,19 @@
+import pytest
+
+import prepare_data
+import root_cause_scan
+
+
+@pytest.fixture(scope='module')
+def prepared_data(synthetic_csv):
+    return prepare_data.impute_data(prepare_data.read_data(synthetic_csv), verbose=False)
+
+
+def test_scan_positions_ranks_the_generated_root_cause_first(prepared_data):
+    # synthetic_data makes products through zone 1 position 3 more often defective
+    scan = root_cause_scan.scan_positions(prepared_data)
+    top = scan[(scan.group == 'NotA001') & (scan['rank'] == 1)]
+
+    assert list(top.defect) == ['Defect_1', 'Defect_2', 'Defect_3', 'Defect_4']
+    assert (top.zone == 1).all() and (top.position == '3').all()
+    assert (scan.defects <= scan.products).all()
@@ -0,0 +1,42 @@
+import numpy
+import pandas
+
+import time_series
+
+
+def test_wilson_interval():
+    lower, upper = time_series.wilson_interval(numpy.array([0, 10, 3]), numpy.array([10, 10, 10]))
+
+    assert lower[0] == 0 and upper[1] == 1
+    assert 0 < upper[0] < 0.35 and 0.65 < lower[1] < 1
+    numpy.testing.assert_allclose([lower[2], upper[2]], [0.10779, 0.60322], atol=1e-5)
+
+
+def test_get_daily_rates():
+    data = pandas.DataFrame({
+        'Date': pandas.to_datetime(['2018-08-01'] * 4 + ['2018-08-03'] * 2),
+        'SKU': pandas.Categorical(['A001'] * 6),
+        'Result_Type': pandas.Categorical(['PASS', 'Defect_1', 'PASS', None, 'Defect_1', 'Defect_1']),
+        # Running counters, which the rates must not be computed from
+        'Defect_1_Count': [5, 6, 6, 6, 7, 8],
+    })
+    rates = time_series.get_daily_rates(data, ['Defect_1', 'PASS']).set_index(['Date', 'vars'])
+
+    assert list(rates.n) == [3, 3, 2, 2]
+    numpy.testing.assert_allclose(rates.value, [1 / 3, 2 / 3, 1, 0])
+    assert rates.loc[('2018-08-03', 'Defect_1'), 'upper'] == 1
+    assert rates.loc[('2018-08-03', 'PASS'), 'lower'] == 0
+    assert (rates.lower <= rates.value).all() and (rates.value <= rates.upper).all()
+
+
+def test_get_daily_means_with_a_single_value():
+    data = pandas.DataFrame({
+        'Date': pandas.to_datetime(['2018-08-01', '2018-08-01', '2018-08-02']),
+        'SKU': pandas.Categorical(['A001'] * 3),
+        'Zone1_Dur': [10.0, 12.0, 11.0],
+    })
+    means = time_series.get_daily_means(data, ['Zone1_Dur'])
+
+    assert list(means.value) == [11, 11]
+    assert numpy.isfinite(means[['lower', 'upper']].iloc[0]).all()
+    assert means[['lower', 'upper']].iloc[1].isna().all()
@@ -0,0 +1,68 @@
+import numpy
+import pandas
+
+import schema
+
+# Standard normal quantile of the two-sided 95% intervals
+Z_95 = 1.959964
+
+
+def sum_daily(values, data, window=1):
+    """Sum the columns of values (aligned with data) per day and SKU of data, as a frame with a row per day from the
+       first to the last and columns (column, SKU). Days without products sum to 0. With window > 1, each day sums the
+       last window days (rolling smoothing)."""
+    sums = values.groupby([data.Date, data.SKU.astype('object')]).sum().unstack('SKU', fill_value=0)
+    days = pandas.date_range(sums.index.min(), sums.index.max(), freq='D', name='Date')
+    return sums.reindex(days, fill_value=0).rolling(window, min_periods=1).sum()
+
+
+def to_long(estimates):
+    # One row per day, SKU and variable with a column per estimate (dict of name -> frame as returned by sum_daily),
+    # leaving out the days and SKUs without values
+    long = pandas.concat({name: frame.stack(['SKU', 'vars']) for name, frame in estimates.items()}, axis=1)
+    return long[long.n > 0].reset_index()
+
+
+def get_daily_means(data, cols, window=1, z=Z_95):
+    """Return the mean of each of cols per day and SKU, with the normal-approximation interval of the mean (z=1.96:
+       95%), as columns Date, SKU, vars, n, value, lower and upper. Counts, sums and sums of squares are aggregated in
+       one pass, and over the last window days if window > 1. With a single value (n=1) there is no spread to estimate
+       and the interval is missing."""
+    values = data[cols].astype('float64').rename_axis('vars', axis=1)
+    sums = sum_daily(pandas.concat({'n': values.notna(), 'sum': values, 'sum2': values ** 2}, axis=1), data, window)
+    n = sums['n']
+    mean = sums['sum'] / n
+    variance = (sums['sum2'] - n * mean ** 2).clip(lower=0) / (n - 1).where(n > 1)
+    half_width = z * numpy.sqrt(variance / n)
+    return to_long({'n': n, 'value': mean, 'lower': mean - half_width, 'upper': mean + half_width})
+
+
+def wilson_interval(successes, trials, z=Z_95):
+    """Return the Wilson score interval (lower, upper) of the rate successes / trials, which unlike the normal
+       approximation stays within [0, 1] and behaves for rates close to 0 or 1."""
+    rate = successes / trials
+    denominator = 1 + z ** 2 / trials
+    center = (rate + z ** 2 / (2 * trials)) / denominator
+    half_width = z / denominator * numpy.sqrt(rate * (1 - rate) / trials + z ** 2 / (4 * trials ** 2))
+    # At rates of 0 or 1 one of the bounds is the rate, which rounding can push outside [0, 1]
+    return (numpy.clip(numpy.minimum(center - half_width, rate), 0, 1),
+            numpy.clip(numpy.maximum(center + half_width, rate), 0, 1))
+
+
+def get_daily_rates(data, result_types=schema.CATEGORIES['Result_Type'], window=1, z=Z_95):
+    """Return the share of the products (rows) of each of result_types per day and SKU, with its Wilson interval, as
+       columns Date, SKU, vars (the result type), n (products), value, lower and upper. Aggregated in one pass, and
+       over the last window days if window > 1.
+
+       Rates are counted over the products rather than from the count columns, which are running sums and so measure
+       the level of the counters rather than the production of the day."""
+    known = data.Result_Type.notna()
+    successes = pandas.DataFrame({result_type: data.Result_Type == result_type for result_type in result_types},
+                                 columns=result_types).rename_axis('vars', axis=1)
+    trials = pandas.DataFrame({result_type: known for result_type in result_types},
+                              columns=result_types).rename_axis('vars', axis=1)
+    sums = sum_daily(pandas.concat({'successes': successes, 'trials': trials}, axis=1), data, window)
+    trials = sums['trials']
+    rate = sums['successes'] / trials
+    lower, upper = wilson_interval(sums['successes'], trials, z)
+    return to_long({'n': trials, 'value': rate, 'lower': lower, 'upper': upper})
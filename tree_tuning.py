@@ -0,0 +1,248 @@
+import argparse
+import collections
+import concurrent.futures
+import glob
+import hashlib
+import itertools
+import json
+import math
+import os
+
+import numpy
+import pandas
+
+import feature_encoding
+import opportunity_trees
+import partitioned_store
+import prepare_data
+
+# Candidate tree parameters, on top of those of each opportunity
+PARAM_GRID = collections.OrderedDict([
+    ('min_samples_split', [10, 100, 1000, 3000]),
+    ('min_samples_leaf', [10, 100, 500, 1000]),
+    ('min_impurity_decrease', [0.0, 0.000005, 0.00001, 0.00003]),
+])
+# Parameters that are numbers of samples, scaled with the fraction of the training rows a tree is fitted on
+SAMPLE_PARAMS = {'min_samples_split': 2, 'min_samples_leaf': 1}
+
+RESULT_COLUMNS = ['data_key', 'rows', 'round', 'fraction', 'params', 'score', 'score_std']
+# Warm starts only re-evaluate the finalists of the last tuning while the rows have grown by at most this fraction since
+# the last full search
+MAX_WARM_GROWTH = 0.2
+
+
+def get_results_file(opportunity, model_dir=opportunity_trees.MODEL_DIR):
+    return os.path.join(model_dir, 'tuning_{}.csv'.format(opportunity.name))
+
+
+def get_cache_file(opportunity, data_key):
+    key = '{}_{}'.format(data_key, prepare_data.get_file_hash(__file__)[:16])
+    return os.path.join(prepare_data.CACHE_DIR, 'tuning_{}_{}.npz'.format(opportunity.name, key))
+
+
+def get_data_key(data, n_splits, random_state):
+    # Content of the rows of an opportunity and the folds they are split into
+    sha = hashlib.sha256(pandas.util.hash_pandas_object(data).to_numpy().tobytes())
+    sha.update(repr((list(data.columns), n_splits, random_state)).encode())
+    return sha.hexdigest()[:16]
+
+
+def prepare_folds(data, opportunity, cache_file, n_splits, random_state):
+    """Encode the rows of the opportunity in data and assign them to stratified folds, saving to cache_file the
+       encoded matrix, whether each row has the defect, its fold and its quantile within its class (in random order),
+       so that training rows at any fraction are a stratified subsample."""
+    import sklearn.model_selection
+
+    encoder = feature_encoding.FeatureEncoder(exclude=opportunity_trees.EXCLUDE).fit(data)
+    x = encoder.transform(data)
+    y = (data.Result_Type == opportunity.defect).to_numpy()
+
+    folds = numpy.zeros(len(y), dtype='int64')
+    splitter = sklearn.model_selection.StratifiedKFold(n_splits, shuffle=True, random_state=random_state)
+    for fold, (_, test) in enumerate(splitter.split(numpy.zeros(len(y)), y)):
+        folds[test] = fold
+    quantiles = numpy.zeros(len(y))
+    order = numpy.random.RandomState(random_state).permutation(len(y))
+    for label in (False, True):
+        rows = order[y[order] == label]
+        quantiles[rows] = (numpy.arange(len(rows)) + 1) / len(rows)
+
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    with open(cache_file + '.tmp', 'wb') as f:
+        numpy.savez(f, x=x, y=y, folds=folds, quantiles=quantiles)
+    os.replace(cache_file + '.tmp', cache_file)
+
+
+_shared = {}
+
+
+def init_worker(cache_file):
+    with numpy.load(cache_file) as arrays:
+        _shared.update(x=arrays['x'], y=arrays['y'], folds=arrays['folds'], quantiles=arrays['quantiles'])
+
+
+def scale_params(params, fraction):
+    # A tree fitted on a fraction of the rows gets sample counts scaled in proportion, so that it is the same tree
+    return dict(params, **{param: max(minimum, int(round(params[param] * fraction)))
+                           for param, minimum in SAMPLE_PARAMS.items() if param in params})
+
+
+def evaluate(params, fraction, fold):
+    """Return the ROC AUC, on the rows of fold, of the defect probability of a tree with params fitted on the given
+       fraction of the rows of the other folds."""
+    import sklearn.metrics
+    import sklearn.tree
+
+    x, y, folds, quantiles = _shared['x'], _shared['y'], _shared['folds'], _shared['quantiles']
+    train = numpy.flatnonzero((folds != fold) & (quantiles <= fraction))
+    test = numpy.flatnonzero(folds == fold)
+    tree = sklearn.tree.DecisionTreeClassifier(random_state=0, **scale_params(params, fraction))
+    tree.fit(x[train], y[train])
+    if len(tree.classes_) < 2:
+        return 0.5
+    return sklearn.metrics.roc_auc_score(y[test], tree.predict_proba(x[test])[:, 1])
+
+
+def get_candidates(opportunity, param_grid=PARAM_GRID):
+    candidates = [dict(zip(param_grid, values)) for values in itertools.product(*param_grid.values())]
+    if opportunity.tree_params not in candidates:
+        candidates.append(dict(opportunity.tree_params))
+    return candidates
+
+
+def get_warm_candidates(results, data_key, n_candidates, n_rows, max_growth=MAX_WARM_GROWTH):
+    """Return the n_candidates best parameters of the last round of the latest tuning on other data than data_key,
+       or None if there was none or if n_rows is more than 1 + max_growth times the rows of the latest full search
+       (one evaluating candidates on fractions of the rows), whose ranking may no longer hold."""
+    previous = results[results.data_key != data_key]
+    full = previous[previous.fraction.astype(float) < 1]
+    if full.empty or not n_rows <= full.rows.iloc[-1] * (1 + max_growth):
+        return None
+    previous = previous[previous.data_key == previous.data_key.iloc[-1]]
+    last_round = previous[previous['round'] == previous['round'].max()].sort_values('score', ascending=False,
+                                                                                    kind='mergesort')
+    candidates = [json.loads(params) for params in last_round.params.iloc[:n_candidates]]
+    # Results of an earlier grid (e.g. with min_impurity_split, which scikit-learn no longer has) are not warm started
+    # from
+    return candidates if all(set(params) == set(PARAM_GRID) for params in candidates) else None
+
+
+def load_results(results_file):
+    if not os.path.exists(results_file):
+        return pandas.DataFrame(columns=RESULT_COLUMNS)
+    # Results saved before the rows were recorded have no rows, and are never warm started from
+    return pandas.read_csv(results_file, dtype={'data_key': str}).reindex(columns=RESULT_COLUMNS)
+
+
+def save_results(results, results_file):
+    os.makedirs(os.path.dirname(results_file), exist_ok=True)
+    results.to_csv(results_file + '.tmp', index=False)
+    os.replace(results_file + '.tmp', results_file)
+
+
+def tune_opportunity(data, opportunity, n_splits=5, eta=3, n_jobs=None, warm_start=True, random_state=0,
+                     model_dir=opportunity_trees.MODEL_DIR, max_warm_growth=MAX_WARM_GROWTH):
+    """Search the tree parameters of an opportunity maximising the cross-validated ROC AUC of its defect, on the rows
+       of data without missing values, and return the best ones.
+
+       Candidates are evaluated by successive halving: all of them on 1/eta^k of the training rows of each fold, the
+       best 1/eta of them on eta times more rows, and so on until the last ones are evaluated on all the rows. Folds
+       are evaluated on n_jobs worker processes (n_jobs=1 evaluates them in this process), from the encoded rows and
+       folds cached in a file shared by the workers.
+
+       Scores are appended to models/opportunity_trees/tuning_<name>.csv and not evaluated again for the same data.
+       With warm_start, when the rows have changed since the last tuning, only the eta best candidates of its last
+       round are evaluated, on all the rows, unless the rows have grown by more than max_warm_growth since the last
+       full search, which is then run again."""
+    data = data.iloc[opportunity_trees.get_rows(data, opportunity)].dropna()
+    data_key = get_data_key(data, n_splits, random_state)
+    cache_file = get_cache_file(opportunity, data_key)
+    if not os.path.exists(cache_file):
+        for stale_file in glob.glob(get_cache_file(opportunity, '*')):
+            os.remove(stale_file)
+        prepare_folds(data, opportunity, cache_file, n_splits, random_state)
+
+    results_file = get_results_file(opportunity, model_dir)
+    results = load_results(results_file)
+    candidates = get_warm_candidates(results, data_key, eta, len(data), max_warm_growth) if warm_start else None
+    if candidates is None:
+        candidates = get_candidates(opportunity)
+    n_rounds = max(int(math.ceil(math.log(len(candidates), eta) - 1e-9)), 1)
+
+    if n_jobs == 1:
+        init_worker(cache_file)
+        pool = None
+    else:
+        pool = concurrent.futures.ProcessPoolExecutor(n_jobs, initializer=init_worker, initargs=(cache_file,))
+    try:
+        for i in range(n_rounds):
+            fraction = round(float(eta) ** (i + 1 - n_rounds), 6)
+            done = results[(results.data_key == data_key) & numpy.isclose(results.fraction.astype(float), fraction)]
+            done_scores = dict(zip(done.params, done.score))
+            todo = [params for params in candidates if json.dumps(params, sort_keys=True) not in done_scores]
+
+            jobs = [(params, fraction, fold) for params in todo for fold in range(n_splits)]
+            fold_scores = (list(pool.map(evaluate, *zip(*jobs))) if pool and jobs else
+                           [evaluate(*job) for job in jobs])
+            fold_scores = numpy.reshape(fold_scores, (len(todo), n_splits))
+            new_results = pandas.DataFrame({
+                'data_key': data_key,
+                'rows': len(data),
+                'round': i,
+                'fraction': fraction,
+                'params': [json.dumps(params, sort_keys=True) for params in todo],
+                'score': fold_scores.mean(axis=1),
+                'score_std': fold_scores.std(axis=1),
+            }, columns=RESULT_COLUMNS)
+            results = pandas.concat([results, new_results], ignore_index=True)
+            save_results(results, results_file)
+            done_scores.update(zip(new_results.params, new_results.score))
+
+            scores = [done_scores[json.dumps(params, sort_keys=True)] for params in candidates]
+            # Ties keep the order of the candidates
+            best = numpy.argsort(-numpy.asarray(scores), kind='mergesort')
+            print('{} round {}: {} candidates on {:.1%} of the rows, best AUC {:.4f} with {}'.format(
+                opportunity.name, i, len(candidates), fraction, scores[best[0]], candidates[best[0]]))
+            candidates = [candidates[j] for j in best[:max(len(candidates) // eta, 1)]]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return candidates[0]
+
+
+def save_tuned_params(tuned_params, tuned_params_file=opportunity_trees.TUNED_PARAMS_FILE):
+    # Merge the parameters of the opportunities just tuned with those of the others
+    if os.path.exists(tuned_params_file):
+        with open(tuned_params_file) as f:
+            tuned_params = dict(json.load(f), **tuned_params)
+    os.makedirs(os.path.dirname(tuned_params_file), exist_ok=True)
+    with open(tuned_params_file + '.tmp', 'w') as f:
+        json.dump(tuned_params, f, indent=2, sort_keys=True)
+    os.replace(tuned_params_file + '.tmp', tuned_params_file)
+
+
+def add_arguments(parser):
+    parser.add_argument('--all', action='store_true',
+                        help='Tune every SKU/defect combination instead of the three main opportunities.')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--eta', type=int, default=3, help='Keep the best 1/eta candidates after each round.')
+    parser.add_argument('--jobs', type=int, default=None, help='Number of worker processes (default: all cores).')
+    parser.add_argument('--no-warm-start', action='store_true',
+                        help='Evaluate all candidates again when the data has changed since the last tuning.')
+
+
+def main(args):
+    dataset_dir = partitioned_store.build_dataset()
+    opportunities = opportunity_trees.get_all_opportunities() if args.all else opportunity_trees.OPPORTUNITIES
+    tuned_params = {}
+    for opportunity in opportunities:
+        data = partitioned_store.load(dataset_dir, filters=opportunity_trees.get_filters(opportunity))
+        tuned_params[opportunity.name] = tune_opportunity(data, opportunity, args.folds, args.eta, args.jobs,
+                                                          not args.no_warm_start)
+    save_tuned_params(tuned_params)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tune the tree parameters of the defect opportunities.')
+    add_arguments(parser)
+    main(parser.parse_args())
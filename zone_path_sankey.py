@@ -1,60 +1,164 @@
+import argparse
 import json
+import os
+import re
 
+import pandas
 
-def get_color(index):
-    return {
-        'Defect_2': '#e31a1c',
-        'PASS': '#1f78b4'
-    }[index[3]]
+import aggregate_cube
 
+# Colours of the flows by Result_Type, other values are drawn in grey
+RESULT_COLORS = {
+    'PASS': '#1f78b4',
+    'Defect_1': '#ff7f00',
+    'Defect_2': '#e31a1c',
+    'Defect_3': '#33a02c',
+    'Defect_4': '#6a3d9a',
+}
+DEFAULT_COLOR = '#999999'
 
-def create_links(index, value, source_zone=1):
-    return {'source': 'Zone{}Position{}'.format(source_zone, index[source_zone-1]),
-            'target': 'Zone{}Position{}'.format(source_zone+1, index[source_zone]),
-            'value': value,
-            'type': '_'.join(index),
-            'color': get_color(index)}
 
+def get_color(result_type):
+    return RESULT_COLORS.get(result_type, DEFAULT_COLOR)
 
-def get_node_order(paths, zone):
-    return ['Zone{}Position{}'.format(zone, n)
-            for n in paths.index.get_level_values('Zone{}Position'.format(zone)).categories]
 
+def get_zone_columns(data):
+    # Position columns of all zones, in zone order
+    columns = [col for col in data.columns if re.match(r'^Zone\d+Position$', col)]
+    return sorted(columns, key=lambda col: int(re.search(r'\d+', col).group()))
 
-def get_nodes(paths, zone):
-    return [{'id': 'Zone{}Position{}'.format(zone, n), 'title': 'P{}'.format(n)}
-            for n in paths.index.get_level_values('Zone{}Position'.format(zone)).categories]
 
+def get_node_id(zone_col, positions):
+    return zone_col + positions.astype(str)
 
-def get_group(paths, zone):
-    return {
-        'id': 'Zone{}'.format(zone),
-        'title': 'Zone{}'.format(zone),
-        'nodes': get_node_order(paths, zone),
-    }
 
+def get_paths(data, zone_cols, result_col='Result_Type', group_cols=()):
+    # Number of products along each observed path through the zones, per combination of group_cols (e.g. SKU) if any
+    paths = aggregate_cube.count_by(data, list(group_cols) + zone_cols + [result_col])
+    return paths[paths > 0]
 
-def make_sankey(data):
-    paths = data.groupby(['Zone1Position', 'Zone2Position', 'Zone3Position', 'Result_Type']).size()
 
-    with open('opportunity1_sankey.json', 'w') as f:
+def get_links(paths, zone_cols, result_col='Result_Type', min_count=0):
+    """Return the flows between the positions of consecutive zones, split by result type, as a dataframe with columns
+       source, target, type, value and color. Flows of fewer than min_count products are left out."""
+    links = []
+    for source_col, target_col in zip(zone_cols[:-1], zone_cols[1:]):
+        flows = paths.groupby(level=[source_col, target_col, result_col]).sum()
+        flows = flows[(flows > 0) & (flows >= min_count)].rename('value').reset_index()
+        links.append(pandas.DataFrame({
+            'source': get_node_id(source_col, flows[source_col]),
+            'target': get_node_id(target_col, flows[target_col]),
+            'type': flows[result_col].astype(str),
+            'value': flows.value.astype(int),
+        }))
+    links = pandas.concat(links, ignore_index=True)
+    links['color'] = links.type.map(get_color)
+    return links
+
+
+def get_nodes(paths, zone_col):
+    return [{'id': zone_col + str(n), 'title': 'P{}'.format(n)}
+            for n in paths.index.get_level_values(zone_col).categories]
+
+
+def get_node_order(paths, zone_col):
+    return [zone_col + str(n) for n in paths.index.get_level_values(zone_col).categories]
+
+
+def render_svg(links, node_order, zone_titles, width=900, height=500, node_width=16, node_padding=8, margin=30):
+    """Render a Sankey diagram of links between the nodes of consecutive columns in node_order as an SVG document.
+       Each flow enters and leaves its nodes at the height it was stacked at, stacked by type within each node."""
+    inflow = links.groupby('target').value.sum()
+    outflow = links.groupby('source').value.sum()
+    node_values = {node: max(inflow.get(node, 0), outflow.get(node, 0)) for column in node_order for node in column}
+    column_totals = [sum(node_values[node] for node in column) for column in node_order]
+    max_nodes = max(len(column) for column in node_order)
+    scale = (height - 2 * margin - node_padding * (max_nodes - 1)) / max(max(column_totals), 1)
+    column_step = (width - 2 * margin - node_width) / max(len(node_order) - 1, 1)
+
+    node_x, node_y = {}, {}
+    for i, column in enumerate(node_order):
+        y = margin
+        for node in column:
+            node_x[node], node_y[node] = margin + i * column_step, y
+            y += node_values[node] * scale + node_padding
+
+    elements = []
+    source_offset = dict.fromkeys(node_values, 0.0)
+    target_offset = dict.fromkeys(node_values, 0.0)
+    type_order = {result_type: i for i, result_type in enumerate(RESULT_COLORS)}
+    for link in sorted(links.itertuples(index=False), key=lambda link: (type_order.get(link.type, len(type_order)),
+                                                                        link.source, link.target)):
+        thickness = link.value * scale
+        x0, x1 = node_x[link.source] + node_width, node_x[link.target]
+        y0 = node_y[link.source] + source_offset[link.source]
+        y1 = node_y[link.target] + target_offset[link.target]
+        source_offset[link.source] += thickness
+        target_offset[link.target] += thickness
+        xm = (x0 + x1) / 2
+        elements.append(
+            '<path d="M{x0:.1f},{y0:.1f} C{xm:.1f},{y0:.1f} {xm:.1f},{y1:.1f} {x1:.1f},{y1:.1f} '
+            'L{x1:.1f},{y1b:.1f} C{xm:.1f},{y1b:.1f} {xm:.1f},{y0b:.1f} {x0:.1f},{y0b:.1f} Z" fill="{color}" '
+            'fill-opacity="0.6"><title>{source} → {target} ({type}): {value}</title></path>'.format(
+                x0=x0, x1=x1, xm=xm, y0=y0, y1=y1, y0b=y0 + thickness, y1b=y1 + thickness, color=link.color,
+                source=link.source, target=link.target, type=link.type, value=link.value))
+
+    for i, column in enumerate(node_order):
+        elements.append('<text x="{:.1f}" y="{:.1f}" font-size="12" text-anchor="middle">{}</text>'.format(
+            margin + i * column_step + node_width / 2, margin - 10, zone_titles[i]))
+        for node in column:
+            node_height = max(node_values[node] * scale, 1)
+            elements.append('<rect x="{:.1f}" y="{:.1f}" width="{}" height="{:.1f}" fill="#333333"/>'.format(
+                node_x[node], node_y[node], node_width, node_height))
+            elements.append('<text x="{:.1f}" y="{:.1f}" font-size="10" dominant-baseline="middle">{}</text>'.format(
+                node_x[node] + node_width + 3, node_y[node] + node_height / 2, 'P' + node.split('Position')[-1]))
+
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="{}" height="{}" font-family="sans-serif">\n{}\n</svg>\n'
+            .format(width, height, '\n'.join(elements)))
+
+
+def make_sankey(data, name='opportunity1_sankey', min_count=0):
+    """Draw the flows of products through the positions of all zones, by Result_Type, to figures/<name>.svg.
+       The diagram is also written to <name>.json in the format of svg-sankey."""
+    zone_cols = get_zone_columns(data)
+    paths = get_paths(data, zone_cols)
+    links = get_links(paths, zone_cols, min_count=min_count)
+    node_order = [get_node_order(paths, zone_col) for zone_col in zone_cols]
+    zone_titles = [zone_col.replace('Position', '') for zone_col in zone_cols]
+
+    with open(name + '.json', 'w') as f:
         json.dump({
-            'nodes': get_nodes(paths, 1) + get_nodes(paths, 2) + get_nodes(paths, 3),
-            'groups': [
-                get_group(paths, 1),
-                get_group(paths, 2),
-                get_group(paths, 3),
-            ],
-            'links': [create_links(index, value, 1) for (index, value) in paths.iteritems()] +
-                     [create_links(index, value, 2) for (index, value) in paths.iteritems()],
+            'nodes': [node for zone_col in zone_cols for node in get_nodes(paths, zone_col)],
+            'groups': [{'id': title, 'title': title, 'nodes': order} for title, order in zip(zone_titles, node_order)],
+            'links': links.to_dict(orient='records'),
             'alignLinkTypes': True,
-            'order': [
-                [get_node_order(paths, 1)],
-                [get_node_order(paths, 2)],
-                [get_node_order(paths, 3)]
-            ]
+            'order': [[order] for order in node_order],
         }, f, indent=2)
 
-    # npm install  svg-sankey@0.1.1
-    # ./node_modules/.bin/svg-sankey ./opportunity1_sankey.json > figures/opportunity1_sankey.svg
-    # Remove order at the top of .svg file
+    os.makedirs('figures', exist_ok=True)
+    with open(os.path.join('figures', name + '.svg'), 'w', encoding='utf-8') as f:
+        f.write(render_svg(links, node_order, zone_titles))
+
+
+def add_arguments(parser):
+    parser.add_argument('--skus', nargs='+', help='Only draw products of these SKUs (default: all).')
+    parser.add_argument('--exclude-skus', nargs='+', default=[], help='Leave out products of these SKUs.')
+    parser.add_argument('--result-types', nargs='+', help='Only draw products with these Result_Type (default: all).')
+    parser.add_argument('--min-count', type=int, default=0, help='Leave out flows of fewer than this many products.')
+    parser.add_argument('--name', default='zone_paths_sankey', help='Write figures/<name>.svg and <name>.json.')
+
+
+def main(args):
+    cube = aggregate_cube.get_cube()
+    selected = ~cube.SKU.isin(args.exclude_skus)
+    if args.skus:
+        selected &= cube.SKU.isin(args.skus)
+    if args.result_types:
+        selected &= cube.Result_Type.isin(args.result_types)
+    make_sankey(cube[selected], args.name, args.min_count)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Draw the flows of products through the zone positions.')
+    add_arguments(parser)
+    main(parser.parse_args())